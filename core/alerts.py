@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .caching import bump_on_commit, inventory_namespace
+from .models import Inventory
+from .notifications import CommitBatch, notify
+
+# Références citées au plus dans une alerte groupée
+ALERT_LISTED_ITEMS = 5
+
+
+def low_stock_assignment(connection, new_stock):
+    """Fragment SET maintenant low_stock_since dans l'UPDATE qui modifie le stock.
+
+    `new_stock` est l'expression SQL du nouveau stock, évaluée sur l'ancienne
+    ligne. Le marqueur prend l'horodatage (paramètre) au passage sous le seuil,
+    le conserve tant que le stock y reste et s'efface au-dessus.
+    """
+    qn = connection.ops.quote_name
+    since = qn(Inventory._meta.get_field('low_stock_since').column)
+    threshold = qn(Inventory._meta.get_field('alert_threshold').column)
+    return f'{since} = CASE WHEN {new_stock} <= {threshold} THEN COALESCE({since}, %s) ELSE NULL END'
+
+
+def crossed_returning(connection):
+    """Expression RETURNING vraie si la ligne vient de passer sous le seuil (paramètre : même horodatage)."""
+    return f"{connection.ops.quote_name(Inventory._meta.get_field('low_stock_since').column)} = %s"
+
+
+class _AlertBatch(CommitBatch, set):
+    """Inventaires passés sous le seuil dans une transaction, signalés à la validation."""
+
+    def collect(self, items):
+        self.update(items)
+
+    def flush(self):
+        send_stock_alerts(self, using=self.using)
+
+
+def queue_stock_alerts(inventory_ids, using='default'):
+    """Met en file les alertes des inventaires ; rien n'est envoyé si la transaction est annulée."""
+    inventory_ids = set(inventory_ids)
+    if inventory_ids:
+        _AlertBatch.queue(inventory_ids, using=using)
+
+
+def _alert_message(items):
+    if len(items) == 1:
+        item = items[0]
+        return (
+            f"Stock bas : {item['product_format__product__name']} ({item['product_format__name']}) "
+            f"à {item['retail_point__name']}, {item['current_stock']} restant(s) "
+            f"pour un seuil de {item['alert_threshold']}"
+        )
+    listed = ', '.join(
+        f"{item['product_format__product__name']} ({item['product_format__name']})"
+        for item in items[:ALERT_LISTED_ITEMS]
+    )
+    more = f" et {len(items) - ALERT_LISTED_ITEMS} autre(s)" if len(items) > ALERT_LISTED_ITEMS else ''
+    return f"Stock bas : {len(items)} références sous le seuil d'alerte : {listed}{more}"
+
+
+def send_stock_alerts(inventory_ids, using='default'):
+    """Une notification STOCK_ALERT par propriétaire, tous points de vente confondus."""
+    rows = (
+        Inventory.objects.using(using).filter(pk__in=inventory_ids).order_by('retail_point_id', 'pk')
+        .values(
+            'pk', 'current_stock', 'alert_threshold', 'retail_point__owner_id', 'retail_point__name',
+            'product_format__name', 'product_format__product__name',
+        )
+    )
+    by_owner = defaultdict(list)
+    for row in rows:
+        by_owner[row['retail_point__owner_id']].append(row)
+    # Les notifications de tous les propriétaires partent en un seul lot
+    with transaction.atomic(using=using):
+        for owner_id, items in by_owner.items():
+            notify(
+                owner_id, 'STOCK_ALERT', _alert_message(items),
+                related_object_id=items[0]['pk'] if len(items) == 1 else None, using=using,
+            )
+    return len(by_owner)
+
+
+def sweep_low_stock(retail_point_ids=None, using=None):
+    """Rattrape les franchissements hors mouvements (seuil modifié, import, réparation).
+
+    Les inventaires sous le seuil sans marqueur sont lus par une requête couverte
+    par l'index partiel inventory_low_stock_idx, marqués puis signalés ; les
+    marqueurs d'inventaires repassés au-dessus du seuil sont effacés. Comme
+    pour un mouvement, last_updated avance et les listes d'inventaire en cache
+    des points de vente touchés sont invalidées à la validation.
+    Renvoie (inventaires signalés, marqueurs effacés).
+    """
+    using = using or router.db_for_write(Inventory)
+    inventories = Inventory.objects.using(using).select_for_update(of=('self',)).order_by('pk')
+    if retail_point_ids is not None:
+        inventories = inventories.filter(retail_point_id__in=retail_point_ids)
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        crossed = dict(
+            inventories.filter(current_stock__lte=F('alert_threshold'), low_stock_since__isnull=True)
+            .values_list('pk', 'retail_point_id')
+        )
+        if crossed:
+            Inventory.objects.using(using).filter(pk__in=crossed).update(low_stock_since=now, last_updated=Now())
+            queue_stock_alerts(crossed, using=using)
+        rearmed = dict(
+            inventories.filter(low_stock_since__isnull=False)
+            .exclude(current_stock__lte=F('alert_threshold'))
+            .values_list('pk', 'retail_point_id')
+        )
+        if rearmed:
+            Inventory.objects.using(using).filter(pk__in=rearmed).update(low_stock_since=None, last_updated=Now())
+        touched = {*crossed.values(), *rearmed.values()}
+        if touched:
+            bump_on_commit(map(inventory_namespace, touched), using=using)
+    return len(crossed), len(rearmed)
+
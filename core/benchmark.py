@@ -0,0 +1,199 @@
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from .models import (
+    Address, Category, Dashboard, Dispute, Inventory, Notification, Order, OrderItem,
+    Product, ProductFormat, ProductImage, Report, RetailPoint, StockCheckpoint, TokenTransaction, User,
+)
+from .rollups import rebuild_sales_rollups
+
+
+def unique_suffix():
+    return uuid.uuid4().hex[:10]
+
+
+def make_user(user_type, prefix='bench'):
+    suffix = unique_suffix()
+    return User.objects.create_user(
+        username=f'{prefix}-{user_type.lower()}-{suffix}',
+        email=f'{prefix}-{suffix}@example.com',
+        password='bench-password',
+        user_type=user_type,
+        phone_number='0000000000',
+    )
+
+
+def make_retail_point(owner, gps_coordinates='5.3600,-4.0083', region='Abidjan'):
+    address = Address.objects.create(
+        user=owner,
+        district='Lagunes',
+        region=region,
+        commune='Plateau',
+        street='Rue du commerce',
+        gps_coordinates=gps_coordinates,
+    )
+    return RetailPoint.objects.create(
+        owner=owner,
+        name=f'Boutique {owner.username}',
+        retail_point_type='boutique',
+        address=address,
+    )
+
+
+def make_formats(manufacturer, count, category=None, formats_per_product=1, price=Decimal('1000')):
+    """Crée `count` formats répartis sur des produits du fabricant."""
+    category = category or Category.objects.create(name=f'Bench {unique_suffix()}')
+    suffix = unique_suffix()
+    products = Product.objects.bulk_create([
+        Product(
+            name=f'Produit {i}',
+            description='Produit de benchmark',
+            category=category,
+            manufacturer=manufacturer,
+        )
+        for i in range(-(-count // formats_per_product))
+    ])
+    return ProductFormat.objects.bulk_create([
+        ProductFormat(
+            product=products[i // formats_per_product],
+            name=f'Format {i}',
+            sku=f'BENCH-{suffix}-{i}',
+            unit_of_measure='unit',
+            quantity_per_unit=1,
+            base_price=price,
+        )
+        for i in range(count)
+    ])
+
+
+def make_inventories(retail_point, formats, stock=Decimal('1000000')):
+    inventories = Inventory.objects.bulk_create([
+        Inventory(product_format=product_format, retail_point=retail_point, current_stock=stock)
+        for product_format in formats
+    ])
+    StockCheckpoint.objects.bulk_create([
+        StockCheckpoint(inventory=inventory, stock=stock) for inventory in inventories
+    ])
+    return inventories
+
+
+def seed_marketplace(size=12):
+    """Jeu de données réaliste : `size` lignes visibles par liste pour chaque profil.
+
+    Renvoie un dictionnaire des utilisateurs (par user_type, plus 'ADMIN') et des
+    objets de référence utilisés pour construire les URL de détail.
+    """
+    users = {user_type: make_user(user_type, prefix='seed') for user_type, _ in User.USER_TYPES}
+    admin = make_user('INDIVIDUAL', prefix='seed-admin')
+    admin.is_staff = admin.is_superuser = True
+    admin.save(update_fields=['is_staff', 'is_superuser'])
+    users['ADMIN'] = admin
+
+    for user in users.values():
+        addresses = [
+            Address(user=user, district='Lagunes', region=f'Region {i % 4}', commune='Cocody',
+                    street=f'Rue {i}', gps_coordinates=f'{5 + i / 100:.4f},{-4 - i / 100:.4f}')
+            for i in range(size)
+        ]
+        for address in addresses:
+            address.sync_coordinates()
+        Address.objects.bulk_create(addresses)
+
+    root = Category.objects.create(name='Alimentation')
+    categories = [root] + [
+        Category.objects.create(name=f'Rayon {i}', parent=root) for i in range(size - 1)
+    ]
+    manufacturer = users['MANUFACTURER']
+    products = Product.objects.bulk_create([
+        Product(name=f'Produit {i}', description='Description produit', manufacturer=manufacturer,
+                category=categories[i % len(categories)])
+        for i in range(size)
+    ])
+    formats = ProductFormat.objects.bulk_create([
+        ProductFormat(product=product, name=f'Format {j}', sku=f'SEED-{unique_suffix()}',
+                      barcode=f'{product.pk:08d}{j}', unit_of_measure='unit',
+                      quantity_per_unit=j + 1, base_price=Decimal('500') * (j + 1))
+        for product in products for j in range(2)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product_format.product, format=product_format,
+                     image='products/seed.jpg', is_default=True)
+        for product_format in formats
+    ])
+
+    retail_points = [
+        make_retail_point(users[user_type], gps_coordinates=f'{5.3 + i / 10:.4f},{-4.0 - i / 10:.4f}',
+                          region=f'Region {i}')
+        for i, user_type in enumerate(['RETAILER', 'WHOLESALER', 'SEMI_WHOLESALER'])
+    ]
+    inventories = [
+        inventory
+        for retail_point in retail_points
+        for inventory in make_inventories(retail_point, formats, stock=Decimal('10000'))
+    ]
+
+    buyers = [users['INDIVIDUAL'], users['RETAILER']]
+    orders = Order.objects.bulk_create([
+        Order(user=buyer, retail_point=retail_points[i % len(retail_points)],
+              order_number=f'SEED{unique_suffix()}', status='PENDING', total_amount=Decimal('1000'))
+        for buyer in buyers for i in range(size)
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, inventory=inventories[(n * 2 + j) % len(inventories)],
+                  quantity=1, unit_price=Decimal('500'), total_price=Decimal('500'))
+        for n, order in enumerate(orders) for j in range(2)
+    ])
+
+    for user in users.values():
+        Notification.objects.bulk_create([
+            Notification(user=user, notification_type='ORDER_UPDATE', message=f'Notification {i}',
+                         related_object_id=orders[i].pk)
+            for i in range(size)
+        ])
+        user.unread_notifications = size
+        User.objects.filter(pk=user.pk).update(unread_notifications=size)
+        TokenTransaction.objects.bulk_create([
+            TokenTransaction(user=user, transaction_type='DEPOSIT', amount=Decimal('100'))
+            for _ in range(size)
+        ])
+        Report.objects.bulk_create([
+            Report(created_by=user, report_type='SALES', title=f'Rapport {i}', format='CSV')
+            for i in range(size)
+        ])
+        Dashboard.objects.bulk_create([
+            Dashboard(user=user, name=f'Tableau {i}', widgets=[])
+            for i in range(size)
+        ])
+
+    disputes = Dispute.objects.bulk_create([
+        Dispute(created_by=users['INDIVIDUAL'], assigned_to=users['RETAILER'], order=orders[i],
+                dispute_type='ORDER', title=f'Litige {i}', description='Commande incomplète')
+        for i in range(size)
+    ])
+
+    # Commandes insérées en masse : agrégats de ventes reconstruits d'un bloc
+    rebuild_sales_rollups()
+
+    return {
+        'users': users,
+        'categories': categories,
+        'products': products,
+        'formats': formats,
+        'retail_points': retail_points,
+        'inventories': inventories,
+        'orders': orders,
+        'disputes': disputes,
+    }
+
+
+@contextmanager
+def timer():
+    """Mesure le temps écoulé ; `elapsed` est renseigné à la sortie du bloc."""
+    result = {'elapsed': 0.0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['elapsed'] = time.perf_counter() - start
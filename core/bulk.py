@@ -0,0 +1,171 @@
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .alerts import sweep_low_stock
+from .caching import CATALOG, bump_on_commit, inventory_namespace
+from .models import Category, Inventory, Product, ProductFormat, RetailPoint, StockCheckpoint, StockMovement
+from .search import schedule_refresh
+
+BULK_UPDATE_BATCH_SIZE = 500
+# Champs dont dépend le document de recherche du produit
+PRODUCT_SEARCH_FIELDS = {'name', 'description', 'category_id'}
+FORMAT_SEARCH_FIELDS = {'barcode'}
+
+
+def _apply_changes(model, items, using):
+    """Charge les cibles en une requête et n'écrit que les champs réellement modifiés.
+
+    Renvoie (résultat par id, objets modifiés par ensemble de champs).
+    """
+    fields = {field for item in items for field in item if field != 'id'}
+    targets = model.objects.using(using).only('pk', *fields).in_bulk([item['id'] for item in items])
+
+    results, groups = [], defaultdict(list)
+    for item in items:
+        target = targets.get(item['id'])
+        if target is None:
+            results.append({'id': item['id'], 'status': 'not_found'})
+            continue
+        changed = []
+        for field, value in item.items():
+            if field != 'id' and getattr(target, field) != value:
+                setattr(target, field, value)
+                changed.append(field)
+        results.append({'id': item['id'], 'status': 'updated' if changed else 'unchanged', 'fields': changed})
+        if changed:
+            groups[tuple(sorted(changed))].append(target)
+    return results, groups
+
+
+def _write(model, groups, using):
+    # bulk_update ignore auto_now : updated_at est fixé ici pour les ETag du catalogue
+    now = timezone.now()
+    for fields, objects in groups.items():
+        for target in objects:
+            target.updated_at = now
+        model.objects.using(using).bulk_update(objects, [*fields, 'updated_at'], batch_size=BULK_UPDATE_BATCH_SIZE)
+
+
+def bulk_update_catalog(products=(), formats=(), using=None):
+    """Met à jour produits et formats en quelques requêtes ; renvoie un résultat compact par id.
+
+    Les signaux ne sont pas émis par bulk_update : le cache du catalogue et les
+    documents de recherche concernés sont invalidés explicitement.
+    """
+    using = using or router.db_for_write(Product)
+    for label, items in (('products', products), ('formats', formats)):
+        ids = [item['id'] for item in items]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError({label: "Identifiant en double"})
+
+    categories = {item['category_id'] for item in products if item.get('category_id') is not None}
+    if categories:
+        missing = categories - set(Category.objects.using(using).filter(pk__in=categories).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError({'products': f"Catégories introuvables: {sorted(missing)}"})
+
+    with transaction.atomic(using=using):
+        product_results, product_groups = _apply_changes(Product, products, using)
+        format_results, format_groups = _apply_changes(ProductFormat, formats, using)
+        _write(Product, product_groups, using)
+        _write(ProductFormat, format_groups, using)
+
+        if product_groups or format_groups:
+            bump_on_commit([CATALOG], using=using)
+        refresh = {
+            target.pk for fields, objects in product_groups.items()
+            if PRODUCT_SEARCH_FIELDS & set(fields) for target in objects
+        }
+        format_ids = [
+            target.pk for fields, objects in format_groups.items()
+            if FORMAT_SEARCH_FIELDS & set(fields) for target in objects
+        ]
+        if format_ids:
+            refresh.update(
+                ProductFormat.objects.using(using).filter(pk__in=format_ids).values_list('product_id', flat=True)
+            )
+        if refresh:
+            schedule_refresh(refresh, using=using)
+    return {'products': product_results, 'formats': format_results}
+
+
+def upsert_inventories(rows, user, using=None):
+    """Crée ou met à jour des inventaires par (format, point de vente) ; renvoie (créés, mis à jour, erreurs).
+
+    Formats et points de vente sont vérifiés en deux requêtes ; si une ligne est
+    en erreur, rien n'est écrit et les erreurs sont rapportées par numéro de ligne.
+    Un stock modifié sur un inventaire existant est tracé par un ajustement.
+    """
+    using = using or router.db_for_write(Inventory)
+    formats = set(ProductFormat.objects.using(using).filter(
+        pk__in={row['product_format_id'] for row in rows}
+    ).values_list('pk', flat=True))
+    retail_points = RetailPoint.objects.using(using).filter(
+        pk__in={row['retail_point_id'] for row in rows}, is_active=True,
+    )
+    if not user.is_staff:
+        retail_points = retail_points.filter(owner=user)
+    retail_points = set(retail_points.values_list('pk', flat=True))
+
+    errors, seen = [], set()
+    for number, row in enumerate(rows, 1):
+        key = (row['product_format_id'], row['retail_point_id'])
+        row_errors = {}
+        if key[0] not in formats:
+            row_errors['product_format_id'] = "Format introuvable"
+        if key[1] not in retail_points:
+            row_errors['retail_point_id'] = "Point de vente introuvable"
+        if key in seen:
+            row_errors['non_field_errors'] = "Ligne en double"
+        seen.add(key)
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+    if errors:
+        return 0, 0, errors
+
+    with transaction.atomic(using=using):
+        existing = {
+            (format_id, retail_point_id): (pk, stock)
+            for pk, format_id, retail_point_id, stock in Inventory.objects.using(using)
+            .select_for_update()
+            .filter(product_format_id__in={key[0] for key in seen}, retail_point_id__in={key[1] for key in seen})
+            .order_by('pk')
+            .values_list('pk', 'product_format_id', 'retail_point_id', 'current_stock')
+        }
+
+        groups = defaultdict(list)
+        for row in rows:
+            groups[tuple(sorted(field for field in row if not field.endswith('_id')))].append(Inventory(**row))
+        for fields, inventories in groups.items():
+            # last_updated est calculé par bulk_create mais n'est réécrit en conflit que s'il est listé
+            Inventory.objects.using(using).bulk_create(
+                inventories, batch_size=BULK_UPDATE_BATCH_SIZE, update_conflicts=True,
+                unique_fields=['product_format', 'retail_point'], update_fields=[*fields, 'last_updated'],
+            )
+
+        inventories = [inventory for group in groups.values() for inventory in group]
+        created = [
+            inventory for inventory in inventories
+            if (inventory.product_format_id, inventory.retail_point_id) not in existing
+        ]
+        StockCheckpoint.objects.using(using).bulk_create(
+            [StockCheckpoint(inventory_id=inventory.pk, stock=inventory.current_stock) for inventory in created],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+        adjusted = [
+            StockMovement(
+                inventory_id=existing[key][0], movement_type='ADJ', quantity=row['current_stock'],
+                reference='Import inventaire', created_by=user,
+            )
+            for row in rows if 'current_stock' in row
+            for key in [(row['product_format_id'], row['retail_point_id'])]
+            if key in existing and existing[key][1] != row['current_stock']
+        ]
+        StockMovement.objects.using(using).bulk_create(adjusted, batch_size=BULK_UPDATE_BATCH_SIZE)
+        bump_on_commit(map(inventory_namespace, {key[1] for key in seen}), using=using)
+        # bulk_create contourne les UPDATE de stock : les seuils sont vérifiés ici
+        sweep_low_stock({key[1] for key in seen}, using=using)
+    return len(created), len(rows) - len(created), []
@@ -0,0 +1,112 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+DEFAULT_TIMEOUT = 300
+# Après expiration « douce », la valeur reste servie pendant qu'un seul processus la recalcule
+STALE_GRACE = 60
+LOCK_TIMEOUT = 10
+WAIT_STEP, WAIT_MAX = 0.05, 2.0
+
+CATALOG = 'catalog'
+
+
+def inventory_namespace(retail_point_id):
+    return f'inventory:{retail_point_id}'
+
+
+# --- Versions : invalider un espace de noms revient à incrémenter sa version ---
+
+def version(namespace):
+    return cache.get_or_set(f'{namespace}:version', 1, timeout=None)
+
+
+def bump(namespace):
+    # Les anciennes clés ne sont pas supprimées : elles deviennent inaccessibles et expirent
+    try:
+        cache.incr(f'{namespace}:version')
+    except ValueError:
+        cache.set(f'{namespace}:version', 2, timeout=None)
+
+
+def bump_on_commit(namespaces, using='default'):
+    namespaces = set(namespaces)
+    transaction.on_commit(lambda: [bump(namespace) for namespace in namespaces], using=using)
+
+
+def versioned_key(namespaces, *parts):
+    if isinstance(namespaces, str):
+        namespaces = [namespaces]
+    versions = '.'.join(f'{namespace}@{version(namespace)}' for namespace in namespaces)
+    return ':'.join([versions, *map(str, parts)])
+
+
+# --- Lecture avec protection contre la ruée ---
+
+def get_or_build(key, build, timeout=DEFAULT_TIMEOUT):
+    """Renvoie la valeur en cache ou la calcule ; un seul appelant calcule une clé donnée.
+
+    Les autres reçoivent la valeur périmée s'il y en a une, sinon attendent
+    brièvement le résultat avant de calculer eux-mêmes en dernier recours.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry['expires'] > time.time():
+        return entry['value']
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = build()
+            cache.set(key, {'value': value, 'expires': time.time() + timeout}, timeout + STALE_GRACE)
+            return value
+        finally:
+            cache.delete(lock_key)
+    if entry is not None:
+        return entry['value']
+
+    deadline = time.monotonic() + WAIT_MAX
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    return build()
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class CachedResponseMixin:
+    """Met en cache la charge utile sérialisée des GET (liste paginée ou détail).
+
+    La clé dépend des versions des espaces de noms de la vue, du schéma et de
+    l'hôte (URLs absolues des images), du chemin et des paramètres de requête.
+    """
+
+    cache_namespaces = (CATALOG,)
+    cache_timeout = DEFAULT_TIMEOUT
+
+    def get_cache_namespaces(self):
+        return self.cache_namespaces
+
+    def get_cache_key(self, request):
+        query = '&'.join(sorted(request.GET.urlencode().split('&')))
+        return versioned_key(
+            self.get_cache_namespaces(), 'view', type(self).__name__, request.build_absolute_uri('/'), request.path, query
+        )
+
+    def get(self, request, *args, **kwargs):
+        def build():
+            response = super(CachedResponseMixin, self).get(request, *args, **kwargs)
+            if response.status_code != 200:
+                raise _Uncacheable(response)
+            return response.data
+
+        try:
+            return Response(get_or_build(self.get_cache_key(request), build, self.cache_timeout))
+        except _Uncacheable as exc:
+            return exc.response
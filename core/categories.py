@@ -0,0 +1,44 @@
+from django.db.models import Count
+
+from .caching import CATALOG, get_or_build, versioned_key
+from .models import Category, Product
+
+TREE_CACHE_TIMEOUT = 3600
+
+
+def build_category_tree():
+    """Arbre imbriqué des catégories ; `product_count` compte les produits actifs du sous-arbre."""
+    direct_counts = dict(
+        Product.objects.filter(is_active=True, category__isnull=False)
+        .values('category').annotate(total=Count('id')).values_list('category', 'total')
+    )
+    nodes, roots = {}, []
+    # Tri par profondeur : chaque parent est rencontré avant ses enfants
+    for pk, name, description, parent_id, depth in Category.objects.order_by('depth', 'name', 'pk').values_list(
+        'pk', 'name', 'description', 'parent_id', 'depth'
+    ):
+        node = {
+            'id': pk,
+            'name': name,
+            'description': description,
+            'depth': depth,
+            'product_count': direct_counts.get(pk, 0),
+            'children': [],
+        }
+        nodes[pk] = node
+        if parent_id in nodes:
+            nodes[parent_id]['children'].append(node)
+        else:
+            roots.append(node)
+
+    def total(node):
+        node['product_count'] += sum(total(child) for child in node['children'])
+        return node['product_count']
+
+    for root in roots:
+        total(root)
+    return roots
+
+
+def category_tree():
+    return get_or_build(versioned_key(CATALOG, 'category-tree'), build_category_tree, TREE_CACHE_TIMEOUT)
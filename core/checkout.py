@@ -0,0 +1,96 @@
+import secrets
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import CartItem, Inventory, Order, OrderItem, StockMovement
+from .rollups import record_order
+from .stock import decrement_many
+
+
+def generate_order_number():
+    return f"CMD{timezone.now():%Y%m%d}{secrets.token_hex(4).upper()}"
+
+
+def unit_price(inventory):
+    return inventory.price_override or inventory.product_format.base_price
+
+
+def checkout_cart(cart, user, **order_fields):
+    """Transforme le panier en commande avec un nombre fixe de requêtes.
+
+    Les inventaires sont verrouillés par id croissant (ordre déterministe, pas
+    d'interblocage entre deux paniers), les lignes et les mouvements sont insérés
+    en masse, le stock est décrémenté par un seul UPDATE et les agrégats de
+    ventes du jour sont incrémentés dans la même transaction.
+    """
+    lines = dict(cart.items.values_list('inventory_id', 'quantity'))
+    if not lines:
+        raise serializers.ValidationError("Le panier est vide")
+
+    with transaction.atomic():
+        inventories = list(
+            Inventory.objects.select_for_update(of=('self',))
+            .select_related('product_format')
+            # Dimensions des agrégats de ventes, lues avec le verrou
+            .annotate(
+                manufacturer_id=F('product_format__product__manufacturer_id'),
+                region=F('retail_point__address__region'),
+            )
+            .filter(pk__in=lines)
+            .order_by('pk')
+        )
+
+        errors = {}
+        for inventory in inventories:
+            if not inventory.is_available:
+                errors[inventory.pk] = "Produit indisponible"
+            elif inventory.current_stock < lines[inventory.pk]:
+                errors[inventory.pk] = f"Stock insuffisant. Stock actuel: {inventory.current_stock}"
+        if errors:
+            raise serializers.ValidationError({'items': errors})
+
+        total_amount = sum(
+            lines[inventory.pk] * unit_price(inventory) for inventory in inventories
+        )
+        order = Order.objects.create(**{
+            **order_fields,
+            'user': user,
+            'status': 'PENDING',
+            'order_number': generate_order_number(),
+            'total_amount': total_amount,
+        })
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                inventory=inventory,
+                quantity=lines[inventory.pk],
+                unit_price=unit_price(inventory),
+                total_price=lines[inventory.pk] * unit_price(inventory),
+            )
+            for inventory in inventories
+        ])
+        # bulk_create contourne StockMovement.save : le stock est décrémenté ci-dessous
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                inventory=inventory,
+                movement_type='OUT',
+                quantity=lines[inventory.pk],
+                reference=f"Commande #{order.order_number}",
+                created_by=user,
+            )
+            for inventory in inventories
+        ])
+        decrement_many({inventory.pk: lines[inventory.pk] for inventory in inventories})
+        record_order(order, [
+            (inventory.product_format_id, inventory.retail_point_id, inventory.manufacturer_id, inventory.region,
+             lines[inventory.pk], lines[inventory.pk] * unit_price(inventory))
+            for inventory in inventories
+        ])
+        CartItem.objects.filter(cart=cart).delete()
+
+    return order
+
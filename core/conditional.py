@@ -0,0 +1,81 @@
+import hashlib
+
+from django.db.models import Count, F, Func, Max, Subquery
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def _scalar(queryset, function, field):
+    """Sous-requête scalaire MAX/COUNT sur une seule table, évaluée une fois par la base."""
+    return Subquery(queryset.order_by().values(value=Func(F(field), function=function))[:1])
+
+
+class ConditionalGetMixin:
+    """Réponses 304 (ETag / Last-Modified) pour les GET de liste et de détail.
+
+    Les validateurs tiennent en une requête : max() des champs de
+    `conditional_fields` et nombre de lignes, plus ceux des relations de
+    `conditional_fields` et `conditional_counts` (données imbriquées,
+    suppressions). Chaque relation est agrégée sur sa propre table, restreinte
+    par la liste des clés du queryset filtré : les jointures ne multiplient pas
+    les lignes. Un 304 ne sérialise rien.
+    """
+
+    conditional_fields = ('updated_at',)
+    conditional_counts = ()
+
+    def get_conditional_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        if lookup in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup]})
+        return queryset
+
+    def related_rows(self, queryset, relation):
+        """Lignes de la relation `relation` (clé étrangère ou relation inverse) du queryset."""
+        field = queryset.model._meta.get_field(relation)
+        rows = field.related_model._base_manager.using(queryset.db)
+        if field.many_to_one:
+            return rows.filter(pk__in=queryset.values(relation))
+        return rows.filter(**{f'{field.field.name}__in': queryset.values('pk')})
+
+    def get_validators(self, request):
+        queryset = self.get_conditional_queryset().order_by()
+        aggregates = {'rows': Count('pk')}
+        for i, field in enumerate(self.conditional_fields):
+            relation, _, related_field = field.rpartition('__')
+            if relation:
+                # Sous-requête non corrélée : Max() ne fait que la remonter
+                aggregates[f'max_{i}'] = Max(_scalar(self.related_rows(queryset, relation), 'MAX', related_field))
+            else:
+                aggregates[f'max_{i}'] = Max(field)
+        for i, relation in enumerate(self.conditional_counts):
+            aggregates[f'count_{i}'] = Max(_scalar(self.related_rows(queryset, relation), 'COUNT', 'pk'))
+        values = (
+            queryset.model._base_manager.using(queryset.db)
+            .filter(pk__in=queryset.values('pk')).aggregate(**aggregates)
+        )
+
+        stamps = [value for key, value in values.items() if key.startswith('max_') and value is not None]
+        last_modified = int(max(stamps).timestamp()) if stamps else None
+        # La représentation dépend aussi de l'URL complète (page, hôte), du format et de l'utilisateur
+        fingerprint = '|'.join(map(str, [
+            type(self).__name__, request.build_absolute_uri(), request.accepted_media_type,
+            request.user.pk, *(values[key] for key in sorted(values)),
+        ]))
+        etag = f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+        return etag, last_modified
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        else:
+            response = not_modified
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'coresupply:events:'
+# Un client qui ne lit plus est déconnecté plutôt que de retenir la mémoire du processus
+SUBSCRIBER_QUEUE_SIZE = 256
+RECONNECT_DELAY = 1
+
+
+def user_channel(user_id):
+    return f'{CHANNEL_PREFIX}user:{user_id}'
+
+
+class Subscription:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Réveille le lecteur pour qu'il ferme le flux
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        if message is None and self.overflowed:
+            raise ConnectionResetError("Abonné trop lent")
+        return message
+
+
+class InMemoryBroker:
+    """Diffusion locale au processus ; sert aussi de relais aux abonnés d'un broker Redis."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+
+    async def start(self):
+        pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        await self.start()
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(channel)
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class RedisBroker(InMemoryBroker):
+    """Publication Redis ; un seul abonnement PSUBSCRIBE par processus, redistribué localement."""
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self._client = None
+        self._listener = None
+
+    def publish(self, channel, message):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(channel, message)
+
+    async def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio as redis
+
+        while True:
+            client = redis.Redis.from_url(self.url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+                    async for message in pubsub.listen():
+                        if message['type'] == 'pmessage':
+                            self.dispatch(message['channel'].decode(), message['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Abonnement Redis interrompu, reconnexion")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                await client.aclose()
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    url = getattr(settings, 'EVENT_BROKER_URL', 'memory://')
+    with _brokers_lock:
+        if url not in _brokers:
+            _brokers[url] = InMemoryBroker() if url.startswith('memory:') else RedisBroker(url)
+        return _brokers[url]
+
+
+def publish(user_id, event, data):
+    """Publie un événement vers les flux ouverts de l'utilisateur ; ne lève jamais."""
+    message = json.dumps({'event': event, 'data': data}, cls=DjangoJSONEncoder)
+    try:
+        get_broker().publish(user_channel(user_id), message)
+    except Exception:
+        logger.exception("Publication de l'événement %s impossible", event)
+
+
+def publish_on_commit(user_id, event, data, using='default'):
+    transaction.on_commit(lambda: publish(user_id, event, data), using=using)
+
+
+def notification_payload(notification):
+    return {
+        'id': notification.pk,
+        'notification_type': notification.notification_type,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'related_object_id': notification.related_object_id,
+        'created_at': notification.created_at,
+    }
@@ -0,0 +1,118 @@
+import csv
+from datetime import datetime
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .models import Order
+
+CHUNK_SIZE = 2000
+# Au-delà, le classeur en cours d'écriture bascule sur disque
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+# Morceaux (lignes CSV ou blocs de fichier) lus par passage dans le thread des vues sous ASGI
+ASYNC_BLOCK_PARTS = 256
+
+ORDER_COLUMNS = [
+    ('ID', 'id'),
+    ('Client', 'user__email'),
+    ('Montant', 'total_amount'),
+    ('Statut', 'status'),
+    ('Date', 'created_at'),
+]
+ITEM_COLUMNS = [
+    ('SKU', 'items__inventory__product_format__sku'),
+    ('Produit', 'items__inventory__product_format__product__name'),
+    ('Format', 'items__inventory__product_format__name'),
+    ('Quantité', 'items__quantity'),
+    ('Prix unitaire', 'items__unit_price'),
+    ('Total ligne', 'items__total_price'),
+]
+
+
+class BlockwiseAsyncMixin:
+    """Sert un itérateur synchrone au fil de l'eau sous ASGI.
+
+    StreamingHttpResponse.__aiter__ lit un itérateur synchrone en entier
+    (sync_to_async(list)) avant d'envoyer le premier octet : l'export serait
+    construit en mémoire. Ici, il est lu par blocs de ASYNC_BLOCK_PARTS
+    morceaux, dans le thread des vues qui détient le curseur serveur. Sous
+    WSGI, la réponse est itérée telle quelle.
+    """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in super().__aiter__():
+                yield part
+            return
+        parts = self.streaming_content
+        next_block = sync_to_async(lambda: list(islice(parts, ASYNC_BLOCK_PARTS)))
+        while block := await next_block():
+            for part in block:
+                yield part
+
+
+class StreamingExportResponse(BlockwiseAsyncMixin, StreamingHttpResponse):
+    pass
+
+
+class FileExportResponse(BlockwiseAsyncMixin, FileResponse):
+    pass
+
+
+class Echo:
+    """Pseudo-tampon : csv.writer renvoie chaque ligne au lieu de la stocker."""
+
+    def write(self, value):
+        return value
+
+
+def order_export(queryset, with_items=False, chunk_size=CHUNK_SIZE):
+    """Renvoie (en-tête, lignes) ; les lignes sont lues par blocs via un curseur serveur.
+
+    Avec `with_items`, une ligne est produite par article de commande (jointure
+    externe : les commandes sans article restent présentes).
+    """
+    columns = ORDER_COLUMNS + (ITEM_COLUMNS if with_items else [])
+    header = [label for label, _ in columns]
+    fields = [field for _, field in columns]
+    ordering = ['pk', 'items__pk'] if with_items else ['pk']
+    status_labels = dict(Order.ORDER_STATUS)
+    status_index = fields.index('status')
+
+    def rows():
+        values = queryset.order_by(*ordering).values_list(*fields)
+        for row in values.iterator(chunk_size=chunk_size):
+            row = list(row)
+            row[status_index] = status_labels.get(row[status_index], row[status_index])
+            yield row
+
+    return header, rows()
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(header, rows, title='Commandes'):
+    """Écrit un classeur en mode write-only dans un fichier temporaire et le renvoie rembobiné."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        # Excel ne gère pas les fuseaux horaires
+        sheet.append([
+            timezone.make_naive(value) if isinstance(value, datetime) and timezone.is_aware(value) else value
+            for value in row
+        ])
+
+    output = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -1,5 +1,5 @@
 import django_filters
-from .models import Order
+from .models import Category, Order, Product
 
 class OrderFilter(django_filters.FilterSet):
     date_range = django_filters.DateFromToRangeFilter(field_name='created_at')
@@ -7,4 +7,19 @@ class OrderFilter(django_filters.FilterSet):
 
     class Meta:
         model = Order
-        fields = ['status', 'user__user_type']
\ No newline at end of file
+        fields = ['status', 'user__user_type']
+
+
+class ProductFilter(django_filters.FilterSet):
+    category_subtree = django_filters.NumberFilter(method='filter_category_subtree')
+
+    class Meta:
+        model = Product
+        fields = ['category', 'manufacturer']
+
+    def filter_category_subtree(self, queryset, name, value):
+        # Préfixe constant : la recherche utilise l'index du chemin
+        path = Category.objects.filter(pk=value).values_list('path', flat=True).first()
+        if path is None:
+            return queryset.none()
+        return queryset.filter(category__path__startswith=path)
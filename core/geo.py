@@ -0,0 +1,158 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+DEFAULT_RADIUS_KM = 10
+MAX_RADIUS_KM = 500
+
+
+def parse_coordinates(value):
+    """Convertit une chaîne "lat,lng" en (lat, lng) ; None si absente ou invalide."""
+    if not value:
+        return None
+    try:
+        lat, lng = (float(part.strip()) for part in str(value).split(','))
+    except ValueError:
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def parse_radius(value):
+    """Rayon de recherche en km ; None s'il n'est pas un nombre fini dans ]0, MAX_RADIUS_KM]."""
+    try:
+        radius = float(value)
+    except (TypeError, ValueError):
+        return None
+    # nan et inf échappent aux comparaisons : geohash_cells ne terminerait jamais
+    if not math.isfinite(radius) or not 0 < radius <= MAX_RADIUS_KM:
+        return None
+    return radius
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        interval, value = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def _cell_size_degrees(precision):
+    lng_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision - lng_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def _cell_size_km(precision, lat):
+    height, width = _cell_size_degrees(precision)
+    return height * KM_PER_DEGREE, width * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+
+
+def bounding_box(lat, lng, radius_km):
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return max(lat - dlat, -90), min(lat + dlat, 90), max(lng - dlng, -180), min(lng + dlng, 180)
+
+
+def geohash_cells(lat, lng, radius_km):
+    """Préfixes geohash couvrant le cercle ; vide si le rayon dépasse les plus grandes cellules.
+
+    La précision retenue est la plus fine dont les cellules sont au moins aussi
+    grandes que le rayon : la zone est alors couverte par 9 cellules au plus.
+    """
+    if not (math.isfinite(lat) and math.isfinite(lng) and math.isfinite(radius_km) and radius_km > 0):
+        raise ValueError("Coordonnées et rayon finis attendus")
+    precision = 0
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        height, width = _cell_size_km(candidate, lat)
+        if min(height, width) < radius_km:
+            break
+        precision = candidate
+    if precision == 0:
+        return set()
+
+    # Échantillonnage de la boîte à la demi-cellule : chaque cellule touchée est vue
+    south, north, west, east = bounding_box(lat, lng, radius_km)
+    height, width = _cell_size_degrees(precision)
+    cells = set()
+    y = south
+    while True:
+        x = west
+        while True:
+            cells.add(encode_geohash(y, x, precision))
+            if x >= east:
+                break
+            x = min(x + width / 2, east)
+        if y >= north:
+            break
+        y = min(y + height / 2, north)
+    return cells
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_expression(lat_field, lng_field, lat, lng):
+    """Distance haversine (km) calculée par la base entre deux champs et un point."""
+    dphi = Radians(F(lat_field) - Value(lat, output_field=FloatField()))
+    dlambda = Radians(F(lng_field) - Value(lng, output_field=FloatField()))
+    a = Power(Sin(dphi / 2), 2) + (
+        Cos(Radians(Value(lat, output_field=FloatField()))) * Cos(Radians(F(lat_field))) * Power(Sin(dlambda / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(a))
+
+
+def proximity_filter(prefix, lat, lng, radius_km):
+    """Pré-filtre indexé (boîte englobante + cellules geohash) sur une adresse."""
+    south, north, west, east = bounding_box(lat, lng, radius_km)
+    condition = Q(**{
+        f'{prefix}latitude__range': (south, north),
+        f'{prefix}longitude__range': (west, east),
+    })
+    cells = Q()
+    for cell in geohash_cells(lat, lng, radius_km):
+        cells |= Q(**{f'{prefix}geohash__startswith': cell})
+    return condition & cells
+
+
+def nearby_retail_points(lat, lng, radius_km):
+    """{id: distance_km} des points de vente actifs dans le rayon, du plus proche au plus loin.
+
+    La base ne renvoie que les candidats de la boîte englobante ; la distance
+    exacte n'est calculée que sur eux.
+    """
+    from .models import RetailPoint
+
+    candidates = RetailPoint.objects.filter(
+        proximity_filter('address__', lat, lng, radius_km), is_active=True
+    ).values_list('pk', 'address__latitude', 'address__longitude')
+    distances = {}
+    for pk, point_lat, point_lng in candidates:
+        distance = haversine_km(lat, lng, point_lat, point_lng)
+        if distance <= radius_km:
+            distances[pk] = distance
+    return dict(sorted(distances.items(), key=lambda item: item[1]))
@@ -0,0 +1,186 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When, Window
+from rest_framework import serializers
+
+from .models import Order, TokenTransaction, User
+
+CREDIT_TYPES = ('DEPOSIT', 'REFUND')
+DEBIT_TYPES = ('WITHDRAWAL', 'ORDER_PAYMENT')
+CENT = Decimal('0.01')
+ORDER_TYPES = ('ORDER_PAYMENT', 'REFUND')
+# record() renseigne toujours balance_after : sans lui, l'écriture date d'avant le
+# journal, quand seuls dépôts et retraits modifiaient le solde
+LEGACY_ORDER_ENTRIES = Q(transaction_type__in=ORDER_TYPES, balance_after__isnull=True)
+# Seules les commandes en cours peuvent être payées
+PAYABLE_STATUSES = ('PENDING', 'CONFIRMED')
+
+
+class InsufficientBalance(serializers.ValidationError):
+    pass
+
+
+def signed_amount(transaction_type, amount):
+    amount = Decimal(str(amount))
+    if amount <= 0:
+        raise serializers.ValidationError("Le montant doit être positif")
+    if transaction_type in CREDIT_TYPES:
+        return amount
+    if transaction_type in DEBIT_TYPES:
+        return -amount
+    raise serializers.ValidationError(f"Type de transaction inconnu: {transaction_type}")
+
+
+def _balance_update_sql(connection, guarded):
+    qn = connection.ops.quote_name
+    table = qn(User._meta.db_table)
+    balance = qn(User._meta.get_field('token_balance').column)
+    pk = qn(User._meta.pk.column)
+    # Comme pour le stock : la garde anti-découvert est évaluée dans l'UPDATE lui-même
+    guard = f' AND {balance} + %s >= 0' if guarded else ''
+    return f'UPDATE {table} SET {balance} = {balance} + %s WHERE {pk} = %s{guard} RETURNING {balance}'
+
+
+def record(user_id, transaction_type, amount, reference=None, using=None):
+    """Applique une transaction au solde en un UPDATE conditionnel et l'inscrit au journal.
+
+    Le solde obtenu est conservé sur la ligne (balance_after). Lève
+    InsufficientBalance si un débit rendrait le solde négatif.
+    """
+    delta = signed_amount(transaction_type, amount)
+    using = using or router.db_for_write(TokenTransaction)
+    connection = connections[using]
+    sql = _balance_update_sql(connection, guarded=delta < 0)
+    params = [delta, user_id, delta] if delta < 0 else [delta, user_id]
+
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            if not User.objects.using(using).filter(pk=user_id).exists():
+                raise User.DoesNotExist(f"Utilisateur {user_id} introuvable")
+            raise InsufficientBalance("Solde insuffisant")
+        return TokenTransaction.objects.using(using).create(
+            user_id=user_id,
+            transaction_type=transaction_type,
+            amount=abs(delta),
+            reference=reference,
+            balance_after=User._meta.get_field('token_balance').to_python(row[0]),
+        )
+
+
+def pay_order(order, using=None):
+    """Débite le client du montant de la commande ; une commande n'est payée qu'une fois.
+
+    La commande est verrouillée le temps du paiement : une annulation concurrente
+    attend, puis rembourse. Seules les commandes en attente ou confirmées sont payables.
+    """
+    using = using or router.db_for_write(TokenTransaction)
+    try:
+        with transaction.atomic(using=using):
+            status = (
+                Order.objects.using(using).select_for_update()
+                .filter(pk=order.pk).values_list('status', flat=True).first()
+            )
+            if status not in PAYABLE_STATUSES:
+                raise serializers.ValidationError(f"La commande #{order.order_number} n'est pas payable")
+            return record(order.user_id, 'ORDER_PAYMENT', order.total_amount, order.order_number, using)
+    except IntegrityError:
+        raise serializers.ValidationError(f"La commande #{order.order_number} est déjà payée")
+
+
+def refund_order(order, using=None):
+    """Rembourse le paiement de la commande s'il existe ; sans effet sinon ou si déjà remboursée."""
+    payment = (
+        TokenTransaction.objects.using(using or router.db_for_read(TokenTransaction))
+        .filter(transaction_type='ORDER_PAYMENT', reference=order.order_number)
+        # Un paiement antérieur au journal n'a rien débité : rien à rendre
+        .exclude(LEGACY_ORDER_ENTRIES)
+        .values_list('user_id', 'amount')
+        .first()
+    )
+    if payment is None:
+        return None
+    try:
+        with transaction.atomic(using=using):
+            return record(payment[0], 'REFUND', payment[1], order.order_number, using)
+    except IntegrityError:
+        return None
+
+
+def _write_snapshots(snapshots, using, chunk_size):
+    """Réécrit balance_after par UPDATE joint à une liste (pk, solde), bloc par bloc."""
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(TokenTransaction._meta.db_table)
+    balance_after = qn(TokenTransaction._meta.get_field('balance_after').column)
+    pk = qn(TokenTransaction._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(snapshots), chunk_size):
+            chunk = snapshots[start:start + chunk_size]
+            rows = ', '.join(['(%s, %s)'] * len(chunk))
+            cursor.execute(
+                f'WITH snapshot (id, balance) AS (VALUES {rows}) '
+                f'UPDATE {table} SET {balance_after} = snapshot.balance '
+                f'FROM snapshot WHERE {table}.{pk} = snapshot.id',
+                [value for row in chunk for value in row],
+            )
+
+
+def reconcile_balances(batch_size=500, fix=False, chunk_size=5000, using='default'):
+    """Recalcule soldes et balance_after depuis le journal, par lots d'utilisateurs verrouillés.
+
+    Les sommes cumulées sont calculées par la base (fonction de fenêtre) et lues
+    par blocs ; seules les lignes divergentes sont réécrites lorsque `fix` est vrai.
+    Les paiements et remboursements antérieurs au journal n'ont jamais modifié
+    les soldes : ils restent neutres et sans instantané.
+    """
+    signed = Case(
+        When(LEGACY_ORDER_ENTRIES, then=Value(Decimal('0'))),
+        When(transaction_type__in=CREDIT_TYPES, then=F('amount')),
+        default=-F('amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    stats = {'users': 0, 'transactions': 0, 'balances': {}, 'snapshots': 0}
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            users = dict(
+                User.objects.using(using).select_for_update()
+                .filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'token_balance')[:batch_size]
+            )
+            if not users:
+                return stats
+            last_pk = max(users)
+            stats['users'] += len(users)
+
+            rows = (
+                TokenTransaction.objects.using(using).filter(user_id__in=users)
+                .annotate(running=Window(Sum(signed), partition_by=[F('user_id')], order_by=[F('id').asc()]))
+                .order_by('user_id', 'id')
+                .values_list('pk', 'user_id', 'transaction_type', 'balance_after', 'running')
+            )
+            expected = dict.fromkeys(users, Decimal('0.00'))
+            stale = []
+            for pk, user_id, transaction_type, balance_after, running in rows.iterator(chunk_size=chunk_size):
+                stats['transactions'] += 1
+                running = running.quantize(CENT)
+                expected[user_id] = running
+                if balance_after is None and transaction_type in ORDER_TYPES:
+                    continue
+                if balance_after != running:
+                    stale.append((pk, running))
+            drifted = {pk: total for pk, total in expected.items() if total != users[pk]}
+            stats['balances'].update((pk, (users[pk], total)) for pk, total in drifted.items())
+            stats['snapshots'] += len(stale)
+
+            if fix:
+                _write_snapshots(stale, using, chunk_size)
+                if drifted:
+                    User.objects.using(using).filter(pk__in=drifted).update(token_balance=Case(
+                        *[When(pk=pk, then=Value(total)) for pk, total in drifted.items()],
+                        output_field=DecimalField(max_digits=10, decimal_places=2),
+                    ))
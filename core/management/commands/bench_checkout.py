@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.benchmark import make_formats, make_inventories, make_retail_point, make_user, timer
+from core.checkout import checkout_cart
+from core.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = "Mesure la latence et le nombre de requêtes du passage de commande selon la taille du panier"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,100,250', help='Tailles de panier, séparées par des virgules')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--keep', action='store_true', help='Conserve les données créées')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        retailer = make_user('RETAILER')
+        manufacturer = make_user('MANUFACTURER')
+        buyer = make_user('INDIVIDUAL')
+        retail_point = make_retail_point(retailer)
+        formats = make_formats(manufacturer, max(sizes), formats_per_product=3)
+        inventories = make_inventories(retail_point, formats)
+        cart = Cart.objects.create(user=buyer)
+
+        try:
+            for size in sizes:
+                timings, queries = [], 0
+                for _ in range(options['repeat']):
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=cart, inventory=inventory, quantity=1)
+                        for inventory in inventories[:size]
+                    ])
+                    with CaptureQueriesContext(connection) as captured, timer() as elapsed:
+                        checkout_cart(cart, buyer)
+                    timings.append(elapsed['elapsed'])
+                    queries = len(captured)
+                self.stdout.write(
+                    f"{size:>5} lignes: {min(timings) * 1000:8.1f} ms (min), "
+                    f"{sum(timings) / len(timings) * 1000:8.1f} ms (moy), {queries} requêtes"
+                )
+        finally:
+            if not options['keep']:
+                category = formats[0].product.category
+                buyer.delete()
+                retailer.delete()
+                manufacturer.delete()
+                category.delete()
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.benchmark import make_user, timer
+from core.models import Notification
+from core.pagination import KeysetPagination
+from core.serializers import NotificationSerializer
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Compare la latence de la page 1 et d'une page profonde : OFFSET contre curseur"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=10000, help='Rang de la page profonde')
+        parser.add_argument('--page-size', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help='Conserve les données créées')
+
+    def seed(self, user, count):
+        for start in range(0, count, BATCH_SIZE):
+            Notification.objects.bulk_create([
+                Notification(user=user, notification_type='ORDER_UPDATE', message=f'Notification {start + i}')
+                for i in range(min(BATCH_SIZE, count - start))
+            ])
+
+    def measure(self, paginator, params, queryset):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(self.repeat):
+            request = Request(factory.get('/api/notifications/', params))
+            with timer() as elapsed:
+                page = paginator.paginate_queryset(queryset, request)
+                paginator.get_paginated_response(NotificationSerializer(page, many=True).data)
+            timings.append(elapsed['elapsed'] * 1000)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        page, page_size = options['page'], options['page_size']
+        user = make_user('INDIVIDUAL')
+        try:
+            with timer() as elapsed:
+                self.seed(user, page * page_size)
+            self.stdout.write(f"{page * page_size} notifications créées en {elapsed['elapsed']:.1f} s")
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE core_notification')
+            queryset = Notification.objects.filter(user=user).order_by('-created_at', '-id')
+
+            offset = PageNumberPagination()
+            offset.page_size = page_size
+            keyset = KeysetPagination()
+            keyset.page_size = page_size
+            # Curseur de la page profonde : dernière clé de la page précédente (hors mesure)
+            last = queryset[(page - 1) * page_size - 1]
+            cursor = keyset.encode_cursor([last.created_at, last.pk])
+
+            rows = [
+                ('OFFSET', self.measure(offset, {'page': 1}, queryset),
+                 self.measure(offset, {'page': page}, queryset)),
+                ('Curseur', self.measure(keyset, {}, queryset),
+                 self.measure(keyset, {'cursor': cursor}, queryset)),
+            ]
+            for label, first, deep in rows:
+                self.stdout.write(f"{label:>8}: page 1 {first:7.1f} ms, page {page} {deep:7.1f} ms")
+        finally:
+            if not options['keep']:
+                user.delete()
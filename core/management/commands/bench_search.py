@@ -0,0 +1,104 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.benchmark import make_user, timer, unique_suffix
+from core.models import Category, Product, ProductFormat
+from core.search import has_trigram, refresh_search_documents, search_products
+
+WORDS = [
+    'riz', 'huile', 'sucre', 'lait', 'savon', 'farine', 'sardine', 'tomate', 'biscuit', 'eau',
+    'jus', 'cafe', 'the', 'chocolat', 'pates', 'sel', 'poivre', 'mayonnaise', 'beurre', 'yaourt',
+]
+BRANDS = ['Dinor', 'Nido', 'Maggi', 'Gino', 'Bonnet Rouge', 'Awa', 'Nescafe', 'Lipton', 'Omo', 'Cadum']
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Mesure la latence (p50/p95) de la recherche produits sur un gros catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formats', type=int, default=1_000_000)
+        parser.add_argument('--formats-per-product', type=int, default=4)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=25)
+        parser.add_argument('--keep', action='store_true', help='Conserve les données créées')
+
+    def seed(self, manufacturer, category, count, per_product):
+        rng = random.Random(42)
+        suffix = unique_suffix()
+        product_ids = []
+        for start in range(0, count, BATCH_SIZE):
+            size = min(BATCH_SIZE, count - start)
+            products = Product.objects.bulk_create([
+                Product(
+                    name=f'{rng.choice(BRANDS)} {rng.choice(WORDS)} {rng.choice(WORDS)}',
+                    description=f'{rng.choice(WORDS)} de qualité, {rng.choice(WORDS)} et {rng.choice(WORDS)}',
+                    category=category,
+                    manufacturer=manufacturer,
+                )
+                for _ in range(-(-size // per_product))
+            ])
+            ProductFormat.objects.bulk_create([
+                ProductFormat(
+                    product=products[i // per_product],
+                    name=f'Format {i}',
+                    sku=f'SRCH-{suffix}-{start + i}',
+                    barcode=f'{rng.randrange(10 ** 12, 10 ** 13)}',
+                    unit_of_measure='unit',
+                    quantity_per_unit=1,
+                    base_price=1000,
+                )
+                for i in range(size)
+            ])
+            ids = [product.pk for product in products]
+            refresh_search_documents(ids)
+            product_ids.extend(ids)
+            self.stdout.write(f"  {start + size} formats créés", ending='\r')
+        self.stdout.write('')
+        return suffix
+
+    def handle(self, *args, **options):
+        manufacturer = make_user('MANUFACTURER')
+        category = Category.objects.create(name=f'Recherche {unique_suffix()}')
+        try:
+            with timer() as elapsed:
+                suffix = self.seed(manufacturer, category, options['formats'], options['formats_per_product'])
+            self.stdout.write(f"Catalogue: {options['formats']} formats en {elapsed['elapsed']:.1f} s")
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE core_productsearchdocument')
+            self.stdout.write(f"Base: {connection.vendor}, trigrammes: {'oui' if has_trigram() else 'non'}")
+
+            rng = random.Random(7)
+            queries = []
+            for _ in range(options['queries']):
+                kind = rng.randrange(4)
+                if kind == 0:
+                    queries.append(rng.choice(WORDS))
+                elif kind == 1:
+                    queries.append(f'{rng.choice(BRANDS)} {rng.choice(WORDS)}')
+                elif kind == 2:
+                    queries.append(f'SRCH-{suffix}-{rng.randrange(options["formats"])}')
+                else:
+                    word = rng.choice(WORDS + BRANDS)
+                    queries.append(word[:-1] if len(word) > 3 else word)
+
+            products = Product.objects.filter(is_active=True)
+            timings = []
+            for query in queries:
+                with timer() as elapsed:
+                    results = search_products(products, query)
+                    results.count()
+                    list(results.values_list('pk', flat=True)[:options['page_size']])
+                timings.append(elapsed['elapsed'] * 1000)
+
+            timings.sort()
+            p50 = timings[len(timings) // 2]
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(f"{len(timings)} requêtes: p50 {p50:.1f} ms, p95 {p95:.1f} ms, max {timings[-1]:.1f} ms")
+        finally:
+            if not options['keep']:
+                manufacturer.delete()
+                category.delete()
@@ -0,0 +1,88 @@
+import threading
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from core.benchmark import make_formats, make_inventories, make_retail_point, make_user, timer
+from core.models import Inventory, StockMovement
+from core.stock import InsufficientStock
+
+
+class Command(BaseCommand):
+    help = "Mesure le débit de mouvements de stock concurrents sur une seule ligne d'inventaire"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--movements', type=int, default=200, help='Mouvements par thread')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Compare avec la lecture-modification-écriture Python')
+        parser.add_argument('--keep', action='store_true', help='Conserve les données créées')
+
+    def handle(self, *args, **options):
+        retailer = make_user('RETAILER')
+        manufacturer = make_user('MANUFACTURER')
+        retail_point = make_retail_point(retailer)
+        product_format = make_formats(manufacturer, 1)[0]
+        initial = Decimal(options['threads'] * options['movements'])
+        inventory = make_inventories(retail_point, [product_format], stock=initial)[0]
+
+        try:
+            self.run('atomic', inventory, initial, options, self.atomic_movement)
+            if options['legacy']:
+                self.run('legacy', inventory, initial, options, self.legacy_movement)
+        finally:
+            if not options['keep']:
+                category = product_format.product.category
+                retailer.delete()
+                manufacturer.delete()
+                category.delete()
+
+    def atomic_movement(self, inventory_id, movement_type):
+        StockMovement.objects.create(inventory_id=inventory_id, movement_type=movement_type, quantity=1)
+
+    def legacy_movement(self, inventory_id, movement_type):
+        # Ancien comportement : lecture, calcul en Python, sauvegarde complète
+        inventory = Inventory.objects.get(pk=inventory_id)
+        inventory.current_stock += 1 if movement_type == 'IN' else -1
+        inventory.save()
+
+    def run(self, label, inventory, initial, options, movement):
+        Inventory.objects.filter(pk=inventory.pk).update(current_stock=initial)
+        rejected = []
+        errors = []
+
+        def worker(index):
+            try:
+                for i in range(options['movements']):
+                    # Deux sorties pour une entrée : la ligne reste très disputée
+                    movement_type = 'IN' if (index + i) % 3 == 0 else 'OUT'
+                    try:
+                        movement(inventory.pk, movement_type)
+                    except InsufficientStock:
+                        rejected.append(1)
+            except Exception as exc:  # remonté après la jointure des threads
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        with timer() as elapsed:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        close_old_connections()
+        if errors:
+            raise errors[0]
+
+        total = options['threads'] * options['movements']
+        ins = sum(1 for n in range(options['threads']) for i in range(options['movements']) if (n + i) % 3 == 0)
+        expected = initial + ins - (total - ins - len(rejected))
+        final = Inventory.objects.get(pk=inventory.pk).current_stock
+        self.stdout.write(
+            f"[{label}] {total} mouvements, {options['threads']} threads: "
+            f"{total / elapsed['elapsed']:.0f} mouvements/s, "
+            f"stock final {final} (attendu {expected}, écart {final - expected}), "
+            f"{len(rejected)} sorties rejetées"
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Report
+from core.reports import requeue_stale_reports, run_report
+
+
+class Command(BaseCommand):
+    help = "Calcule les rapports en attente (worker hors processus web ou reprise après redémarrage)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('report_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_reports()
+        if requeued:
+            self.stdout.write(f"{requeued} rapport(s) abandonné(s) remis en attente")
+        pending = Report.objects.filter(status='PENDING').order_by('created_at')
+        if options['report_ids']:
+            pending = pending.filter(pk__in=options['report_ids'])
+        for report_id in pending.values_list('pk', flat=True):
+            run_report(report_id)
+            report = Report.objects.get(pk=report_id)
+            self.stdout.write(f"Rapport {report_id}: {report.get_status_display()} {report.file.name or report.error}")
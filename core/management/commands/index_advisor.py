@@ -0,0 +1,148 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import EmptyResultSet
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.mixins import ListModelMixin
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import urls
+from core.pagination import KeysetPagination
+
+PAGE_SIZE = 25
+
+
+class Rollback(Exception):
+    pass
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+
+def plan_issues(plan):
+    """Parcours séquentiels filtrés et tris non couverts par un index.
+
+    L'EXPLAIN est fait avec enable_seqscan/enable_sort désactivés : un nœud qui
+    subsiste signifie qu'aucun index ne permet de l'éviter, quelle que soit la
+    taille actuelle des tables.
+    """
+    issues = []
+    for node in walk(plan):
+        if node['Node Type'] == 'Seq Scan' and 'Filter' in node:
+            issues.append(f"parcours séquentiel de {node['Relation Name']} (filtre {node['Filter']})")
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            issues.append(f"tri sans index ({', '.join(node['Sort Key'])})")
+    return issues
+
+
+class Command(BaseCommand):
+    help = "Passe les requêtes des vues de core/urls.py dans EXPLAIN et signale les parcours séquentiels et tris non indexés"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Nom d'utilisateur pour les vues authentifiées (défaut : premier administrateur)")
+        parser.add_argument('--route', action='append', help='Limite l\'analyse à ces noms de route')
+        parser.add_argument('--fail', action='store_true', help='Code de sortie non nul si un problème est trouvé')
+        parser.add_argument('--verbose-plans', action='store_true', help='Affiche les plans complets')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("L'analyse EXPLAIN nécessite PostgreSQL")
+        user = self.get_user(options['user'])
+
+        problems = 0
+        for name, pattern in self.routes(options['route']):
+            try:
+                queryset = self.view_queryset(pattern, user)
+                if queryset is None:
+                    continue
+                plan = self.explain(queryset)
+            except EmptyResultSet:
+                self.stdout.write(f"{name:40} aucune requête (résultat vide)")
+                continue
+            except Exception as exc:
+                self.stdout.write(f"{name:40} ignorée ({exc.__class__.__name__}: {exc})")
+                continue
+
+            issues = plan_issues(plan)
+            problems += len(issues)
+            if not issues:
+                self.stdout.write(self.style.SUCCESS(f"{name:40} OK"))
+            for issue in issues:
+                self.stdout.write(self.style.WARNING(f"{name:40} {issue}"))
+            if options['verbose_plans']:
+                self.stdout.write(json.dumps(plan, indent=2))
+
+        self.stdout.write(f"{problems} problème(s) détecté(s)")
+        if problems and options['fail']:
+            raise CommandError("Requêtes non couvertes par un index")
+
+    def get_user(self, username):
+        User = get_user_model()
+        if username:
+            return User.objects.get(username=username)
+        user = User.objects.filter(is_staff=True).order_by('pk').first()
+        if user is None:
+            raise CommandError("Aucun administrateur : précisez --user")
+        return user
+
+    def routes(self, only):
+        seen = set()
+        for pattern in urls.urlpatterns:
+            if 'format' in pattern.pattern.regex.groupindex or pattern.name in seen:
+                continue
+            seen.add(pattern.name)
+            if not only or pattern.name in only:
+                yield pattern.name, pattern
+
+    def view_queryset(self, pattern, user):
+        callback = pattern.callback
+        view_class = getattr(callback, 'cls', None)
+        if view_class is None or not hasattr(view_class, 'get_queryset'):
+            return None
+        actions = getattr(callback, 'actions', None)
+        if (actions is None and not hasattr(view_class, 'get')) or (actions is not None and 'get' not in actions):
+            return None
+
+        # Paramètres d'URL factices : seule la forme de la requête compte
+        kwargs = {key: 1 for key in pattern.pattern.regex.groupindex}
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=user)
+        view = view_class(**getattr(callback, 'initkwargs', {}))
+        if actions is not None:
+            view.action_map = actions
+            view.action = actions['get']
+        view.args, view.kwargs, view.format_kwarg = (), kwargs, None
+        view.request = view.initialize_request(request)
+        view.headers = {}
+
+        queryset = view.filter_queryset(view.get_queryset())
+        lookup = view.lookup_url_kwarg or view.lookup_field
+        if lookup in kwargs:
+            return queryset.filter(**{view.lookup_field: kwargs[lookup]})
+        if isinstance(view, ListModelMixin):
+            paginator = view.paginator
+            if isinstance(paginator, KeysetPagination):
+                queryset = queryset.order_by(*getattr(view, 'keyset_ordering', paginator.ordering))
+            queryset = queryset[:PAGE_SIZE]
+        return queryset
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        plan = None
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('SET LOCAL enable_sort = off')
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                    plan = cursor.fetchone()[0]
+                raise Rollback
+        except Rollback:
+            pass
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
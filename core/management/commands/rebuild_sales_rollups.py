@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import REBUILD_CHUNK_DAYS, rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les agrégats de ventes quotidiens (DailySales, DailyProductSales) depuis les commandes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Premier jour reconstruit (AAAA-MM-JJ)')
+        parser.add_argument('--chunk-days', type=int, default=REBUILD_CHUNK_DAYS, help='Jours par transaction')
+
+    def handle(self, *args, **options):
+        chunks = rebuild_sales_rollups(since=options['since'], chunk_days=options['chunk_days'])
+        self.stdout.write(f"{chunks} tranche(s) reconstruite(s)")
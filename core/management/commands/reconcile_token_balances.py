@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.ledger import reconcile_balances
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule les soldes de jetons et les balance_after depuis l'historique des transactions. "
+        "Un solde initial sans transaction apparaît comme un écart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Utilisateurs par lot')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Transactions lues par bloc')
+        parser.add_argument('--fix', action='store_true', help='Corrige les soldes et instantanés divergents')
+
+    def handle(self, *args, **options):
+        stats = reconcile_balances(
+            batch_size=options['batch_size'], fix=options['fix'], chunk_size=options['chunk_size'],
+        )
+        for pk, (stored, expected) in sorted(stats['balances'].items()):
+            self.stdout.write(f"Utilisateur {pk}: solde {stored}, attendu {expected}")
+        action = 'corrigés' if options['fix'] else 'à corriger'
+        self.stdout.write(
+            f"{stats['users']} utilisateurs, {stats['transactions']} transactions : "
+            f"{len(stats['balances'])} soldes et {stats['snapshots']} instantanés {action}"
+        )
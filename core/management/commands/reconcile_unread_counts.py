@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.notifications import RECONCILE_BATCH_SIZE, rebuild_unread_counts
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs de notifications non lues depuis Notification.is_read"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE, help='Utilisateurs par lot')
+
+    def handle(self, *args, **options):
+        fixed = rebuild_unread_counts(batch_size=options['batch_size'])
+        self.stdout.write(f"{fixed} compteurs corrigés")
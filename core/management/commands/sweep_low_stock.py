@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.alerts import sweep_low_stock
+
+
+class Command(BaseCommand):
+    help = "Signale les inventaires passés sous leur seuil d'alerte hors mouvements de stock (tâche planifiée)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retail-point', type=int, action='append', dest='retail_points',
+                            help='Limite le balayage à ces points de vente')
+
+    def handle(self, *args, **options):
+        alerted, rearmed = sweep_low_stock(options['retail_points'])
+        self.stdout.write(f"{alerted} inventaire(s) signalé(s), {rearmed} alerte(s) réarmée(s)")
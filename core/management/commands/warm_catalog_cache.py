@@ -0,0 +1,48 @@
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory
+
+from core.models import Product, RetailPoint
+
+
+class Command(BaseCommand):
+    help = "Préremplit le cache des vues du catalogue (à lancer après un déploiement)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url', action='append', dest='base_urls',
+            help="URL publique de l'API, ex. https://api.example.com (répétable ; défaut http://localhost)",
+        )
+        parser.add_argument('--pages', type=int, default=1, help='Pages préchargées par liste')
+        parser.add_argument('--max-products', type=int, default=1000, help='Fiches produit préchargées')
+
+    def targets(self, options):
+        """(chemin, paginé) pour chaque réponse à précharger."""
+        yield reverse('category-list'), True
+        yield reverse('product-format-list'), True
+        products = Product.objects.filter(is_active=True).order_by('-updated_at').values_list('pk', flat=True)
+        for pk in products[:options['max_products']]:
+            yield reverse('product-detail', kwargs={'pk': pk}), False
+        for pk in RetailPoint.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True):
+            yield reverse('retail-point-inventory', kwargs={'retail_point_id': pk}), True
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        for base_url in options['base_urls'] or ['http://localhost']:
+            url = urlsplit(base_url)
+            warmed = failed = 0
+            for path, paginated in self.targets(options):
+                match = resolve(path)
+                for page in range(1, options['pages'] + 1 if paginated else 2):
+                    params = {'page': page} if page > 1 else {}
+                    request = factory.get(path, params, secure=url.scheme == 'https', HTTP_HOST=url.netloc)
+                    response = match.func(request, *match.args, **match.kwargs)
+                    if response.status_code == 200:
+                        warmed += 1
+                    else:
+                        failed += 1
+                    if not paginated or not response.data.get('next'):
+                        break
+            self.stdout.write(f"{base_url}: {warmed} réponses en cache, {failed} en échec")
@@ -0,0 +1,124 @@
+import hashlib
+import math
+from collections import defaultdict
+
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Floor
+
+from .caching import get_or_build, versioned_key
+from .models import RetailPoint
+
+# Au-delà de ce zoom, les points sont renvoyés un par un
+CLUSTER_MAX_ZOOM = 15
+# Nombre de cellules de regroupement sur la largeur d'une tuile
+CELLS_PER_TILE = 8
+CLUSTER_CACHE_TIMEOUT = 24 * 3600
+NAMESPACE = 'map-clusters'
+
+
+def parse_bbox(value):
+    """Convertit "ouest,sud,est,nord" en tuple borné au globe ; None si invalide.
+
+    nan et inf sont refusés : math.floor les rejette dans clusters_in_bbox.
+    """
+    try:
+        bbox = tuple(float(part) for part in str(value).split(','))
+    except ValueError:
+        return None
+    if len(bbox) != 4 or not all(math.isfinite(part) for part in bbox):
+        return None
+    west, south, east, north = bbox
+    bbox = (
+        min(max(west, -180.0), 180.0), min(max(south, -90.0), 90.0),
+        min(max(east, -180.0), 180.0), min(max(north, -90.0), 90.0),
+    )
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return None
+    return bbox
+
+
+def cell_size(zoom):
+    return 360 / 2 ** zoom / CELLS_PER_TILE
+
+
+def active_points(region=None):
+    queryset = RetailPoint.objects.filter(
+        is_active=True, address__latitude__isnull=False, address__longitude__isnull=False
+    )
+    if region:
+        queryset = queryset.filter(address__region=region)
+    return queryset
+
+
+def build_cluster_grid(zoom, region=None):
+    """Agrège en base tous les points actifs par cellule de grille et par région."""
+    size = cell_size(zoom)
+    rows = (
+        active_points(region)
+        .annotate(
+            cell_y=Floor(F('address__latitude') / size, output_field=FloatField()),
+            cell_x=Floor(F('address__longitude') / size, output_field=FloatField()),
+        )
+        .values('cell_y', 'cell_x', 'address__region')
+        .annotate(count=Count('id'), lat_sum=Sum('address__latitude'), lng_sum=Sum('address__longitude'))
+    )
+
+    cells = defaultdict(lambda: {'count': 0, 'lat_sum': 0.0, 'lng_sum': 0.0, 'regions': {}})
+    for row in rows:
+        cell = cells[(int(row['cell_y']), int(row['cell_x']))]
+        cell['count'] += row['count']
+        cell['lat_sum'] += row['lat_sum']
+        cell['lng_sum'] += row['lng_sum']
+        cell['regions'][row['address__region']] = row['count']
+
+    return [
+        {
+            'cell': [y, x],
+            'count': cell['count'],
+            'lat': round(cell['lat_sum'] / cell['count'], 6),
+            'lng': round(cell['lng_sum'] / cell['count'], 6),
+            'regions': cell['regions'],
+        }
+        for (y, x), cell in sorted(cells.items())
+    ]
+
+
+def known_regions():
+    """Régions des points actifs géolocalisés, en cache avec les grappes."""
+    return get_or_build(
+        versioned_key(NAMESPACE, 'regions'),
+        lambda: sorted(set(active_points().values_list('address__region', flat=True))),
+        CLUSTER_CACHE_TIMEOUT,
+    )
+
+
+def region_key(region):
+    # Valeur libre du client : empreinte de longueur fixe, jamais le texte brut dans la clé
+    return hashlib.sha256(region.encode()).hexdigest() if region else '*'
+
+
+def cluster_grid(zoom, region=None):
+    # Région inconnue : rien à regrouper, et aucune clé créée à la demande du client
+    if region and region not in known_regions():
+        return []
+    key = versioned_key(NAMESPACE, f'z{zoom}', region_key(region))
+    return get_or_build(key, lambda: build_cluster_grid(zoom, region), CLUSTER_CACHE_TIMEOUT)
+
+
+def clusters_in_bbox(zoom, bbox, region=None):
+    size = cell_size(zoom)
+    west, south, east, north = bbox
+    y_min, y_max = math.floor(south / size), math.floor(north / size)
+    x_min, x_max = math.floor(west / size), math.floor(east / size)
+    return [
+        cluster for cluster in cluster_grid(zoom, region)
+        if y_min <= cluster['cell'][0] <= y_max and x_min <= cluster['cell'][1] <= x_max
+    ]
+
+
+def points_in_bbox(bbox, region=None):
+    west, south, east, north = bbox
+    return active_points(region).filter(
+        address__latitude__range=(south, north),
+        address__longitude__range=(west, east),
+    ).select_related('address').order_by('pk')
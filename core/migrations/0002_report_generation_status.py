@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='filters_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='status',
+            field=models.CharField(choices=[('DRAFT', 'Brouillon'), ('PENDING', 'En attente'), ('RUNNING', 'En cours'), ('DONE', 'Terminé'), ('FAILED', 'Échec')], default='DRAFT', max_length=10),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+from core.geo import encode_geohash, parse_coordinates
+
+
+def backfill_coordinates(apps, schema_editor):
+    Address = apps.get_model('core', 'Address')
+    batch = []
+    for address in Address.objects.exclude(gps_coordinates__isnull=True).exclude(gps_coordinates='').iterator(chunk_size=2000):
+        coordinates = parse_coordinates(address.gps_coordinates)
+        if coordinates is None:
+            continue
+        address.latitude, address.longitude = coordinates
+        address.geohash = encode_geohash(*coordinates)
+        batch.append(address)
+        if len(batch) >= 2000:
+            Address.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+            batch = []
+    Address.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_report_generation_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['latitude', 'longitude'], name='address_lat_lng_idx'),
+        ),
+        migrations.RunPython(backfill_coordinates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.3 on 2026-10-17 09:15
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    children = {}
+    for category in Category.objects.only('id', 'parent_id'):
+        children.setdefault(category.parent_id, []).append(category)
+
+    batch = []
+    level = [(category, '') for category in children.get(None, [])]
+    while level:
+        next_level = []
+        for category, parent_path in level:
+            category.path = f'{parent_path}{category.pk}/'
+            category.depth = category.path.count('/') - 1
+            batch.append(category)
+            next_level.extend((child, category.path) for child in children.get(category.pk, []))
+        level = next_level
+    Category.objects.bulk_update(batch, ['path', 'depth'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_address_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
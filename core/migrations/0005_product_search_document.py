@@ -0,0 +1,73 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:49
+
+from collections import defaultdict
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import DatabaseError, migrations, models, transaction
+
+from core.search import build_document, search_vector
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX core_productsearch_vector_gin ON core_productsearchdocument USING gin (vector)')
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:
+        # Extension indisponible : la recherche se limite au plein texte
+        return
+    schema_editor.execute(
+        'CREATE INDEX core_productsearch_title_trgm ON core_productsearchdocument USING gin (title gin_trgm_ops)'
+    )
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS core_productsearch_title_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS core_productsearch_vector_gin')
+
+
+def backfill_documents(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductFormat = apps.get_model('core', 'ProductFormat')
+    ProductSearchDocument = apps.get_model('core', 'ProductSearchDocument')
+
+    codes = defaultdict(list)
+    for product_id, sku, barcode in ProductFormat.objects.filter(is_active=True).values_list('product_id', 'sku', 'barcode'):
+        codes[product_id].extend(code for code in (sku, barcode) if code)
+    batch = []
+    rows = Product.objects.values_list('pk', 'name', 'description', 'category__name').iterator(chunk_size=2000)
+    for pk, name, description, category_name in rows:
+        title, body = build_document(name, description, category_name, codes[pk])
+        batch.append(ProductSearchDocument(product_id=pk, title=title, body=body))
+        if len(batch) >= 2000:
+            ProductSearchDocument.objects.bulk_create(batch)
+            batch = []
+    ProductSearchDocument.objects.bulk_create(batch)
+    if schema_editor.connection.vendor == 'postgresql':
+        ProductSearchDocument.objects.update(vector=search_vector())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='core.product')),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+        migrations.RunPython(backfill_documents, migrations.RunPython.noop),
+    ]
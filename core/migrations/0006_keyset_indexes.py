@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0005_product_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notif_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tokentransaction',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='tokentx_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-date_joined', '-id'], name='user_joined_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['retail_point', 'is_available'], name='inventory_rp_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('current_stock__gt', 0), ('is_available', True)), fields=['product_format', 'retail_point'], name='inventory_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notif_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='order_created_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'id'], name='product_active_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='product_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productformat',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['product', 'id'], name='format_active_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['inventory', '-created_at'], name='movement_inventory_date_idx'),
+        ),
+    ]
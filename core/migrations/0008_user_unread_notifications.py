@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:11
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counts(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    Notification = apps.get_model('core', 'Notification')
+    unread = (
+        Notification.objects.filter(user=OuterRef('pk'), is_read=False)
+        .values('user').annotate(total=Count('id')).values('total')
+    )
+    User.objects.filter(pk__in=Notification.objects.filter(is_read=False).values('user_id')).update(
+        unread_notifications=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
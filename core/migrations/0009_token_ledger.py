@@ -0,0 +1,60 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:20
+
+from django.core.management.base import CommandError
+from django.db import migrations, models
+from django.db.models import Count
+
+# Références citées au plus dans le message d'erreur
+LISTED_DUPLICATES = 20
+
+
+def check_duplicate_payments(apps, schema_editor):
+    """Refuse d'ajouter tokentx_order_once tant que des paiements ou remboursements sont en double.
+
+    Avant cette migration, l'API laissait les clients créer librement ces
+    écritures, sans effet sur les soldes (seuls dépôts et retraits les
+    modifiaient) ; reconcile_token_balances les tient pour neutres. Les
+    supprimer ou les fusionner en silence fausserait l'historique : la
+    correction est laissée à l'exploitation.
+    """
+    TokenTransaction = apps.get_model('core', 'TokenTransaction')
+    duplicates = list(
+        TokenTransaction.objects.using(schema_editor.connection.alias)
+        .filter(transaction_type__in=['ORDER_PAYMENT', 'REFUND'], reference__isnull=False)
+        .values('transaction_type', 'reference')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by('transaction_type', 'reference')
+    )
+    if not duplicates:
+        return
+    listed = '\n'.join(
+        f"  {row['transaction_type']} {row['reference']!r} : {row['count']} écritures"
+        for row in duplicates[:LISTED_DUPLICATES]
+    )
+    more = f"\n  ... et {len(duplicates) - LISTED_DUPLICATES} autre(s)" if len(duplicates) > LISTED_DUPLICATES else ''
+    raise CommandError(
+        f"{len(duplicates)} référence(s) de commande payées ou remboursées plusieurs fois :\n{listed}{more}\n"
+        "Supprimer ou requalifier les écritures en trop puis relancer migrate ; "
+        "reconcile_token_balances recalculera ensuite les soldes."
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_user_unread_notifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_payments, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='tokentransaction',
+            name='balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='tokentransaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('transaction_type__in', ['ORDER_PAYMENT', 'REFUND'])), fields=('transaction_type', 'reference'), name='tokentx_order_once'),
+        ),
+    ]
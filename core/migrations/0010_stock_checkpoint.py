@@ -0,0 +1,43 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def initial_checkpoints(apps, schema_editor):
+    # Le stock courant fait foi à la migration ; les contrôles partent de là
+    Inventory = apps.get_model('core', 'Inventory')
+    StockCheckpoint = apps.get_model('core', 'StockCheckpoint')
+    inventories = Inventory.objects.annotate(last_movement=Max('movements__id')).values_list(
+        'pk', 'current_stock', 'last_movement',
+    )
+    StockCheckpoint.objects.bulk_create(
+        (StockCheckpoint(inventory_id=pk, stock=stock, movement_id=last_movement or 0)
+         for pk, stock, last_movement in inventories.iterator(chunk_size=2000)),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_token_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('movement_id', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='core.inventory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['inventory', '-movement_id'], name='checkpoint_inventory_idx')],
+            },
+        ),
+        migrations.RunPython(initial_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-17 03:53
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def mark_low_stock(apps, schema_editor):
+    # Les stocks déjà bas sont considérés comme signalés : pas d'alerte en masse au déploiement
+    Inventory = apps.get_model('core', 'Inventory')
+    Inventory.objects.using(schema_editor.connection.alias).filter(
+        current_stock__lte=F('alert_threshold'),
+    ).update(low_stock_since=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_stock_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='low_stock_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('current_stock__lte', models.F('alert_threshold'))), fields=['retail_point'], name='inventory_low_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('low_stock_since__isnull', False)), fields=['retail_point'], name='inventory_low_stock_flag_idx'),
+        ),
+        migrations.RunPython(mark_low_stock, migrations.RunPython.noop),
+    ]
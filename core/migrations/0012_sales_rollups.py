@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-17 04:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_inventory_low_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('order_lines', models.IntegerField(default=0)),
+                ('units', models.DecimalField(decimal_places=3, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancelled_lines', models.IntegerField(default=0)),
+                ('cancelled_units', models.DecimalField(decimal_places=3, default=0, max_digits=14)),
+                ('cancelled_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('manufacturer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('product_format', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.productformat')),
+                ('retail_point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.retailpoint')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['manufacturer', 'day'], name='dailyproductsales_mfr_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product_format', 'retail_point'), name='dailyproductsales_day_format_rp_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancelled_orders', models.IntegerField(default=0)),
+                ('cancelled_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('retail_point', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.retailpoint')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['region', 'day'], name='dailysales_region_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'retail_point'), name='dailysales_day_rp_uniq'), models.UniqueConstraint(condition=models.Q(('retail_point__isnull', True)), fields=('day',), name='dailysales_day_no_rp_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+
+from .geo import encode_geohash, parse_coordinates
 
 class User(AbstractUser):
     USER_TYPES = (
@@ -14,6 +19,11 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=20)
     is_verified = models.BooleanField(default=False)
     token_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Compteur dénormalisé, tenu à jour par core.notifications
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [models.Index(fields=['-date_joined', '-id'], name='user_joined_keyset_idx')]
 
 class Address(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -22,8 +32,27 @@ class Address(models.Model):
     commune = models.CharField(max_length=100)
     street = models.CharField(max_length=255)
     gps_coordinates = models.CharField(max_length=50, blank=True, null=True)
+    # Dérivés de gps_coordinates à l'enregistrement, pour la recherche de proximité
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     is_primary = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [models.Index(fields=['latitude', 'longitude'], name='address_lat_lng_idx')]
+
+    def sync_coordinates(self):
+        coordinates = parse_coordinates(self.gps_coordinates)
+        self.latitude, self.longitude = coordinates or (None, None)
+        self.geohash = encode_geohash(*coordinates) if coordinates else ''
+
+    def save(self, *args, **kwargs):
+        self.sync_coordinates()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'gps_coordinates' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'latitude', 'longitude', 'geohash'}
+        super().save(*args, **kwargs)
+
 class RetailPoint(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
@@ -39,12 +68,52 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
+    # Chemin matérialisé "1/5/12/" : les descendants de X sont path__startswith=X.path
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or 'default'
+        with transaction.atomic(using=using):
+            categories = Category.objects.using(using)
+            # Chemins relus sous verrou : l'instance a pu être chargée avant le déplacement
+            # d'un ancêtre, son path et son depth en mémoire sont alors périmés
+            paths = dict(
+                categories.select_for_update().filter(pk__in=[pk for pk in (self.pk, self.parent_id) if pk])
+                .values_list('pk', 'path')
+            ) if self.pk or self.parent_id else {}
+            old_path = None if self._state.adding else paths.get(self.pk)
+            parent_path = paths.get(self.parent_id, '') if self.parent_id else ''
+            if old_path and parent_path.startswith(old_path):
+                raise ValidationError({'parent': "Une catégorie ne peut pas être placée sous elle-même"})
+            if old_path is not None:
+                self.path = f'{parent_path}{self.pk}/'
+                self.depth = self.path.count('/') - 1
+                update_fields = kwargs.get('update_fields')
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'path', 'depth'}
+            super().save(*args, **kwargs)
+
+            if old_path is None:
+                self.path = f'{parent_path}{self.pk}/'
+                self.depth = self.path.count('/') - 1
+                categories.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            elif self.path != old_path:
+                # Déplacement : tout le sous-arbre est réécrit en une requête
+                categories.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(models.Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=models.F('depth') + (self.depth - (old_path.count('/') - 1)),
+                )
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(path__startswith=self.path)
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
@@ -54,6 +123,13 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Catalogue public : seuls les produits actifs sont listés
+            models.Index(fields=['category', 'id'], condition=models.Q(is_active=True), name='product_active_category_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='product_active_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -69,9 +145,19 @@ class ProductFormat(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['product', 'id'], condition=models.Q(is_active=True), name='format_active_product_idx')]
+
     def __str__(self):
         return f"{self.product.name} - {self.name}"
 
+class ProductSearchDocument(models.Model):
+    # Document de recherche précalculé, rafraîchi à l'enregistrement (voir core/search.py)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    vector = SearchVectorField(null=True)
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     format = models.ForeignKey(ProductFormat, on_delete=models.CASCADE, null=True, blank=True)
@@ -90,10 +176,32 @@ class Inventory(models.Model):
     price_override = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     is_available = models.BooleanField(default=True)
     last_updated = models.DateTimeField(auto_now=True)
+    # Passage sous le seuil d'alerte, tenu à jour par les mouvements (core/alerts.py)
+    low_stock_since = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ('product_format', 'retail_point')
         verbose_name_plural = 'Inventories'
+        indexes = [
+            models.Index(fields=['retail_point', 'is_available'], name='inventory_rp_available_idx'),
+            # Recherche de proximité : références vendables uniquement
+            models.Index(
+                fields=['product_format', 'retail_point'],
+                condition=models.Q(is_available=True, current_stock__gt=0),
+                name='inventory_in_stock_idx',
+            ),
+            # Balayage des alertes de stock : seules les lignes concernées sont indexées
+            models.Index(
+                fields=['retail_point'],
+                condition=models.Q(current_stock__lte=models.F('alert_threshold')),
+                name='inventory_low_stock_idx',
+            ),
+            models.Index(
+                fields=['retail_point'],
+                condition=models.Q(low_stock_since__isnull=False),
+                name='inventory_low_stock_flag_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product_format} at {self.retail_point}"
@@ -114,24 +222,47 @@ class StockMovement(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['inventory', '-created_at'], name='movement_inventory_date_idx')]
+
     def __str__(self):
         return f"{self.get_movement_type_display()} of {self.quantity} for {self.inventory}"
 
     def save(self, *args, **kwargs):
-        # Mise à jour automatique du stock
-        super().save(*args, **kwargs)
-        self.update_inventory_stock()
+        # Mise à jour automatique du stock, uniquement à la création du mouvement
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get('using')):
+            self.update_inventory_stock(using=kwargs.get('using'))
+            super().save(*args, **kwargs)
+
+    def update_inventory_stock(self, using=None):
+        from .stock import apply_movement
+
+        new_stock = apply_movement(self.inventory_id, self.movement_type, self.quantity, using=using)
+        # Garde l'instance en cache cohérente sans relire la ligne
+        if StockMovement.inventory.is_cached(self):
+            self.inventory.current_stock = new_stock
+        return new_stock
+
+
+class StockCheckpoint(models.Model):
+    """Stock vérifié d'un inventaire, après le mouvement `movement_id` inclus.
+
+    Le stock à un instant donné vaut le dernier point de contrôle antérieur plus
+    les mouvements suivants (un ajustement repart de sa propre quantité).
+    """
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='checkpoints')
+    stock = models.DecimalField(max_digits=10, decimal_places=3)
+    # 0 : aucun mouvement n'est couvert (point de contrôle initial)
+    movement_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
 
-    def update_inventory_stock(self):
-        inventory = self.inventory
-        if self.movement_type == 'IN':
-            inventory.current_stock += self.quantity
-        elif self.movement_type == 'OUT':
-            inventory.current_stock -= self.quantity
-        elif self.movement_type == 'ADJ':
-            inventory.current_stock = self.quantity
-        
-        inventory.save()
+    class Meta:
+        indexes = [models.Index(fields=['inventory', '-movement_id'], name='checkpoint_inventory_idx')]
+
+    def __str__(self):
+        return f"{self.stock} for {self.inventory} at movement {self.movement_id}"
 
 
 class Cart(models.Model):
@@ -173,9 +304,28 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_keyset_idx'),
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['-created_at', '-id'], name='order_created_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Commande #{self.order_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Statut tel que lu en base : les transitions sont détectées sans relecture
+        instance._original_status = dict(zip(field_names, values)).get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Remboursement et agrégats de ventes (post_save) sont écrits dans la même transaction
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     inventory = models.ForeignKey(Inventory, on_delete=models.PROTECT)
@@ -191,6 +341,50 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class DailySales(models.Model):
+    """Commandes du jour par point de vente, tenues à jour par core/rollups.py."""
+    day = models.DateField()
+    retail_point = models.ForeignKey(RetailPoint, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    region = models.CharField(max_length=100, blank=True)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancelled_orders = models.IntegerField(default=0)
+    cancelled_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'retail_point'], name='dailysales_day_rp_uniq'),
+            # Commandes sans point de vente : une ligne par jour (NULL n'entre pas dans l'unicité ci-dessus)
+            models.UniqueConstraint(
+                fields=['day'], condition=models.Q(retail_point__isnull=True), name='dailysales_day_no_rp_uniq',
+            ),
+        ]
+        indexes = [models.Index(fields=['region', 'day'], name='dailysales_region_day_idx')]
+
+
+class DailyProductSales(models.Model):
+    """Lignes de commande du jour par format et point de vente, tenues à jour par core/rollups.py."""
+    day = models.DateField()
+    product_format = models.ForeignKey(ProductFormat, on_delete=models.CASCADE, related_name='+')
+    retail_point = models.ForeignKey(RetailPoint, on_delete=models.CASCADE, related_name='+')
+    manufacturer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    region = models.CharField(max_length=100, blank=True)
+    order_lines = models.IntegerField(default=0)
+    units = models.DecimalField(max_digits=14, decimal_places=3, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancelled_lines = models.IntegerField(default=0)
+    cancelled_units = models.DecimalField(max_digits=14, decimal_places=3, default=0)
+    cancelled_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'product_format', 'retail_point'], name='dailyproductsales_day_format_rp_uniq',
+            ),
+        ]
+        indexes = [models.Index(fields=['manufacturer', 'day'], name='dailyproductsales_mfr_day_idx')]
+
+
 class TokenTransaction(models.Model):
     TRANSACTION_TYPES = (
         ('DEPOSIT', 'Dépôt'),
@@ -203,8 +397,21 @@ class TokenTransaction(models.Model):
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     reference = models.CharField(max_length=100, blank=True, null=True)
+    # Solde du compte juste après la transaction (voir core.ledger)
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='tokentx_user_keyset_idx')]
+        constraints = [
+            # Un paiement et un remboursement au plus par commande
+            models.UniqueConstraint(
+                fields=['transaction_type', 'reference'],
+                condition=models.Q(transaction_type__in=['ORDER_PAYMENT', 'REFUND']),
+                name='tokentx_order_once',
+            ),
+        ]
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
         ('ORDER_UPDATE', 'Mise à jour commande'),
@@ -220,6 +427,12 @@ class Notification(models.Model):
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_keyset_idx'),
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_read=False), name='notif_user_unread_idx'),
+        ]
+
 
 class Dispute(models.Model):
     DISPUTE_TYPES = (
@@ -272,6 +485,14 @@ class Report(models.Model):
         ('CSV', 'CSV'),
     )
 
+    REPORT_STATUS = (
+        ('DRAFT', 'Brouillon'),
+        ('PENDING', 'En attente'),
+        ('RUNNING', 'En cours'),
+        ('DONE', 'Terminé'),
+        ('FAILED', 'Échec'),
+    )
+
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     report_type = models.CharField(max_length=20, choices=REPORT_TYPES)
     title = models.CharField(max_length=200)
@@ -279,6 +500,12 @@ class Report(models.Model):
     format = models.CharField(max_length=10, choices=REPORT_FORMATS, default='PDF')
     file = models.FileField(upload_to='reports/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=REPORT_STATUS, default='DRAFT')
+    progress = models.PositiveSmallIntegerField(default=0)  # en pourcentage
+    error = models.TextField(blank=True)
+    filters_hash = models.CharField(max_length=64, blank=True, db_index=True)  # déduplication
+    started_at = models.DateTimeField(null=True, blank=True)  # mise en file ou prise en charge
+    completed_at = models.DateTimeField(null=True, blank=True)
 
 class Dashboard(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
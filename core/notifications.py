@@ -0,0 +1,135 @@
+import weakref
+
+from asgiref.local import Local
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from .events import notification_payload, publish
+from .models import Notification, User
+
+RECONCILE_BATCH_SIZE = 1000
+# Lots en attente de validation (voir CommitBatch)
+_pending = Local()
+
+
+def adjust_unread(deltas, using='default'):
+    """Applique {user_id: delta} aux compteurs de non-lus en un seul UPDATE."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    delta = Case(
+        *[When(pk=user_id, then=Value(value)) for user_id, value in deltas.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+    User.objects.using(using).filter(pk__in=deltas).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, Value(0))
+    )
+
+
+class CommitBatch:
+    """Éléments d'une transaction, traités ensemble par un seul rappel on_commit.
+
+    Le lot en attente est retrouvé par une référence faible, par thread ou
+    contexte asynchrone comme les connexions : seul Django en garde une forte,
+    dans sa file on_commit. Une annulation (transaction ou point de sauvegarde)
+    l'en retire, la référence s'éteint et un nouveau lot commence. Le lot se
+    marque exécuté à l'appel et ne reçoit plus rien ensuite.
+    """
+
+    def __init__(self, using):
+        super().__init__()
+        self.using = using
+        self.executed = False
+
+    def __call__(self):
+        self.executed = True
+        self.flush()
+
+    def collect(self, items):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    @classmethod
+    def queue(cls, items, using='default'):
+        pending = getattr(_pending, 'batches', None)
+        if pending is None:
+            pending = _pending.batches = {}
+        ref = pending.get((cls, using))
+        batch = ref() if ref is not None else None
+        # Hors transaction, le rappel s'exécute aussitôt : aucun lot ne reste en attente
+        if batch is not None and not batch.executed and transaction.get_connection(using).in_atomic_block:
+            batch.collect(items)
+            return
+        batch = cls(using)
+        batch.collect(items)
+        pending[(cls, using)] = weakref.ref(batch)
+        transaction.on_commit(batch, using=using)
+
+
+class _Batch(CommitBatch, list):
+    """Notifications d'une transaction, écrites par un seul bulk_create à la validation."""
+
+    def collect(self, items):
+        self.extend(items)
+
+    def flush(self):
+        deltas = {}
+        for notification in self:
+            if not notification.is_read:
+                deltas[notification.user_id] = deltas.get(notification.user_id, 0) + 1
+        with transaction.atomic(using=self.using):
+            Notification.objects.using(self.using).bulk_create(self)
+            adjust_unread(deltas, using=self.using)
+        for notification in self:
+            publish(notification.user_id, 'notification', notification_payload(notification))
+
+
+def notify(user_id, notification_type, message, related_object_id=None, using='default'):
+    """Met une notification en file ; rien n'est écrit si la transaction est annulée."""
+    _Batch.queue([Notification(
+        user_id=user_id,
+        notification_type=notification_type,
+        message=message,
+        related_object_id=related_object_id,
+    )], using=using)
+
+
+def mark_read(user_id, ids=None, using='default'):
+    """Marque comme lues les notifications non lues de l'utilisateur ; renvoie leur nombre."""
+    queryset = Notification.objects.using(using).filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    with transaction.atomic(using=using):
+        updated = queryset.update(is_read=True)
+        adjust_unread({user_id: -updated}, using=using)
+    return updated
+
+
+def rebuild_unread_counts(batch_size=RECONCILE_BATCH_SIZE, using='default'):
+    """Recalcule les compteurs depuis Notification.is_read, par lots d'utilisateurs.
+
+    Les utilisateurs du lot sont verrouillés avant le comptage : une écriture
+    concurrente passe entièrement avant ou après. Renvoie le nombre de compteurs corrigés.
+    """
+    fixed = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            users = dict(
+                User.objects.using(using).select_for_update()
+                .filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'unread_notifications')[:batch_size]
+            )
+            if not users:
+                return fixed
+            counts = dict(
+                Notification.objects.using(using).filter(user_id__in=users, is_read=False)
+                .values('user_id').annotate(total=Count('id')).values_list('user_id', 'total')
+            )
+            deltas = {pk: counts.get(pk, 0) - stored for pk, stored in users.items()}
+            adjust_unread(deltas, using=using)
+            fixed += sum(1 for delta in deltas.values() if delta)
+            last_pk = max(users)
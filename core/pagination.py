@@ -0,0 +1,161 @@
+import base64
+import json
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _cursor_value(value):
+    # isoformat() complet : DjangoJSONEncoder tronque les microsecondes, la clé ne serait plus exacte
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class KeysetPagination(BasePagination):
+    """Pagination par curseur sur une clé stable, par défaut (-created_at, -id).
+
+    Le curseur est opaque (dernière clé vue et sens de lecture) : chaque page est
+    une recherche indexée, quel que soit son rang. Aucun COUNT(*) ; ?total=estimate
+    ajoute le total estimé par le planificateur.
+    La vue peut redéfinir la clé via `keyset_ordering` (le dernier champ doit être unique).
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+    invalid_cursor_message = "Curseur invalide"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.key = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+        self.total = None
+        if request.query_params.get(self.total_query_param) == 'estimate':
+            self.total = self.estimate_total(queryset)
+
+        ordering = [self._flip(field) for field in self.key] if reverse else list(self.key)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.total is not None:
+            payload['estimated_total'] = self.total
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'estimated_total': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.cursor_link(self.position_of(self.rows[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        return self.cursor_link(self.position_of(self.rows[0]), reverse=True)
+
+    # --- Curseur ---
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def position_of(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.key]
+
+    @staticmethod
+    def encode_cursor(position, reverse=False):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, default=_cursor_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def cursor_link(self, position, reverse):
+        url = remove_query_param(self.base_url, self.total_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            fields = [self.model._meta.get_field(field.lstrip('-')) for field in self.key]
+            if len(payload['p']) != len(fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(fields, payload['p'])]
+            return position, bool(payload['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def after(ordering, position):
+        """Comparaison lexicographique de la clé : (a, b) > (x, y) <=> a > x OU (a = x ET b > y).
+
+        La borne large a >= x, redondante, permet à la base de démarrer le parcours
+        d'index à la position du curseur au lieu de filtrer depuis le début.
+        """
+        condition = Q()
+        for i, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{field.lstrip("-")}__{lookup}': position[i]})
+            for previous, value in zip(ordering[:i], position):
+                clause &= Q(**{previous.lstrip('-'): value})
+            condition |= clause
+        first = ordering[0]
+        bound = Q(**{f'{first.lstrip("-")}__{"lte" if first.startswith("-") else "gte"}': position[0]})
+        return bound & condition
+
+    @staticmethod
+    def estimate_total(queryset):
+        queryset = queryset.order_by()
+        if connections[queryset.db].vendor == 'postgresql':
+            plan = json.loads(queryset.explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        # Pas d'estimateur exploitable ailleurs (SQLite en développement) : comptage exact
+        return queryset.count()
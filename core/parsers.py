@@ -0,0 +1,23 @@
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class CSVParser(BaseParser):
+    """Corps text/csv avec ligne d'en-tête : renvoie une liste de dictionnaires."""
+
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            reader = csv.DictReader(codecs.iterdecode(stream, encoding))
+            return [
+                {key.strip(): value.strip() for key, value in row.items() if key and value not in (None, '')}
+                for row in reader
+            ]
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise ParseError(f"CSV invalide: {exc}")
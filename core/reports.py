@@ -0,0 +1,407 @@
+import hashlib
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+
+from .exports import stream_csv, write_xlsx
+from .models import Dispute, Inventory, Order, OrderItem, Report, User
+
+logger = logging.getLogger(__name__)
+
+SELLER_TYPES = ('RETAILER', 'WHOLESALER', 'SEMI_WHOLESALER')
+PDF_LINES_PER_PAGE = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORT_WORKERS', 2),
+                thread_name_prefix='report',
+            )
+        return _executor
+
+
+# --- Déduplication ---
+
+def normalize_filters(filters):
+    normalized = {}
+    for key, value in sorted((filters or {}).items()):
+        if value in (None, '', [], {}):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(item) for item in value)
+        else:
+            value = str(value).strip()
+        normalized[str(key)] = value
+    return normalized
+
+
+FILTER_CHOICES = {'status': Order.ORDER_STATUS, 'user_type': User.USER_TYPES}
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value) if isinstance(value, str) else None
+    except ValueError:
+        return None
+
+
+def parse_filters(filters):
+    """Vérifie les filtres d'un rapport ; lève ValidationError (une entrée par filtre) s'ils sont inexploitables.
+
+    Un filtre invalide doit être refusé à la requête : dans le worker, il ferait
+    échouer le rapport (parse_date renvoie None pour une date mal formée).
+    """
+    if filters is None:
+        return {}
+    if not isinstance(filters, dict):
+        raise serializers.ValidationError("Objet attendu")
+    values = normalize_filters(filters)
+    errors = {}
+    for key, value in values.items():
+        if key in ('date_from', 'date_to'):
+            if _parse_day(value) is None:
+                errors[key] = "Date attendue (AAAA-MM-JJ)"
+        elif key in FILTER_CHOICES:
+            choices = dict(FILTER_CHOICES[key])
+            if value not in choices:
+                errors[key] = f"Valeurs possibles : {', '.join(choices)}"
+        elif key == 'retail_point':
+            if not (isinstance(value, str) and value.isdigit()):
+                errors[key] = "Identifiant de point de vente attendu"
+        else:
+            errors[key] = "Filtre inconnu"
+    if not errors and 'date_from' in values and 'date_to' in values:
+        if _parse_day(values['date_from']) > _parse_day(values['date_to']):
+            errors['date_to'] = "Doit suivre date_from"
+    if errors:
+        raise serializers.ValidationError(errors)
+    return filters
+
+
+def report_scope(user):
+    # Les données visibles dépendent du profil : seuls les administrateurs partagent un périmètre
+    return 'all' if user.is_staff else f'user:{user.pk}'
+
+
+def compute_filters_hash(report):
+    payload = {
+        'type': report.report_type,
+        'format': report.format,
+        'scope': report_scope(report.created_by),
+        'filters': normalize_filters(report.filters),
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    ).hexdigest()
+
+
+# --- Calcul des rapports (agrégats en base) ---
+
+def _date_range(queryset, field, filters):
+    if filters.get('date_from'):
+        queryset = queryset.filter(**{f'{field}__date__gte': parse_date(filters['date_from'])})
+    if filters.get('date_to'):
+        queryset = queryset.filter(**{f'{field}__date__lte': parse_date(filters['date_to'])})
+    return queryset
+
+
+def sales_report(user, filters):
+    items = OrderItem.objects.all()
+    if not user.is_staff:
+        if user.user_type in SELLER_TYPES:
+            items = items.filter(inventory__retail_point__owner=user)
+        elif user.user_type == 'MANUFACTURER':
+            items = items.filter(inventory__product_format__product__manufacturer=user)
+        else:
+            items = items.filter(order__user=user)
+
+    items = _date_range(items, 'order__created_at', filters)
+    if filters.get('status'):
+        items = items.filter(order__status=filters['status'])
+    if filters.get('retail_point'):
+        items = items.filter(inventory__retail_point_id=filters['retail_point'])
+
+    rows = (
+        items.annotate(day=TruncDate('order__created_at'))
+        .values('day')
+        .annotate(
+            orders=Count('order', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum('total_price'),
+            cancelled=Count('order', distinct=True, filter=Q(order__status='CANCELLED')),
+        )
+        .order_by('day')
+    )
+    header = ['Date', 'Commandes', 'Unités', "Chiffre d'affaires", 'Annulées']
+    return header, (
+        [row['day'], row['orders'], row['units'], row['revenue'], row['cancelled']] for row in rows
+    )
+
+
+def stock_report(user, filters):
+    inventories = Inventory.objects.all()
+    if not user.is_staff:
+        if user.user_type in SELLER_TYPES:
+            inventories = inventories.filter(retail_point__owner=user)
+        elif user.user_type == 'MANUFACTURER':
+            inventories = inventories.filter(product_format__product__manufacturer=user)
+        else:
+            inventories = inventories.filter(is_available=True)
+
+    if filters.get('retail_point'):
+        inventories = inventories.filter(retail_point_id=filters['retail_point'])
+
+    rows = (
+        inventories.values('retail_point_id', 'retail_point__name')
+        .annotate(
+            references=Count('id'),
+            stock=Sum('current_stock'),
+            below_threshold=Count('id', filter=Q(current_stock__lte=F('alert_threshold'))),
+            unavailable=Count('id', filter=Q(is_available=False)),
+        )
+        .order_by('retail_point__name', 'retail_point_id')
+    )
+    header = ['Point de vente', 'Références', 'Stock total', 'Sous le seuil', 'Indisponibles']
+    return header, (
+        [row['retail_point__name'], row['references'], row['stock'], row['below_threshold'], row['unavailable']]
+        for row in rows
+    )
+
+
+def disputes_report(user, filters):
+    disputes = Dispute.objects.all()
+    if not user.is_staff:
+        disputes = disputes.filter(Q(created_by=user) | Q(assigned_to=user))
+    disputes = _date_range(disputes, 'created_at', filters)
+
+    resolution = ExpressionWrapper(F('updated_at') - F('created_at'), output_field=DurationField())
+    rows = (
+        disputes.values('dispute_type', 'status')
+        .annotate(total=Count('id'), resolution=Avg(resolution, filter=Q(status='RESOLVED')))
+        .order_by('dispute_type', 'status')
+    )
+    types = dict(Dispute.DISPUTE_TYPES)
+    statuses = dict(Dispute.STATUS_CHOICES)
+    header = ['Type', 'Statut', 'Litiges', 'Résolution moyenne (h)']
+    return header, (
+        [
+            types.get(row['dispute_type'], row['dispute_type']),
+            statuses.get(row['status'], row['status']),
+            row['total'],
+            round(row['resolution'] / timedelta(hours=1), 1) if row['resolution'] else '',
+        ]
+        for row in rows
+    )
+
+
+def users_report(user, filters):
+    if not user.is_staff:
+        raise PermissionError("Rapport réservé aux administrateurs")
+    users = _date_range(User.objects.all(), 'date_joined', filters)
+    if filters.get('user_type'):
+        users = users.filter(user_type=filters['user_type'])
+
+    rows = (
+        users.values('user_type')
+        .annotate(
+            total=Count('id'),
+            verified=Count('id', filter=Q(is_verified=True)),
+            active=Count('id', filter=Q(is_active=True)),
+            tokens=Sum('token_balance'),
+        )
+        .order_by('user_type')
+    )
+    types = dict(User.USER_TYPES)
+    header = ['Profil', 'Utilisateurs', 'Vérifiés', 'Actifs', 'Solde de jetons']
+    return header, (
+        [types.get(row['user_type'], row['user_type']), row['total'], row['verified'], row['active'], row['tokens']]
+        for row in rows
+    )
+
+
+BUILDERS = {
+    'SALES': sales_report,
+    'STOCK': stock_report,
+    'DISPUTES': disputes_report,
+    'USER': users_report,
+}
+
+
+# --- Rendu ---
+
+def _cell(value):
+    return '' if value is None else str(value)
+
+
+def _pdf_text(value):
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def render_pdf(title, header, rows):
+    """PDF texte minimal (Helvetica, A4), sans dépendance externe."""
+    lines = [title, ''] + [' | '.join(header)] + [' | '.join(_cell(value) for value in row) for row in rows]
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # arbre des pages, complété une fois les pages connues
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    kids = []
+    for page in pages:
+        text = ' '.join(f'({_pdf_text(line)}) Tj T*' for line in page)
+        stream = f'BT /F1 9 Tf 12 TL 40 800 Td {text} ET'.encode('cp1252', 'replace')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        ' '.join(f'{kid} 0 R' for kid in kids).encode(), len(kids)
+    )
+
+    output = io.BytesIO()
+    output.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = output.tell()
+    output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b'%010d 00000 n \n' % offset)
+    output.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def render(report, header, rows):
+    if report.format == 'CSV':
+        return ''.join(stream_csv(header, rows)).encode('utf-8'), 'csv'
+    if report.format == 'EXCEL':
+        return write_xlsx(header, rows, title=report.get_report_type_display()[:31]).read(), 'xlsx'
+    return render_pdf(report.title, header, rows), 'pdf'
+
+
+# --- Orchestration ---
+
+ACTIVE_STATUSES = ('PENDING', 'RUNNING')
+
+def request_generation(report):
+    """Met le rapport en file d'attente, ou réutilise un résultat identique récent.
+
+    Renvoie True si un fichier existant a été réutilisé.
+    """
+    now = timezone.now()
+    report.filters_hash = compute_filters_hash(report)
+    report.error = ''
+    reuse_after = now - timedelta(seconds=getattr(settings, 'REPORT_REUSE_SECONDS', 3600))
+    recent = (
+        Report.objects.filter(filters_hash=report.filters_hash, status='DONE', completed_at__gte=reuse_after)
+        .exclude(pk=report.pk)
+        .exclude(file='')
+        .order_by('-completed_at')
+        .first()
+    )
+    if recent is not None:
+        report.file = recent.file.name
+        report.status, report.progress, report.completed_at = 'DONE', 100, now
+        report.save(update_fields=['filters_hash', 'error', 'file', 'status', 'progress', 'completed_at'])
+        return True
+
+    report.status, report.progress, report.started_at = 'PENDING', 0, now
+    report.save(update_fields=['filters_hash', 'error', 'status', 'progress', 'started_at'])
+    report_id = report.pk
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, report_id))
+    return False
+
+
+def _stale_before():
+    # Au-delà du verrou de calcul : un worker encore vivant l'aurait terminé ou relâché
+    return timezone.now() - timedelta(seconds=getattr(settings, 'REPORT_STALE_SECONDS', 1800))
+
+
+def is_stale(report):
+    """Vrai si le rapport est en file ou en cours depuis trop longtemps (worker arrêté en route)."""
+    return report.status in ACTIVE_STATUSES and (report.started_at is None or report.started_at < _stale_before())
+
+
+def requeue_stale_reports():
+    """Remet en attente les rapports abandonnés par leur worker ; renvoie leur nombre."""
+    return (
+        Report.objects.filter(status__in=ACTIVE_STATUSES)
+        .filter(Q(started_at__isnull=True) | Q(started_at__lt=_stale_before()))
+        .update(status='PENDING', progress=0, started_at=timezone.now())
+    )
+
+
+def _set_progress(report_id, progress):
+    Report.objects.filter(pk=report_id).update(progress=progress)
+
+
+def run_report(report_id):
+    """Calcule un rapport en attente ; les rapports identiques en attente reçoivent le même fichier."""
+    claimed = Report.objects.filter(pk=report_id, status='PENDING').update(
+        status='RUNNING', progress=5, started_at=timezone.now(),
+    )
+    if not claimed:
+        return
+    report = Report.objects.select_related('created_by').get(pk=report_id)
+    lock_key = f'report-lock:{report.filters_hash}'
+    if not cache.add(lock_key, report_id, timeout=getattr(settings, 'REPORT_LOCK_SECONDS', 900)):
+        # Calcul identique en cours : il complètera aussi ce rapport, sinon
+        # generate_reports le reprendra une fois périmé
+        Report.objects.filter(pk=report_id, status='RUNNING').update(
+            status='PENDING', progress=0, started_at=timezone.now(),
+        )
+        return
+
+    try:
+        report.refresh_from_db(fields=['status'])
+        if report.status != 'RUNNING':
+            return
+        header, rows = BUILDERS[report.report_type](report.created_by, normalize_filters(report.filters))
+        rows = list(rows)
+        _set_progress(report_id, 60)
+
+        content, extension = render(report, header, rows)
+        _set_progress(report_id, 90)
+        name = f'{report.report_type.lower()}-{report.filters_hash[:12]}.{extension}'
+        report.file.save(name, ContentFile(content), save=False)
+
+        Report.objects.filter(
+            Q(pk=report_id) | Q(filters_hash=report.filters_hash, status__in=['PENDING', 'RUNNING'])
+        ).update(status='DONE', progress=100, error='', file=report.file.name, completed_at=timezone.now())
+    except Exception as exc:
+        logger.exception("Échec de la génération du rapport %s", report_id)
+        Report.objects.filter(
+            Q(pk=report_id) | Q(filters_hash=report.filters_hash, status='PENDING')
+        ).update(status='FAILED', error=str(exc))
+    finally:
+        cache.delete(lock_key)
+
+
+def _run_in_worker(report_id):
+    try:
+        run_report(report_id)
+    finally:
+        connection.close()
@@ -0,0 +1,218 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, Order, OrderItem, RetailPoint
+
+# (modèle, clé, attributs fixés à la création de la ligne, mesures cumulées)
+ORDER_ROLLUP = (
+    DailySales, ('day', 'retail_point_id'), ('region',),
+    ('orders', 'revenue', 'cancelled_orders', 'cancelled_revenue'),
+)
+PRODUCT_ROLLUP = (
+    DailyProductSales, ('day', 'product_format_id', 'retail_point_id'), ('manufacturer_id', 'region'),
+    ('order_lines', 'units', 'revenue', 'cancelled_lines', 'cancelled_units', 'cancelled_revenue'),
+)
+REBUILD_CHUNK_DAYS = 31
+
+
+def _increment(rollup, rows, using):
+    """Ajoute les mesures aux lignes d'agrégat par INSERT ... ON CONFLICT DO UPDATE.
+
+    `rows` associe une clé à (attributs, mesures). Deux écritures concurrentes sur
+    la même journée s'additionnent dans la base, sans lecture préalable. Une clé
+    à NULL vise l'index unique partiel correspondant (une requête par motif).
+    """
+    model, keys, attributes, measures = rollup
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    column = {name: qn(model._meta.get_field(name).column) for name in (*keys, *attributes, *measures)}
+    columns = ', '.join(column[name] for name in (*keys, *attributes, *measures))
+    updates = ', '.join(f'{column[name]} = {table}.{column[name]} + EXCLUDED.{column[name]}' for name in measures)
+
+    patterns = defaultdict(list)
+    for key, (fixed, values) in rows.items():
+        patterns[tuple(value is None for value in key)].append(
+            (*key, *(fixed[name] for name in attributes), *(values[name] for name in measures))
+        )
+    with connection.cursor() as cursor:
+        for nulls, params in patterns.items():
+            target = ', '.join(column[name] for name, null in zip(keys, nulls) if not null)
+            predicate = ' AND '.join(f'{column[name]} IS NULL' for name, null in zip(keys, nulls) if null)
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(column)) + ')'] * len(params))
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {placeholders} '
+                f'ON CONFLICT ({target}){f" WHERE {predicate}" if predicate else ""} DO UPDATE SET {updates}',
+                [value for row in params for value in row],
+            )
+
+
+def _bucket(rows, key, fixed, **values):
+    if key not in rows:
+        rows[key] = (fixed, defaultdict(int))
+    for name, value in values.items():
+        rows[key][1][name] += value
+
+
+def order_lines(order_ids, using='default'):
+    """Lignes des commandes sous la forme attendue par record_order, en une requête."""
+    lines = defaultdict(list)
+    for row in (
+        OrderItem.objects.using(using).filter(order_id__in=order_ids)
+        .values_list(
+            'order_id', 'inventory__product_format_id', 'inventory__retail_point_id',
+            'inventory__product_format__product__manufacturer_id', 'inventory__retail_point__address__region',
+            'quantity', 'total_price',
+        )
+    ):
+        lines[row[0]].append(row[1:])
+    return lines
+
+
+def _apply(order, lines, region, created, cancelled, using):
+    day = timezone.localdate(order.created_at)
+    orders, products = {}, {}
+    total = order.total_amount
+    _bucket(
+        orders, (day, order.retail_point_id), {'region': region},
+        orders=created, revenue=created * total, cancelled_orders=cancelled, cancelled_revenue=cancelled * total,
+    )
+    for format_id, retail_point_id, manufacturer_id, line_region, quantity, price in lines:
+        _bucket(
+            products, (day, format_id, retail_point_id), {'manufacturer_id': manufacturer_id, 'region': line_region},
+            order_lines=created, units=created * quantity, revenue=created * price,
+            cancelled_lines=cancelled, cancelled_units=cancelled * quantity, cancelled_revenue=cancelled * price,
+        )
+    with transaction.atomic(using=using):
+        _increment(ORDER_ROLLUP, orders, using)
+        _increment(PRODUCT_ROLLUP, products, using)
+
+
+def _order_region(order, lines, using):
+    if order.retail_point_id is None:
+        return ''
+    # Commande passée dans un seul point de vente : la région est déjà connue par les lignes
+    for _, retail_point_id, _, region, _, _ in lines:
+        if retail_point_id == order.retail_point_id:
+            return region
+    return (
+        RetailPoint.objects.using(using).filter(pk=order.retail_point_id)
+        .values_list('address__region', flat=True).first() or ''
+    )
+
+
+def record_order(order, lines=None, using='default'):
+    """Ajoute une commande créée aux agrégats, dans la transaction de création.
+
+    `lines` contient (format, point de vente, fabricant, région, quantité,
+    montant) par ligne ; sans elle, les lignes sont relues en une requête.
+    """
+    lines = order_lines([order.pk], using)[order.pk] if lines is None else lines
+    cancelled = int(order.status == 'CANCELLED')
+    _apply(order, lines, _order_region(order, lines, using), 1, cancelled, using)
+
+
+def record_cancellation(order, cancelled=True, using='default'):
+    """Reporte l'annulation (ou sa levée) d'une commande sur les agrégats de son jour de création."""
+    lines = order_lines([order.pk], using)[order.pk]
+    _apply(order, lines, _order_region(order, lines, using), 0, 1 if cancelled else -1, using)
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _rebuild_days(start, end, using):
+    orders = Order.objects.using(using).filter(created_at__gte=_aware(start), created_at__lt=_aware(end))
+    cancelled = Q(status='CANCELLED')
+    DailySales.objects.using(using).bulk_create([
+        DailySales(**row) for row in orders
+        .values(
+            'retail_point_id', day=TruncDate('created_at'),
+            region=Coalesce(F('retail_point__address__region'), Value('')),
+        )
+        .annotate(
+            orders=Count('id'), revenue=Sum('total_amount'),
+            cancelled_orders=Count('id', filter=cancelled),
+            cancelled_revenue=Sum('total_amount', filter=cancelled, default=Decimal('0')),
+        )
+        .order_by()
+    ])
+    items = OrderItem.objects.using(using).filter(order__in=orders)
+    cancelled = Q(order__status='CANCELLED')
+    DailyProductSales.objects.using(using).bulk_create([
+        DailyProductSales(**row) for row in items
+        .values(
+            day=TruncDate('order__created_at'),
+            product_format_id=F('inventory__product_format_id'),
+            retail_point_id=F('inventory__retail_point_id'),
+            manufacturer_id=F('inventory__product_format__product__manufacturer_id'),
+            region=F('inventory__retail_point__address__region'),
+        )
+        .annotate(
+            order_lines=Count('id'), units=Sum('quantity'), revenue=Sum('total_price'),
+            cancelled_lines=Count('id', filter=cancelled),
+            cancelled_units=Sum('quantity', filter=cancelled, default=Decimal('0')),
+            cancelled_revenue=Sum('total_price', filter=cancelled, default=Decimal('0')),
+        )
+        .order_by()
+    ], batch_size=1000)
+
+
+def rebuild_sales_rollups(since=None, chunk_days=REBUILD_CHUNK_DAYS, using=None):
+    """Reconstruit les agrégats depuis les commandes, par tranches de `chunk_days` jours.
+
+    Chaque tranche est effacée puis recalculée dans sa propre transaction ; sous
+    PostgreSQL les tables d'agrégats y sont verrouillées en écriture, si bien
+    qu'une commande validée pendant la tranche est comptée une et une seule fois.
+    Renvoie le nombre de tranches traitées.
+    """
+    using = using or router.db_for_write(DailySales)
+    connection = connections[using]
+    first = Order.objects.using(using).aggregate(first=Min('created_at'))['first']
+    if first is None:
+        return 0
+    start = max(since, timezone.localdate(first)) if since else timezone.localdate(first)
+    end = timezone.localdate() + timedelta(days=1)
+    chunks = 0
+    while start < end:
+        stop = min(start + timedelta(days=chunk_days), end)
+        with transaction.atomic(using=using):
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('LOCK TABLE {}, {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                        connection.ops.quote_name(DailySales._meta.db_table),
+                        connection.ops.quote_name(DailyProductSales._meta.db_table),
+                    ))
+            DailySales.objects.using(using).filter(day__gte=start, day__lt=stop).delete()
+            DailyProductSales.objects.using(using).filter(day__gte=start, day__lt=stop).delete()
+            _rebuild_days(start, stop, using)
+        start = stop
+        chunks += 1
+    return chunks
+
+
+def sales_totals(rollups):
+    """Totaux d'un ensemble de lignes d'agrégat (DailySales ou DailyProductSales)."""
+    measures = ORDER_ROLLUP[3] if rollups.model is DailySales else PRODUCT_ROLLUP[3]
+    totals = rollups.aggregate(**{name: Sum(name, default=0) for name in measures})
+    totals['net_revenue'] = totals['revenue'] - totals['cancelled_revenue']
+    return totals
+
+
+def sales_breakdown(rollups, *fields, limit=None):
+    """Mesures groupées par `fields`, par chiffre d'affaires décroissant (ou par jour)."""
+    measures = ORDER_ROLLUP[3] if rollups.model is DailySales else PRODUCT_ROLLUP[3]
+    # Un alias d'annotation ne peut pas reprendre le nom d'un champ : renommage à la lecture
+    rows = rollups.values(*fields).annotate(**{f'total_{name}': Sum(name) for name in measures})
+    rows = rows.order_by('day') if fields == ('day',) else rows.order_by('-total_revenue', *fields)
+    return [
+        {**{field: row[field] for field in fields}, **{name: row[f'total_{name}'] for name in measures}}
+        for row in (rows[:limit] if limit else rows)
+    ]
@@ -0,0 +1,121 @@
+import unicodedata
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .models import Product, ProductFormat, ProductSearchDocument
+from .notifications import CommitBatch
+
+SEARCH_CONFIG = 'french'
+CHUNK_SIZE = 2000
+
+_trigram_available = {}
+
+
+def normalize(text):
+    """Minuscules, sans accents ni espaces superflus : même forme pour les documents et les requêtes."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).lower().split())
+
+
+def build_document(name, description, category_name, codes):
+    """(titre, corps) : nom et codes (SKU, code-barres) pèsent plus que catégorie et description."""
+    title = normalize(' '.join([name or '', *codes]))
+    body = normalize(' '.join([category_name or '', description or '']))
+    return title, body
+
+
+def search_vector():
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('body', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def has_trigram(using='default'):
+    if using not in _trigram_available:
+        connection = connections[using]
+        available = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                available = cursor.fetchone() is not None
+        _trigram_available[using] = available
+    return _trigram_available[using]
+
+
+def refresh_search_documents(product_ids, using='default'):
+    """Recalcule les documents des produits donnés, par lots ; les produits disparus sont ignorés."""
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        chunk = product_ids[start:start + CHUNK_SIZE]
+        codes = defaultdict(list)
+        formats = ProductFormat.objects.using(using).filter(product_id__in=chunk, is_active=True)
+        for product_id, sku, barcode in formats.values_list('product_id', 'sku', 'barcode'):
+            codes[product_id].extend(code for code in (sku, barcode) if code)
+
+        documents = [
+            ProductSearchDocument(product_id=pk, **dict(zip(('title', 'body'), build_document(
+                name, description, category_name, codes[pk]
+            ))))
+            for pk, name, description, category_name in Product.objects.using(using).filter(pk__in=chunk).values_list(
+                'pk', 'name', 'description', 'category__name'
+            )
+        ]
+        ProductSearchDocument.objects.using(using).bulk_create(
+            documents, update_conflicts=True, unique_fields=['product'], update_fields=['title', 'body'],
+        )
+        if connections[using].vendor == 'postgresql':
+            ProductSearchDocument.objects.using(using).filter(product_id__in=chunk).update(vector=search_vector())
+
+
+class _RefreshBatch(CommitBatch, set):
+    """Produits modifiés dans une transaction, recalculés en un seul passage à la validation."""
+
+    def collect(self, items):
+        self.update(items)
+
+    def flush(self):
+        refresh_search_documents(self, using=self.using)
+
+
+def schedule_refresh(product_ids, using='default'):
+    """Rafraîchit les documents à la validation de la transaction, en un seul passage.
+
+    Une suppression en cascade de N formats ne déclenche qu'un recalcul ; rien
+    n'est recalculé si la transaction est annulée.
+    """
+    product_ids = set(product_ids)
+    if product_ids:
+        _RefreshBatch.queue(product_ids, using=using)
+
+
+def search_products(queryset, query):
+    """Filtre et classe `queryset` (produits) par pertinence décroissante ; annote `search_rank`."""
+    terms = normalize(query)
+    if not terms:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(terms, search_type='websearch', config=SEARCH_CONFIG)
+        condition = Q(search_document__vector=search_query)
+        rank = SearchRank(F('search_document__vector'), search_query)
+        if has_trigram(queryset.db):
+            # Tolérance aux fautes de frappe sur le nom et les codes
+            condition |= Q(search_document__title__trigram_word_similar=terms)
+            rank = rank + TrigramWordSimilarity(terms, 'search_document__title')
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+    # Repli SQLite : tous les mots doivent apparaître, le titre compte double
+    condition, rank = Q(), Value(0)
+    for word in terms.split():
+        condition &= Q(search_document__title__contains=word) | Q(search_document__body__contains=word)
+        rank = rank + Case(
+            When(search_document__title__contains=word, then=Value(2)),
+            When(search_document__body__contains=word, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', 'pk')
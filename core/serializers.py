@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
+from django.db.models import Prefetch
 from .models import *
+from .reports import parse_filters
+from .widgets import parse_widgets
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -85,12 +88,27 @@ class ProductImageSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     formats = ProductFormatSerializer(many=True, read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
+    distance = serializers.SerializerMethodField()  # km, renseignée avec ?near=
     
     class Meta:
         model = Product
         fields = '__all__'
         read_only_fields = ('manufacturer',)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Un prefetch par relation imbriquée : le coût ne dépend ni de la taille de
+        # page ni du nombre de formats/images par produit. category et manufacturer
+        # sont rendus par clé primaire et ne nécessitent aucune jointure.
+        return queryset.prefetch_related(
+            Prefetch('formats', queryset=ProductFormat.objects.order_by('pk')),
+            Prefetch('images', queryset=ProductImage.objects.order_by('pk')),
+        )
+
+    def get_distance(self, obj):
+        distance = getattr(obj, 'distance', None)
+        return round(distance, 3) if distance is not None else None
+
     def validate(self, data):
         # Vérifier que l'utilisateur est un fabricant
         if self.context['request'].user.user_type != 'MANUFACTURER':
@@ -122,6 +140,15 @@ class InventorySerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('last_updated',)
 
+class InventoryUpsertRowSerializer(serializers.Serializer):
+    """Ligne d'un import d'inventaire : les références sont vérifiées en masse (voir core/bulk.py)."""
+    product_format_id = serializers.IntegerField(min_value=1)
+    retail_point_id = serializers.IntegerField(min_value=1)
+    current_stock = serializers.DecimalField(required=False, max_digits=10, decimal_places=3, min_value=0)
+    alert_threshold = serializers.DecimalField(required=False, max_digits=10, decimal_places=3, min_value=0)
+    price_override = serializers.DecimalField(required=False, allow_null=True, max_digits=10, decimal_places=2, min_value=0)
+    is_available = serializers.BooleanField(required=False)
+
 class StockMovementSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMovement
@@ -143,6 +170,25 @@ class StockMovementSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class StockMovementRowSerializer(serializers.Serializer):
+    """Ligne d'un lot de mouvements : validée sans requête, l'inventaire est résolu en masse."""
+    inventory = serializers.IntegerField(min_value=1)
+    movement_type = serializers.ChoiceField(choices=StockMovement.MOVEMENT_TYPES)
+    quantity = serializers.DecimalField(max_digits=10, decimal_places=3)
+    reference = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, data):
+        quantity = data['quantity']
+        if data['movement_type'] in ('IN', 'OUT') and quantity <= 0:
+            raise serializers.ValidationError({'quantity': "La quantité doit être positive"})
+        if data['movement_type'] == 'ADJ' and quantity < 0:
+            raise serializers.ValidationError({'quantity': "Le stock ajusté ne peut pas être négatif"})
+        if data['movement_type'] == 'TRF' and quantity == 0:
+            raise serializers.ValidationError({'quantity': "Un transfert porte une quantité non nulle"})
+        return data
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     inventory = InventorySerializer(read_only=True)
     inventory_id = serializers.PrimaryKeyRelatedField(
@@ -234,7 +280,13 @@ class ReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = Report
         fields = '__all__'
-        read_only_fields = ('created_by', 'created_at', 'file')
+        read_only_fields = (
+            'created_by', 'created_at', 'file', 'status', 'progress', 'error', 'filters_hash', 'started_at',
+            'completed_at',
+        )
+
+    def validate_filters(self, value):
+        return parse_filters(value)
 
 class DashboardSerializer(serializers.ModelSerializer):
     class Meta:
@@ -242,6 +294,9 @@ class DashboardSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('user', 'created_at', 'updated_at')
 
+    def validate_widgets(self, value):
+        return parse_widgets(value)
+
     def validate(self, data):
         if data.get('is_default', False):
             Dashboard.objects.filter(user=self.context['request'].user, is_default=True).update(is_default=False)
@@ -251,38 +306,25 @@ class DashboardSerializer(serializers.ModelSerializer):
 # core/serializers.py
 class BulkProductUpdateSerializer(serializers.Serializer):
     id = serializers.IntegerField()
-    name = serializers.CharField(required=False)
+    name = serializers.CharField(required=False, max_length=255)
+    description = serializers.CharField(required=False, allow_blank=True)
+    # Existence vérifiée en une requête pour tout le lot (voir core/bulk.py)
+    category = serializers.IntegerField(required=False, allow_null=True, source='category_id')
     is_active = serializers.BooleanField(required=False)
-    # Ajouter tous les champs modifiables
-
-class RetailPointMapSerializer(serializers.ModelSerializer):
-    lat = serializers.SerializerMethodField()
-    lng = serializers.SerializerMethodField()
-    region = serializers.CharField(source='address.region')
-
-    class Meta:
-        model = RetailPoint
-        fields = ['id', 'name', 'lat', 'lng', 'region']
-
-    def get_lat(self, obj):
-        coords = obj.address.gps_coordinates
-        return float(coords.split(',')[0].strip()) if coords else None
 
-    def get_lng(self, obj):
-        coords = obj.address.gps_coordinates
-        return float(coords.split(',')[1].strip()) if coords else None
 
+class BulkProductFormatUpdateSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField(required=False, max_length=100)
+    base_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2, min_value=0)
+    barcode = serializers.CharField(required=False, max_length=50, allow_blank=True, allow_null=True)
+    is_active = serializers.BooleanField(required=False)
 
 class RetailPointMapSerializer(serializers.ModelSerializer):
-    lat = serializers.SerializerMethodField()
-    lng = serializers.SerializerMethodField()
+    lat = serializers.FloatField(source='address.latitude', read_only=True)
+    lng = serializers.FloatField(source='address.longitude', read_only=True)
+    region = serializers.CharField(source='address.region', read_only=True)
 
     class Meta:
         model = RetailPoint
-        fields = ['id', 'name', 'lat', 'lng']
-
-    def get_lat(self, obj):
-        return obj.address.gps_coordinates.split(',')[0] if obj.address.gps_coordinates else None
-
-    def get_lng(self, obj):
-        return obj.address.gps_coordinates.split(',')[1] if obj.address.gps_coordinates else None
\ No newline at end of file
+        fields = ['id', 'name', 'lat', 'lng', 'region']
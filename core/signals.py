@@ -1,13 +1,92 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Order, Notification
+from .caching import CATALOG, bump_on_commit, inventory_namespace
+from .events import publish_on_commit
+from .ledger import refund_order
+from .maps import NAMESPACE as MAP_CLUSTERS
+from .models import (
+    Address, Category, Inventory, Order, Product, ProductFormat, ProductImage, RetailPoint, StockCheckpoint,
+)
+from .notifications import notify
+from .rollups import record_cancellation
+from .search import schedule_refresh
 
 @receiver(post_save, sender=Order)
-def create_order_notification(sender, instance, created, **kwargs):
-    if not created and instance.status != instance._original_status:
-        Notification.objects.create(
-            user=instance.user,
-            notification_type='ORDER_UPDATE',
-            message=f"Votre commande #{instance.order_number} est maintenant {instance.get_status_display()}",
-            related_object_id=instance.id
-        )
\ No newline at end of file
+def handle_order_status_change(sender, instance, created, using='default', **kwargs):
+    previous = getattr(instance, '_original_status', None)
+    instance._original_status = instance.status
+    if created or previous is None or previous == instance.status:
+        return
+    if instance.status == 'CANCELLED':
+        refund_order(instance, using=using)
+    if 'CANCELLED' in (previous, instance.status):
+        record_cancellation(instance, cancelled=instance.status == 'CANCELLED', using=using)
+    publish_on_commit(
+        instance.user_id, 'order_status',
+        {'order_id': instance.id, 'order_number': instance.order_number, 'status': instance.status},
+        using=using,
+    )
+    notify(
+        instance.user_id,
+        'ORDER_UPDATE',
+        f"Votre commande #{instance.order_number} est maintenant {instance.get_status_display()}",
+        related_object_id=instance.id,
+        using=using,
+    )
+
+
+@receiver(post_save, sender=Inventory)
+def create_initial_checkpoint(sender, instance, created, using='default', **kwargs):
+    # Le stock initial n'est porté par aucun mouvement : il sert de point de départ
+    if created:
+        StockCheckpoint.objects.using(using).create(inventory=instance, stock=instance.current_stock)
+
+
+@receiver(post_save, sender=RetailPoint)
+@receiver(post_delete, sender=RetailPoint)
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+def invalidate_map_clusters(sender, using='default', **kwargs):
+    bump_on_commit([MAP_CLUSTERS], using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductFormat)
+@receiver(post_delete, sender=ProductFormat)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog(sender, using='default', **kwargs):
+    bump_on_commit([CATALOG], using=using)
+
+
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidate_inventory(sender, instance, using='default', **kwargs):
+    bump_on_commit([inventory_namespace(instance.retail_point_id)], using=using)
+
+
+SEARCH_FIELDS = {'name', 'description', 'category'}
+
+
+# Documents de recherche recalculés à la validation : une suppression en cascade ne les recrée pas
+@receiver(post_save, sender=Product)
+def refresh_product_search(sender, instance, update_fields=None, using='default', **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    schedule_refresh([instance.pk], using=using)
+
+
+@receiver(post_save, sender=ProductFormat)
+@receiver(post_delete, sender=ProductFormat)
+def refresh_format_search(sender, instance, using='default', **kwargs):
+    schedule_refresh([instance.product_id], using=using)
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_search(sender, instance, created, using='default', **kwargs):
+    if not created:
+        products = Product.objects.using(using).filter(category=instance).values_list('pk', flat=True)
+        schedule_refresh(products, using=using)
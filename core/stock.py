@@ -0,0 +1,230 @@
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from .alerts import crossed_returning, low_stock_assignment, queue_stock_alerts
+from .caching import bump_on_commit, inventory_namespace
+from .models import Inventory, StockCheckpoint, StockMovement
+
+
+class InsufficientStock(serializers.ValidationError):
+    pass
+
+
+def stock_delta(movement_type, quantity):
+    """Delta signé appliqué au stock (None pour un ajustement absolu).
+
+    Un transfert porte une quantité signée : positive à l'arrivée,
+    négative au départ du point de vente.
+    """
+    quantity = Decimal(str(quantity))
+    if movement_type == 'IN':
+        return quantity
+    if movement_type == 'OUT':
+        return -quantity
+    if movement_type == 'TRF':
+        return quantity
+    if movement_type == 'ADJ':
+        return None
+    raise serializers.ValidationError(f"Type de mouvement inconnu: {movement_type}")
+
+
+def _stock_update_sql(connection, guarded, absolute=False):
+    qn = connection.ops.quote_name
+    table = qn(Inventory._meta.db_table)
+    stock = qn(Inventory._meta.get_field('current_stock').column)
+    last_updated = qn(Inventory._meta.get_field('last_updated').column)
+    pk = qn(Inventory._meta.pk.column)
+    retail_point = qn(Inventory._meta.get_field('retail_point').column)
+
+    assignment = '%s' if absolute else f'{stock} + %s'
+    # La garde est évaluée dans le même UPDATE : pas de fenêtre entre lecture et écriture
+    guard = f' AND {stock} + %s >= 0' if guarded else ''
+    return (
+        f'UPDATE {table} SET {stock} = {assignment}, {last_updated} = %s, '
+        f'{low_stock_assignment(connection, assignment)} '
+        f'WHERE {pk} = %s{guard} RETURNING {stock}, {retail_point}, {crossed_returning(connection)}'
+    )
+
+
+def apply_movement(inventory_id, movement_type, quantity, using=None):
+    """Applique un mouvement en un seul UPDATE conditionnel et renvoie le nouveau stock.
+
+    Lève InsufficientStock si le mouvement rendrait le stock négatif. Un passage
+    sous le seuil d'alerte est détecté par le même UPDATE et signalé à la validation.
+    """
+    delta = stock_delta(movement_type, quantity)
+    using = using or router.db_for_write(StockMovement)
+    connection = connections[using]
+    now = timezone.now()
+
+    value = Decimal(str(quantity)) if delta is None else delta
+    sql = _stock_update_sql(connection, guarded=delta is not None and delta < 0, absolute=delta is None)
+    params = [value, now, value, now, inventory_id] + ([delta] if delta is not None and delta < 0 else []) + [now]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    if row is None:
+        if not Inventory.objects.using(using).filter(pk=inventory_id).exists():
+            raise Inventory.DoesNotExist(f"Inventaire {inventory_id} introuvable")
+        raise InsufficientStock(f"Stock insuffisant pour l'inventaire {inventory_id}")
+    bump_on_commit([inventory_namespace(row[1])], using=using)
+    if row[2]:
+        queue_stock_alerts([inventory_id], using=using)
+    return Inventory._meta.get_field('current_stock').to_python(row[0])
+
+
+def decrement_many(quantities, using=None):
+    """Décrémente plusieurs inventaires en un seul UPDATE joint à la liste des quantités.
+
+    `quantities` associe un id d'inventaire à la quantité à retirer. Chaque ligne
+    n'est modifiée que si son stock reste positif ; sinon InsufficientStock est
+    levée et la transaction englobante doit être annulée.
+    """
+    if not quantities:
+        return 0
+    using = using or router.db_for_write(StockMovement)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(Inventory._meta.db_table)
+    stock = qn(Inventory._meta.get_field('current_stock').column)
+    last_updated = qn(Inventory._meta.get_field('last_updated').column)
+    pk = qn(Inventory._meta.pk.column)
+    retail_point = qn(Inventory._meta.get_field('retail_point').column)
+
+    rows = ' UNION ALL '.join(
+        ['SELECT CAST(%s AS bigint) AS inventory_id, CAST(%s AS numeric) AS quantity'] * len(quantities)
+    )
+    new_stock = f'{table}.{stock} - delta.quantity'
+    sql = (
+        f'UPDATE {table} SET {stock} = {new_stock}, {last_updated} = %s, '
+        f'{low_stock_assignment(connection, new_stock)} '
+        f'FROM ({rows}) AS delta '
+        f'WHERE {table}.{pk} = delta.inventory_id AND {table}.{stock} >= delta.quantity '
+        f'RETURNING {table}.{pk}, {table}.{retail_point}, {crossed_returning(connection)}'
+    )
+    now = timezone.now()
+    params = [now, now]
+    for inventory_id, quantity in quantities.items():
+        params.extend([inventory_id, Decimal(str(quantity))])
+    params.append(now)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        updated = cursor.fetchall()
+    if len(updated) != len(quantities):
+        raise InsufficientStock("Stock insuffisant pour au moins une ligne")
+    bump_on_commit(map(inventory_namespace, {row[1] for row in updated}), using=using)
+    queue_stock_alerts([row[0] for row in updated if row[2]], using=using)
+    return len(updated)
+
+
+def stock_at(inventory_id, at=None, using=None):
+    """Stock reconstitué depuis le dernier point de contrôle, à l'instant `at` (maintenant par défaut)."""
+    checkpoints = StockCheckpoint.objects.using(using).filter(inventory_id=inventory_id)
+    movements = StockMovement.objects.using(using).filter(inventory_id=inventory_id)
+    if at is not None:
+        checkpoints = checkpoints.filter(created_at__lte=at)
+        movements = movements.filter(created_at__lte=at)
+
+    stock, after = checkpoints.order_by('-movement_id').values_list('stock', 'movement_id').first() or (Decimal('0'), 0)
+    # Un ajustement fixe le stock : seuls les mouvements suivants comptent
+    reset = (
+        movements.filter(pk__gt=after, movement_type='ADJ')
+        .order_by('-pk').values_list('quantity', 'pk').first()
+    )
+    if reset is not None:
+        stock, after = reset
+    total = movements.filter(pk__gt=after).aggregate(total=Sum(Case(
+        When(movement_type='OUT', then=-F('quantity')), default=F('quantity'),
+    )))['total']
+    return stock + (total or 0)
+
+
+def set_stock_many(stocks, using=None):
+    """Fixe le stock de plusieurs inventaires, déjà verrouillés, en un seul UPDATE (alertes de seuil comprises)."""
+    if not stocks:
+        return
+    using = using or router.db_for_write(StockMovement)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(Inventory._meta.db_table)
+    stock = qn(Inventory._meta.get_field('current_stock').column)
+    last_updated = qn(Inventory._meta.get_field('last_updated').column)
+    pk = qn(Inventory._meta.pk.column)
+    retail_point = qn(Inventory._meta.get_field('retail_point').column)
+
+    rows = ', '.join(['(%s, %s)'] * len(stocks))
+    sql = (
+        f'WITH target (id, stock) AS (VALUES {rows}) '
+        f'UPDATE {table} SET {stock} = target.stock, {last_updated} = %s, '
+        f'{low_stock_assignment(connection, "target.stock")} '
+        f'FROM target WHERE {table}.{pk} = target.id '
+        f'RETURNING {table}.{pk}, {table}.{retail_point}, {crossed_returning(connection)}'
+    )
+    now = timezone.now()
+    params = [value for item in stocks.items() for value in item] + [now, now, now]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        updated = cursor.fetchall()
+    bump_on_commit(map(inventory_namespace, {row[1] for row in updated}), using=using)
+    queue_stock_alerts([row[0] for row in updated if row[2]], using=using)
+
+
+def ingest_movements(rows, user, partial=False, using=None):
+    """Applique un lot de mouvements dans une transaction ; renvoie (rapport par ligne, nombre appliqué).
+
+    `rows` contient, pour chaque ligne, les données validées ou None et ses
+    erreurs. Les inventaires sont verrouillés en une requête et le stock rejoué
+    ligne à ligne en mémoire ; les mouvements sont insérés en masse et chaque
+    inventaire ne reçoit que son stock final. Sans `partial`, une seule ligne en
+    erreur annule tout le lot.
+    """
+    using = using or router.db_for_write(StockMovement)
+    with transaction.atomic(using=using):
+        inventories = Inventory.objects.using(using).select_for_update(of=('self',)).filter(
+            pk__in={data['inventory'] for data, _ in rows if data}
+        )
+        if not user.is_staff:
+            inventories = inventories.filter(retail_point__owner=user)
+        stocks = dict(inventories.order_by('pk').values_list('pk', 'current_stock'))
+
+        report, accepted = [], []
+        for number, (data, errors) in enumerate(rows, 1):
+            if data and data['inventory'] not in stocks:
+                errors = {'inventory': "Inventaire introuvable"}
+            elif data:
+                current = stocks[data['inventory']]
+                delta = stock_delta(data['movement_type'], data['quantity'])
+                new_stock = data['quantity'] if delta is None else current + delta
+                if new_stock < 0:
+                    errors = {'quantity': f"Stock insuffisant. Stock actuel: {current}"}
+                else:
+                    stocks[data['inventory']] = new_stock
+                    accepted.append((len(report), data, new_stock))
+            report.append({'row': number, 'status': 'error', 'errors': errors} if errors else {'row': number})
+
+        if len(accepted) < len(rows) and not partial:
+            for entry in report:
+                entry.setdefault('status', 'not_applied')
+            return report, 0
+
+        # bulk_create contourne StockMovement.save : le stock est fixé ci-dessous
+        movements = StockMovement.objects.using(using).bulk_create([
+            StockMovement(
+                inventory_id=data['inventory'], movement_type=data['movement_type'], quantity=data['quantity'],
+                reference=data.get('reference'), notes=data.get('notes', ''), created_by=user,
+            )
+            for _, data, _ in accepted
+        ])
+        set_stock_many(
+            {data['inventory']: stocks[data['inventory']] for _, data, _ in accepted}, using=using,
+        )
+        for (index, _, new_stock), movement in zip(accepted, movements):
+            report[index].update(status='created', id=movement.pk, stock=str(new_stock))
+    return report, len(accepted)
@@ -0,0 +1,132 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .models import Inventory, StockCheckpoint, StockMovement
+from .stock import set_stock_many
+
+# Quantités manipulées en millièmes (decimal_places=3) : calcul exact en int64
+SCALE = 1000
+BATCH_SIZE = 5000
+CHUNK_SIZE = 50000
+
+
+def scaled(field):
+    return Cast(Round(F(field) * SCALE), BigIntegerField())
+
+
+def unscale(value):
+    return Decimal(int(value)).scaleb(-3)
+
+
+def _inventory_frame(last_pk, batch_size, using):
+    latest = StockCheckpoint.objects.using(using).filter(inventory_id=OuterRef('pk')).order_by('-movement_id')
+    rows = (
+        Inventory.objects.using(using).select_for_update(of=('self',))
+        .filter(pk__gt=last_pk).order_by('pk')
+        .annotate(
+            current=scaled('current_stock'),
+            base=Subquery(latest.annotate(scaled_stock=scaled('stock')).values('scaled_stock')[:1]),
+            after=Subquery(latest.values('movement_id')[:1]),
+        )
+        .values_list('pk', 'retail_point_id', 'current', 'base', 'after')[:batch_size]
+    )
+    frame = pd.DataFrame.from_records(
+        list(rows), columns=['inventory_id', 'retail_point_id', 'current', 'base', 'after'], index='inventory_id',
+    )
+    frame['has_checkpoint'] = frame['after'].notna()
+    return frame.fillna({'base': 0, 'after': 0}).astype({'base': 'int64', 'after': 'int64'})
+
+
+def _movement_frame(inventory_ids, chunk_size, using):
+    latest = (
+        StockCheckpoint.objects.using(using).filter(inventory_id=OuterRef('inventory_id'))
+        .order_by('-movement_id').values('movement_id')[:1]
+    )
+    rows = (
+        StockMovement.objects.using(using)
+        .filter(inventory_id__in=inventory_ids)
+        # Seuls les mouvements postérieurs au dernier point de contrôle sont lus
+        .annotate(after=Coalesce(Subquery(latest), Value(0)), scaled_quantity=scaled('quantity'))
+        .filter(pk__gt=F('after'))
+        .order_by('pk')
+        .values_list('pk', 'inventory_id', 'movement_type', 'scaled_quantity')
+    )
+    return pd.DataFrame.from_records(
+        rows.iterator(chunk_size=chunk_size), columns=['id', 'inventory_id', 'movement_type', 'quantity'],
+    )
+
+
+def expected_stock(inventories, movements):
+    """(stock attendu, dernier mouvement couvert) par inventaire, calculés par groupes vectorisés."""
+    expected = inventories['base'].copy()
+    last_movement = inventories['after'].copy()
+    if movements.empty:
+        return expected, last_movement
+
+    inventory_ids = movements['inventory_id'].to_numpy()
+    kinds = movements['movement_type'].to_numpy()
+    quantities = movements['quantity'].to_numpy(dtype='int64')
+    ids = movements['id'].to_numpy()
+
+    # Un ajustement remplace le stock : on repart du dernier de chaque inventaire
+    is_reset = kinds == 'ADJ'
+    resets = movements[is_reset].groupby('inventory_id').last()
+    reset_id = movements['inventory_id'].map(resets['id']).fillna(0).to_numpy()
+    counted = ~is_reset & (ids > reset_id)
+    signed = np.where(kinds == 'OUT', -quantities, quantities)
+    deltas = pd.Series(signed[counted]).groupby(inventory_ids[counted]).sum()
+
+    expected.loc[resets.index] = resets['quantity'].astype('int64')
+    expected += deltas.reindex(expected.index, fill_value=0)
+    last_movement.update(movements.groupby('inventory_id')['id'].max())
+    return expected, last_movement.astype('int64')
+
+
+def reconcile_stock(repair=False, checkpoint=False, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, using='default'):
+    """Compare current_stock au stock rejoué depuis les points de contrôle, par lots verrouillés.
+
+    `repair` réécrit les stocks divergents ; `checkpoint` enregistre un point de
+    contrôle pour chaque inventaire cohérent (ou réparé) ayant de nouveaux mouvements.
+    """
+    stats = {'inventories': 0, 'movements': 0, 'drift': [], 'checkpoints': 0}
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            inventories = _inventory_frame(last_pk, batch_size, using)
+            if inventories.empty:
+                return stats
+            last_pk = int(inventories.index.max())
+            movements = _movement_frame(inventories.index.tolist(), chunk_size, using)
+            stats['inventories'] += len(inventories)
+            stats['movements'] += len(movements)
+
+            expected, last_movement = expected_stock(inventories, movements)
+            drifted = inventories.index[expected != inventories['current']]
+            stats['drift'].extend(
+                (int(pk), unscale(inventories.at[pk, 'current']), unscale(expected.at[pk]),
+                 bool(inventories.at[pk, 'has_checkpoint']))
+                for pk in drifted
+            )
+
+            if repair and len(drifted):
+                # Même UPDATE que les mouvements : last_updated, marqueur de seuil et caches suivent
+                set_stock_many({int(pk): unscale(expected.at[pk]) for pk in drifted}, using=using)
+
+            if checkpoint:
+                verified = inventories.index if repair else inventories.index.difference(drifted)
+                stale = [
+                    pk for pk in verified
+                    if last_movement.at[pk] != inventories.at[pk, 'after'] or not inventories.at[pk, 'has_checkpoint']
+                ]
+                StockCheckpoint.objects.using(using).bulk_create([
+                    StockCheckpoint(
+                        inventory_id=int(pk), stock=unscale(expected.at[pk]), movement_id=int(last_movement.at[pk]),
+                    )
+                    for pk in stale
+                ], batch_size=chunk_size)
+                stats['checkpoints'] += len(stale)
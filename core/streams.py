@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+
+from .events import get_broker, notification_payload, user_channel
+from .models import Notification
+
+HEARTBEAT_SECONDS = 20
+RETRY_MILLISECONDS = 3000
+# Notifications renvoyées au plus à la reconnexion (Last-Event-ID)
+REPLAY_LIMIT = 100
+
+
+async def authenticate(request):
+    """Jeton (en-tête Authorization ou ?token=, EventSource n'envoyant pas d'en-têtes) ou session."""
+    header = request.headers.get('Authorization', '')
+    key = header[6:].strip() if header.startswith('Token ') else request.GET.get('token')
+    if key:
+        token = await Token.objects.select_related('user').filter(key=key).afirst()
+        return token.user if token is not None and token.user.is_active else None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def release_connections():
+    """Ferme les connexions du thread de la requête, sauf au milieu d'une transaction."""
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data, cls=DjangoJSONEncoder)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def event_stream(user_id, last_event_id=None):
+    # Abonnement avant le rattrapage : rien n'est perdu entre les deux
+    async with get_broker().subscribe(user_channel(user_id)) as subscription:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        replayed = last_event_id or 0
+        if last_event_id is not None:
+            missed = Notification.objects.filter(user_id=user_id, pk__gt=last_event_id).order_by('pk')
+            async for notification in missed[:REPLAY_LIMIT]:
+                replayed = notification.pk
+                yield format_event('notification', notification_payload(notification), notification.pk)
+        # Le flux peut rester ouvert des heures : la connexion ouverte par
+        # l'authentification et le rattrapage est rendue, la boucle ne lit plus la base
+        await sync_to_async(release_connections)()
+
+        while True:
+            try:
+                message = await subscription.get(HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            except ConnectionResetError:
+                return
+            message = json.loads(message)
+            event_id = message['data'].get('id') if message['event'] == 'notification' else None
+            if event_id is not None and event_id <= replayed:
+                continue
+            yield format_event(message['event'], message['data'], event_id)
+
+
+async def notification_stream(request):
+    """Flux Server-Sent Events des notifications et changements de statut de commande.
+
+    Nécessite un déploiement ASGI : chaque connexion inactive ne coûte qu'une
+    coroutine et une file, la diffusion passant par un abonnement Redis unique par processus.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({'detail': "Informations d'authentification non fournies."}, status=401)
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    return StreamingHttpResponse(
+        event_stream(user.pk, last_event_id),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
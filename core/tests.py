@@ -1,3 +1,2020 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.handlers.asgi import ASGIHandler
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import maps, reports, urls
+from .alerts import sweep_low_stock
+from .benchmark import make_formats, make_inventories, make_retail_point, make_user, seed_marketplace
+from .checkout import checkout_cart
+from .events import get_broker, publish
+from .exports import ASYNC_BLOCK_PARTS, FileExportResponse, StreamingExportResponse, stream_csv, write_xlsx
+from .models import (
+    Cart, CartItem, Category, DailyProductSales, DailySales, Dashboard, Inventory, Notification, Order, OrderItem,
+    Product, ProductFormat, ProductImage, Report, StockMovement, TokenTransaction, User,
+)
+from .notifications import notify
+from .rollups import sales_totals
+from .stock import InsufficientStock, apply_movement, decrement_many, set_stock_many, stock_at
+from .stock_reconciliation import reconcile_stock
+from .streams import notification_stream
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'perf_baseline.json'
+# PERF_UPDATE_BASELINE=1 python manage.py test core  -> réécrit la ligne de base
+UPDATE_BASELINE = bool(os.environ.get('PERF_UPDATE_BASELINE'))
+LATENCY_FACTOR = float(os.environ.get('PERF_LATENCY_FACTOR', 3))
+LATENCY_SLACK_MS = float(os.environ.get('PERF_LATENCY_SLACK_MS', 50))
+
+SMALL_PAGE, LARGE_PAGE = 2, 10
+# Meilleur temps sur plusieurs appels : écarte les pics ponctuels (GC, ordonnanceur)
+TIMING_RUNS = 3
+# Nombre maximal de requêtes SQL par route, quel que soit le profil
+# (dont une requête d'agrégat pour les validateurs ETag / Last-Modified)
+QUERY_BUDGETS = {
+    'product-list': 5,
+    'product-detail': 4,
+    'product-format-list': 3,
+    'category-list': 3,
+}
+PROFILES = ['ANONYMOUS', 'INDIVIDUAL', 'RETAILER', 'WHOLESALER', 'SEMI_WHOLESALER', 'MANUFACTURER', 'ADMIN']
+
+
+def route_names():
+    names = []
+    for pattern in urls.urlpatterns:
+        # Les variantes à suffixe de format du routeur répondent avec la même vue
+        if 'format' in pattern.pattern.regex.groupindex or pattern.name in names:
+            continue
+        # Flux sans fin, couvert par ses propres tests
+        if pattern.name == 'notification-stream':
+            continue
+        names.append(pattern.name)
+    return names
+
+
+class EndpointPerformanceTests(TestCase):
+    """Nombre de requêtes SQL, temps et taille de réponse de chaque route de core/urls.py."""
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=LARGE_PAGE + 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if UPDATE_BASELINE and cls.results:
+            BASELINE_PATH.write_text(json.dumps(cls.results, indent=2, sort_keys=True) + '\n')
+
+    def route_kwargs(self):
+        data = self.data
+        users = data['users']
+        return {
+            'product-detail': {'pk': data['products'][0].pk},
+            'product-format-create': {'product_id': data['products'][0].pk},
+            'product-format-list-create': {'product_id': data['products'][0].pk},
+            'product-image-list-create': {'product_id': data['products'][0].pk},
+            'product-format-detail': {'pk': data['formats'][0].pk},
+            'product-format-image-list-create': {'format_id': data['formats'][0].pk},
+            'product-image-detail': {'pk': data['formats'][0].productimage_set.first().pk},
+            'inventory-detail': {'pk': data['inventories'][0].pk},
+            'retail-point-inventory': {'retail_point_id': data['retail_points'][0].pk},
+            'cart-item-detail': {'pk': 1},
+            'order-detail': {'pk': data['orders'][0].pk},
+            'mark-notification-read': {'pk': users['INDIVIDUAL'].notification_set.first().pk},
+            'dispute-detail': {'pk': data['disputes'][0].pk},
+            'dispute-message-create': {'dispute_id': data['disputes'][0].pk},
+            'report-detail': {'pk': users['INDIVIDUAL'].report_set.first().pk},
+            'report-generate': {'pk': users['INDIVIDUAL'].report_set.first().pk},
+            'dashboard-detail': {'pk': users['INDIVIDUAL'].dashboard_set.first().pk},
+            'dashboard-render': {'pk': users['INDIVIDUAL'].dashboard_set.first().pk},
+        }
+
+    def client_for(self, profile):
+        client = APIClient()
+        if profile != 'ANONYMOUS':
+            client.force_authenticate(self.data['users'][profile])
+        return client
+
+    def measure(self, client, path, page_size):
+        view = resolve(path).func
+        view_class = getattr(view, 'view_class', None) or getattr(view, 'cls', None)
+        pagination_class = getattr(view_class, 'pagination_class', None)
+        patcher = (
+            mock.patch.object(pagination_class, 'page_size', page_size)
+            if pagination_class is not None else nullcontext()
+        )
+        timings = []
+        with patcher:
+            for run in range(TIMING_RUNS):
+                # Chemin à froid : le cache des vues du catalogue masquerait les requêtes
+                cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    content = response.content if not response.streaming else b''.join(response.streaming_content)
+                    timings.append(time.perf_counter() - start)
+                if run == 0:
+                    queries = len(captured)
+        return {
+            'status': response.status_code,
+            'queries': queries,
+            'wall_ms': round(min(timings) * 1000, 2),
+            'bytes': len(content),
+        }
+
+    def test_every_route_has_url_kwargs(self):
+        kwargs = self.route_kwargs()
+        for name in route_names():
+            with self.subTest(route=name):
+                reverse(name, kwargs=kwargs.get(name))
+
+    def test_routes_query_count_and_latency(self):
+        baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        kwargs = self.route_kwargs()
+
+        for name in route_names():
+            path = reverse(name, kwargs=kwargs.get(name))
+            for profile in PROFILES:
+                client = self.client_for(profile)
+                key = f'{name}:{profile}'
+                with self.subTest(route=name, profile=profile):
+                    small = self.measure(client, path, SMALL_PAGE)
+                    large = self.measure(client, path, LARGE_PAGE)
+                    self.results[key] = {
+                        'status': large['status'],
+                        'queries_small_page': small['queries'],
+                        'queries_large_page': large['queries'],
+                        'wall_ms': large['wall_ms'],
+                        'bytes': large['bytes'],
+                    }
+
+                    self.assertLessEqual(
+                        large['queries'], small['queries'],
+                        f"{path} en {profile}: {small['queries']} requêtes pour {SMALL_PAGE} lignes, "
+                        f"{large['queries']} pour {LARGE_PAGE} (N+1)",
+                    )
+                    if name in QUERY_BUDGETS:
+                        self.assertLessEqual(
+                            large['queries'], QUERY_BUDGETS[name],
+                            f"{path} en {profile}: budget de {QUERY_BUDGETS[name]} requêtes dépassé",
+                        )
+                    if UPDATE_BASELINE:
+                        continue
+                    reference = baseline.get(key)
+                    # Une route sans ligne de base échapperait en silence aux deux contrôles ci-dessous
+                    self.assertIsNotNone(
+                        reference, f"{key} absent de {BASELINE_PATH.name} : relancer avec PERF_UPDATE_BASELINE=1",
+                    )
+                    self.assertLessEqual(
+                        large['queries'], reference['queries_large_page'],
+                        f"{path} en {profile}: {large['queries']} requêtes, "
+                        f"ligne de base {reference['queries_large_page']}",
+                    )
+                    limit = reference['wall_ms'] * LATENCY_FACTOR + LATENCY_SLACK_MS
+                    self.assertLessEqual(
+                        large['wall_ms'], limit,
+                        f"{path} en {profile}: {large['wall_ms']} ms, ligne de base {reference['wall_ms']} ms",
+                    )
+
+
+class StockMovementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        retail_point = make_retail_point(make_user('RETAILER'))
+        formats = make_formats(make_user('MANUFACTURER'), 1)
+        cls.inventory = make_inventories(retail_point, formats, stock=Decimal('10'))[0]
+
+    def move(self, movement_type, quantity):
+        return StockMovement.objects.create(inventory=self.inventory, movement_type=movement_type, quantity=quantity)
+
+    def stored(self):
+        return Inventory.objects.values_list('current_stock', 'last_updated').get(pk=self.inventory.pk)
+
+    def test_negative_guard_is_part_of_the_update(self):
+        before = self.stored()
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertRaises(InsufficientStock):
+                self.move('OUT', '10.001')
+        self.assertEqual(self.stored(), before)
+        self.assertFalse(StockMovement.objects.exists())
+        # Pas de lecture préalable : la garde est dans le WHERE de l'UPDATE
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        self.assertIn('>= 0', statements[0])
+
+        self.move('OUT', '10')
+        self.assertEqual(self.stored()[0], Decimal('0'))
+
+    def test_adjustment_sets_an_absolute_level(self):
+        self.move('ADJ', '3.5')
+        self.assertEqual(self.stored()[0], Decimal('3.5'))
+        self.move('ADJ', '0')
+        self.assertEqual(self.stored()[0], Decimal('0'))
+
+    def test_transfer_quantity_is_signed(self):
+        self.move('TRF', '5')
+        self.assertEqual(self.stored()[0], Decimal('15'))
+        self.move('TRF', '-4')
+        self.assertEqual(self.stored()[0], Decimal('11'))
+        with self.assertRaises(InsufficientStock):
+            self.move('TRF', '-12')
+        self.assertEqual(self.stored()[0], Decimal('11'))
+
+    def test_saving_an_existing_movement_does_not_apply_it_again(self):
+        movement = self.move('IN', '5')
+        movement.notes = 'Livraison du matin'
+        movement.save()
+        self.assertEqual(self.stored()[0], Decimal('15'))
+        self.assertEqual(StockMovement.objects.get().notes, 'Livraison du matin')
+
+    def test_returned_level_matches_the_row_without_reading_it_back(self):
+        with CaptureQueriesContext(connection) as queries:
+            level = apply_movement(self.inventory.pk, 'IN', '2.5')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(level, Decimal('12.5'))
+        self.assertEqual(self.stored()[0], level)
+
+        inventory = Inventory.objects.get(pk=self.inventory.pk)
+        movement = StockMovement(inventory=inventory, movement_type='OUT', quantity=Decimal('0.5'))
+        with CaptureQueriesContext(connection) as queries:
+            movement.save()
+        # UPDATE ... RETURNING puis INSERT du mouvement, sans SELECT de l'inventaire
+        self.assertEqual([query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']],
+                         ['UPDATE', 'INSERT'])
+        self.assertEqual(inventory.current_stock, Decimal('12'))
+        self.assertEqual(self.stored()[0], inventory.current_stock)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = make_user('INDIVIDUAL')
+        cls.retail_point = make_retail_point(make_user('RETAILER'))
+        formats = make_formats(make_user('MANUFACTURER'), 6)
+        cls.inventories = make_inventories(cls.retail_point, formats, stock=Decimal('10'))
+        Inventory.objects.filter(pk=cls.inventories[0].pk).update(price_override=Decimal('750'))
+
+    def fill(self, lines):
+        cart, _ = Cart.objects.get_or_create(user=self.buyer)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, inventory=inventory, quantity=quantity) for inventory, quantity in lines
+        ])
+        return cart
+
+    def checkout(self, cart):
+        return checkout_cart(cart, self.buyer, retail_point=self.retail_point)
+
+    def stocks(self):
+        return dict(Inventory.objects.filter(retail_point=self.retail_point).values_list('pk', 'current_stock'))
+
+    def count_queries(self, size):
+        cart = self.fill((inventory, Decimal('1')) for inventory in self.inventories[:size])
+        with CaptureQueriesContext(connection) as queries:
+            self.checkout(cart)
+        return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        small = self.count_queries(1)
+        self.assertEqual(self.count_queries(6), small)
+
+    def test_one_bad_line_rejects_the_whole_cart(self):
+        Inventory.objects.filter(pk=self.inventories[2].pk).update(is_available=False)
+        cart = self.fill([
+            (self.inventories[0], Decimal('2')),
+            (self.inventories[1], Decimal('10.5')),
+            (self.inventories[2], Decimal('1')),
+            (self.inventories[3], Decimal('1')),
+        ])
+        stocks = self.stocks()
+        with self.assertRaises(serializers.ValidationError) as raised:
+            self.checkout(cart)
+        self.assertEqual(set(raised.exception.detail['items']), {self.inventories[1].pk, self.inventories[2].pk})
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertFalse(DailySales.objects.exists())
+        self.assertEqual(self.stocks(), stocks)
+        self.assertEqual(cart.items.count(), 4)
+
+    def test_order_lines_and_movements(self):
+        cart = self.fill([(self.inventories[0], Decimal('2')), (self.inventories[1], Decimal('1.5'))])
+        order = self.checkout(cart)
+
+        order.refresh_from_db()
+        self.assertRegex(order.order_number, rf"^CMD{timezone.now():%Y%m%d}[0-9A-F]{{8}}$")
+        self.assertEqual(order.status, 'PENDING')
+        self.assertEqual(order.user, self.buyer)
+        self.assertEqual(order.total_amount, Decimal('3000'))
+        self.assertEqual(
+            list(order.items.order_by('inventory_id').values_list('inventory_id', 'quantity', 'unit_price', 'total_price')),
+            [
+                (self.inventories[0].pk, Decimal('2'), Decimal('750'), Decimal('1500')),
+                (self.inventories[1].pk, Decimal('1.5'), Decimal('1000'), Decimal('1500')),
+            ],
+        )
+        self.assertEqual(
+            list(StockMovement.objects.order_by('inventory_id').values_list(
+                'inventory_id', 'movement_type', 'quantity', 'reference', 'created_by',
+            )),
+            [
+                (self.inventories[0].pk, 'OUT', Decimal('2'), f"Commande #{order.order_number}", self.buyer.pk),
+                (self.inventories[1].pk, 'OUT', Decimal('1.5'), f"Commande #{order.order_number}", self.buyer.pk),
+            ],
+        )
+        stocks = self.stocks()
+        self.assertEqual(stocks[self.inventories[0].pk], Decimal('8'))
+        self.assertEqual(stocks[self.inventories[1].pk], Decimal('8.5'))
+        self.assertFalse(cart.items.exists())
+
+    def test_empty_cart_is_rejected(self):
+        cart, _ = Cart.objects.get_or_create(user=self.buyer)
+        with self.assertRaises(serializers.ValidationError):
+            self.checkout(cart)
+        self.assertFalse(Order.objects.exists())
+
+
+class CatalogQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+
+    def assertConstantQueries(self, path, budget):
+        cache.clear()
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(path)
+        product = self.data['products'][0]
+        for i in range(5):
+            product_format = ProductFormat.objects.create(
+                product=product, name=f'Extra {i}', sku=f'EXTRA-{product.pk}-{i}',
+                unit_of_measure='unit', quantity_per_unit=1, base_price=100,
+            )
+            ProductImage.objects.create(product=product, format=product_format, image='products/extra.jpg')
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(after), len(before))
+        self.assertLessEqual(len(after), budget)
+
+    def test_product_list_ignores_formats_and_images_per_product(self):
+        self.assertConstantQueries(reverse('product-list'), QUERY_BUDGETS['product-list'])
+
+    def test_product_detail_ignores_formats_and_images_per_product(self):
+        path = reverse('product-detail', kwargs={'pk': self.data['products'][0].pk})
+        self.assertConstantQueries(path, QUERY_BUDGETS['product-detail'])
+
+
+def asgi_get(path, headers=(), on_send=None):
+    """Sert `path` par l'application ASGI et renvoie les messages envoyés au serveur."""
+    messages, requested = [], []
+    path, _, query_string = path.partition('?')
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+        if on_send is not None:
+            on_send(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(name.encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+    }
+    # Comme le client de test : la connexion de la transaction de test reste ouverte
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        async_to_sync(get_asgi_application())(scope, receive, send)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    return messages
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.admin = cls.data['users']['ADMIN']
+        buyer = cls.data['users']['INDIVIDUAL']
+        Order.objects.bulk_create([
+            Order(user=buyer, order_number=f'EXPORT{i}', total_amount=Decimal('100')) for i in range(600)
+        ])
+        wholesaler = cls.data['users']['WHOLESALER']
+        cls.cancelled = Order.objects.create(
+            user=wholesaler, order_number='EXPORT-CANCELLED', status='CANCELLED', total_amount=Decimal('5000'),
+        )
+        Order.objects.filter(pk=cls.cancelled.pk).update(created_at=timezone.make_aware(datetime(2020, 1, 15, 12)))
+        cls.cancelled.refresh_from_db()
+        cls.item = OrderItem.objects.create(
+            order=cls.cancelled, inventory=Inventory.objects.select_related('product_format__product').first(),
+            quantity=Decimal('2'), unit_price=Decimal('2500'), total_price=Decimal('5000'),
+        )
+        cls.orders = Order.objects.count()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def csv_rows(self, **params):
+        response = self.export(**params)
+        self.assertIsInstance(response, StreamingExportResponse)
+        return list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_csv_export_lists_every_order(self):
+        rows = self.csv_rows()
+        self.assertEqual(rows[0], ['ID', 'Client', 'Montant', 'Statut', 'Date'])
+        self.assertEqual(len(rows), self.orders + 1)
+        self.assertEqual([int(row[0]) for row in rows[1:]], sorted(Order.objects.values_list('pk', flat=True)))
+        row = next(row for row in rows if row[0] == str(self.cancelled.pk))
+        self.assertEqual(row[1:4], [self.cancelled.user.email, '5000.00', 'Annulée'])
+        self.assertTrue(row[4].startswith('2020-01-15'))
+
+    def test_filters_narrow_the_export(self):
+        for params, expected in (
+            ({'status': 'CANCELLED'}, [self.cancelled.pk]),
+            ({'user__user_type': 'WHOLESALER'}, [self.cancelled.pk]),
+            ({'date_range_after': '2020-01-01', 'date_range_before': '2020-01-31'}, [self.cancelled.pk]),
+            ({'min_amount': '1000'}, sorted(Order.objects.filter(total_amount__gte=1000).values_list('pk', flat=True))),
+        ):
+            with self.subTest(params=params):
+                self.assertEqual([int(row[0]) for row in self.csv_rows(**params)[1:]], expected)
+        self.assertEqual(len(self.csv_rows(min_amount='1000')), 8 + 1 + 1)
+
+        response = self.client.get(reverse('order-export'), {'min_amount': 'beaucoup'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_items_produce_one_row_per_order_line(self):
+        rows = self.csv_rows(items='1', status='CANCELLED')
+        self.assertEqual(rows[0][5:], ['SKU', 'Produit', 'Format', 'Quantité', 'Prix unitaire', 'Total ligne'])
+        product_format = self.item.inventory.product_format
+        self.assertEqual(rows[1:], [[
+            str(self.cancelled.pk), self.cancelled.user.email, '5000.00', 'Annulée', rows[1][4],
+            product_format.sku, product_format.product.name, product_format.name, '2.000', '2500.00', '5000.00',
+        ]])
+
+        rows = self.csv_rows(items='1')
+        lines = OrderItem.objects.count()
+        without_items = Order.objects.filter(items__isnull=True).count()
+        self.assertEqual(len(rows), 1 + lines + without_items)
+        # Jointure externe : une commande sans article garde une ligne aux colonnes vides
+        empty = next(row for row in rows[1:] if row[0] == str(Order.objects.filter(items__isnull=True).first().pk))
+        self.assertEqual(empty[5:], [''] * 6)
+
+    def test_excel_export_is_written_in_write_only_mode(self):
+        with mock.patch('core.exports.Workbook', wraps=Workbook) as workbook:
+            response = self.export(format='excel', status='CANCELLED')
+        workbook.assert_called_once_with(write_only=True)
+        self.assertIsInstance(response, FileExportResponse)
+        self.assertIn('commandes.xlsx', response['Content-Disposition'])
+
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)))['Commandes']
+        rows = list(sheet.values)
+        self.assertEqual(rows[0], ('ID', 'Client', 'Montant', 'Statut', 'Date'))
+        self.assertEqual(rows[1][:4], (self.cancelled.pk, self.cancelled.user.email, 5000, 'Annulée'))
+        # Date sans fuseau, dans le fuseau courant
+        self.assertEqual(rows[1][4], timezone.make_naive(self.cancelled.created_at))
+        self.assertEqual(len(rows), 2)
+
+    def test_excel_export_streams_through_asgi(self):
+        reads = []
+
+        def spying_xlsx(header, rows):
+            output = write_xlsx(header, rows)
+            read = output.read
+            output.read = lambda size=-1: reads.append(size) or read(size)
+            return output
+
+        def on_send(message):
+            if message.get('body') and not first_send:
+                first_send.append(len(reads))
+
+        first_send = []
+        token = Token.objects.create(user=self.admin)
+        # Blocs de 4 Ko au lieu de 64, deux par passage : le classeur compressé n'en fait que quelques-uns
+        with mock.patch('core.views.write_xlsx', spying_xlsx), mock.patch.object(ASGIHandler, 'chunk_size', 4096), \
+                mock.patch('core.exports.ASYNC_BLOCK_PARTS', 2):
+            messages = asgi_get(
+                f"{reverse('order-export')}?format=excel", [('authorization', f'Token {token.key}')], on_send,
+            )
+        self.assertEqual(messages[0]['status'], 200)
+        # Fichier lu bloc par bloc, et premier envoi avant la fin de la lecture
+        self.assertEqual(set(reads), {4096})
+        self.assertGreater(len(reads), 3)
+        self.assertLessEqual(first_send[0], 2)
+        body = b''.join(message['body'] for message in messages[1:] if message.get('body'))
+        rows = list(load_workbook(BytesIO(body))['Commandes'].values)
+        self.assertEqual(len(rows), self.orders + 1)
+
+    def test_csv_export_streams_through_asgi(self):
+        produced = []
+
+        def counting_stream(header, rows):
+            for part in stream_csv(header, rows):
+                produced.append(part)
+                yield part
+
+        def on_send(message):
+            if message.get('body') and not first_send:
+                first_send.append(len(produced))
+
+        first_send = []
+        token = Token.objects.create(user=self.admin)
+        with mock.patch('core.views.stream_csv', counting_stream):
+            messages = asgi_get(reverse('order-export'), [('authorization', f'Token {token.key}')], on_send)
+
+        self.assertEqual(messages[0]['status'], 200)
+        bodies = [message for message in messages[1:] if message.get('body')]
+        # Premier envoi après un bloc lu, et non après l'export entier
+        self.assertEqual(len(produced), self.orders + 1)
+        self.assertLessEqual(first_send[0], ASYNC_BLOCK_PARTS)
+        content = b''.join(message['body'] for message in bodies).decode()
+        self.assertEqual(len(content.splitlines()), self.orders + 1)
+
+
+class ReportGenerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.user = cls.data['users']['INDIVIDUAL']
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, user=None, **fields):
+        fields = {'report_type': 'SALES', 'title': 'Ventes', 'format': 'CSV', 'filters': {}, **fields}
+        return Report.objects.create(created_by=user or self.user, **fields)
+
+    def generate(self, report):
+        return self.client.post(reverse('report-generate', kwargs={'pk': report.pk}))
+
+    def test_invalid_filters_are_rejected_at_request_time(self):
+        for filters in (
+            {'date_from': 'garbage'}, {'date_to': '2024-02-30'}, {'date_from': '2024-03-01', 'date_to': '2024-02-01'},
+            {'status': 'LOST'}, {'retail_point': 'abc'}, {'user_type': 'ROBOT'}, {'colour': 'red'}, ['SALES'],
+        ):
+            with self.subTest(filters=filters):
+                response = self.client.post(reverse('report-list'), {
+                    'report_type': 'SALES', 'title': 'Ventes', 'format': 'CSV', 'filters': filters,
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('filters', response.json())
+
+        response = self.client.post(reverse('report-list'), {
+            'report_type': 'SALES', 'title': 'Ventes', 'format': 'CSV',
+            'filters': {'date_from': '2024-01-01', 'status': 'PENDING', 'retail_point': 3, 'user_type': ''},
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        # Rapport enregistré avant la validation : refusé au lancement, sans passer en échec
+        legacy = self.create(filters={'date_from': 'garbage'})
+        response = self.generate(legacy)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_from', response.json()['filters'])
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.status, 'DRAFT')
+
+    def test_queued_report_is_run_with_progress(self):
+        report = self.create()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.generate(report)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        report.refresh_from_db()
+        self.assertEqual((report.status, report.progress), ('PENDING', 0))
+
+        with mock.patch('core.reports._set_progress', wraps=reports._set_progress) as set_progress:
+            reports.run_report(report.pk)
+        self.assertEqual([call.args[1] for call in set_progress.call_args_list], [60, 90])
+        report.refresh_from_db()
+        self.assertEqual((report.status, report.progress, report.error), ('DONE', 100, ''))
+        self.assertIsNotNone(report.completed_at)
+        lines = report.file.read().decode().splitlines()
+        self.assertEqual(lines[0], "Date,Commandes,Unités,Chiffre d'affaires,Annulées")
+        self.assertEqual(sum(int(line.split(',')[1]) for line in lines[1:]), Order.objects.filter(
+            user=self.user, items__isnull=False).distinct().count())
+
+        # Déjà traité : un second passage ne fait rien
+        reports.run_report(report.pk)
+        self.assertEqual(Report.objects.get(pk=report.pk).completed_at, report.completed_at)
+
+    def test_failed_builder_marks_the_report_failed(self):
+        report = self.create(report_type='USER')
+        reports.request_generation(report)
+        with self.assertLogs('core.reports', 'ERROR'):
+            reports.run_report(report.pk)
+        report.refresh_from_db()
+        self.assertEqual(report.status, 'FAILED')
+        self.assertIn('administrateurs', report.error)
+        self.assertFalse(cache.get(f'report-lock:{report.filters_hash}'))
+
+    def test_identical_recent_report_is_reused_within_the_same_scope(self):
+        first = self.create(filters={'status': 'PENDING'})
+        reports.request_generation(first)
+        reports.run_report(first.pk)
+        first.refresh_from_db()
+
+        same = self.create(title='Autre titre', filters={'status': ' PENDING ', 'retail_point': ''})
+        self.assertEqual(self.generate(same).status_code, 200)
+        same.refresh_from_db()
+        self.assertEqual((same.status, same.file.name), ('DONE', first.file.name))
+
+        # Autre format, autres filtres ou autre utilisateur : nouveau calcul
+        for report in (
+            self.create(format='PDF', filters={'status': 'PENDING'}),
+            self.create(filters={'status': 'DELIVERED'}),
+            self.create(user=self.data['users']['RETAILER'], filters={'status': 'PENDING'}),
+        ):
+            with self.subTest(report=report.format, filters=report.filters, user=report.created_by_id):
+                self.assertFalse(reports.request_generation(report))
+                self.assertEqual(report.status, 'PENDING')
+
+        # Résultat trop ancien : recalculé
+        Report.objects.filter(pk=first.pk).update(completed_at=timezone.now() - timedelta(hours=2))
+        Report.objects.filter(pk=same.pk).delete()
+        self.assertFalse(reports.request_generation(self.create(filters={'status': 'PENDING'})))
+
+    def test_running_computation_completes_pending_duplicates(self):
+        first, duplicate = self.create(), self.create(title='Doublon')
+        for report in (first, duplicate):
+            reports.request_generation(report)
+        self.assertEqual(first.filters_hash, duplicate.filters_hash)
+
+        # Le verrou est tenu par le premier calcul : le doublon repasse en attente
+        lock_key = f'report-lock:{first.filters_hash}'
+        cache.add(lock_key, first.pk)
+        reports.run_report(duplicate.pk)
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.status, duplicate.progress), ('PENDING', 0))
+
+        cache.delete(lock_key)
+        reports.run_report(first.pk)
+        first.refresh_from_db()
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.status, duplicate.progress), ('DONE', 100))
+        self.assertEqual(duplicate.file.name, first.file.name)
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_abandoned_reports_are_requeued(self):
+        stale = timezone.now() - timedelta(hours=1)
+        running = self.create()
+        pending = self.create(filters={'status': 'PENDING'})
+        fresh = self.create(filters={'status': 'DELIVERED'})
+        for report in (running, pending, fresh):
+            reports.request_generation(report)
+        # Worker arrêté en plein calcul, doublon jamais repris, calcul encore en cours
+        Report.objects.filter(pk=running.pk).update(status='RUNNING', progress=60, started_at=stale)
+        Report.objects.filter(pk=pending.pk).update(started_at=stale)
+        Report.objects.filter(pk=fresh.pk).update(status='RUNNING', started_at=timezone.now())
+
+        # Le client peut relancer un rapport abandonné, pas un calcul en cours
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.generate(fresh).status_code, 202)
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.generate(running).status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        Report.objects.filter(pk=running.pk).update(status='RUNNING', started_at=stale)
+
+        out = StringIO()
+        call_command('generate_reports', stdout=out)
+        self.assertIn('2 rapport(s) abandonné(s) remis en attente', out.getvalue())
+        self.assertEqual(
+            dict(Report.objects.filter(pk__in=[running.pk, pending.pk, fresh.pk]).values_list('pk', 'status')),
+            {running.pk: 'DONE', pending.pk: 'DONE', fresh.pk: 'RUNNING'},
+        )
+
+    def test_renderers(self):
+        header = ['Date', 'Libellé', 'Montant']
+        rows = [[date(2024, 1, i % 28 + 1), f'Ligne (n°{i})', Decimal('12.50')] for i in range(100)]
+
+        content, extension = reports.render(Report(format='CSV', title='T'), header, rows)
+        self.assertEqual(extension, 'csv')
+        lines = content.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'Date,Libellé,Montant')
+        self.assertEqual(lines[1], '2024-01-01,Ligne (n°0),12.50')
+        self.assertEqual(len(lines), 101)
+
+        content, extension = reports.render(Report(format='EXCEL', report_type='SALES', title='T'), header, rows)
+        self.assertEqual(extension, 'xlsx')
+        sheet = load_workbook(BytesIO(content)).active
+        self.assertEqual(sheet.title, 'Analyse des ventes')
+        self.assertEqual([cell.value for cell in sheet[1]], header)
+        self.assertEqual(sheet.max_row, 101)
+        self.assertEqual(sheet['C2'].value, 12.5)
+
+        content, extension = reports.render(Report(format='PDF', title='Ventes (janvier)'), header, rows)
+        self.assertEqual(extension, 'pdf')
+        self.assertTrue(content.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(content.endswith(b'%%EOF\n'))
+        # 103 lignes de texte : deux pages, parenthèses échappées
+        self.assertIn(b'/Count 2', content)
+        self.assertIn(b'(Ventes \\(janvier\\)) Tj', content)
+        # Table xref : chaque décalage désigne bien le début de son objet
+        xref = int(content.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        offsets = [int(line[:10]) for line in content[xref:].split(b'\n')[3:] if line.endswith(b' n ')]
+        for number, offset in enumerate(offsets, 1):
+            self.assertTrue(content[offset:].startswith(b'%d 0 obj' % number))
+
+
+class ProductProximityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        manufacturer = make_user('MANUFACTURER')
+        owner = make_user('RETAILER')
+        here = make_retail_point(owner, gps_coordinates='5.3600,-4.0083')
+        close = make_retail_point(owner, gps_coordinates='5.4000,-4.0083')  # ~4,5 km
+        far = make_retail_point(owner, gps_coordinates='5.6000,-4.0083')  # ~27 km
+        closed = make_retail_point(owner, gps_coordinates='5.3600,-4.0083')
+        closed.is_active = False
+        closed.save()
+        formats = make_formats(manufacturer, 6)
+        cls.here, cls.close, cls.far, cls.empty, cls.hidden, cls.shut = (f.product for f in formats)
+        make_inventories(here, [formats[0], formats[3], formats[4]])
+        make_inventories(close, [formats[1], formats[0]])
+        make_inventories(far, [formats[2]])
+        make_inventories(closed, [formats[5]])
+        Inventory.objects.filter(product_format=formats[3]).update(current_stock=0)
+        Inventory.objects.filter(product_format=formats[4]).update(is_available=False)
+
+    def near(self, **params):
+        response = self.client.get(reverse('product-list'), {'near': '5.3600,-4.0083', **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_products_are_ordered_by_nearest_stock(self):
+        self.assertEqual(self.near(), [self.here.pk, self.close.pk])
+        self.assertEqual(self.near(radius=50), [self.here.pk, self.close.pk, self.far.pk])
+
+    def test_radius_excludes_distant_points(self):
+        self.assertEqual(self.near(radius=1), [self.here.pk])
+
+    def test_out_of_stock_unavailable_and_inactive_points_are_excluded(self):
+        found = set(self.near(radius=50))
+        self.assertFalse(found & {self.empty.pk, self.hidden.pk, self.shut.pk})
+
+    def test_invalid_coordinates_and_radius_are_rejected(self):
+        for params in (
+            {'near': 'abc'}, {'near': '95,0'}, {'near': 'nan,0'}, {'near': '5.3,inf'},
+            {'near': '5.3,-4.0', 'radius': 'nan'}, {'near': '5.3,-4.0', 'radius': 'inf'},
+            {'near': '5.3,-4.0', 'radius': '-1'}, {'near': '5.3,-4.0', 'radius': '0'},
+            {'near': '5.3,-4.0', 'radius': '501'}, {'near': '5.3,-4.0', 'radius': 'loin'},
+        ):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(reverse('product-list'), params).status_code, 400)
+
+
+class RetailPointMapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.data['users']['INDIVIDUAL'])
+        self.path = reverse('retail-point-map')
+
+    def test_clusters_are_cached_until_a_retail_point_changes(self):
+        response = self.client.get(self.path, {'zoom': 3})
+        self.assertEqual(response.data['mode'], 'clusters')
+        self.assertEqual(sum(c['count'] for c in response.data['clusters']), len(self.data['retail_points']))
+
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(self.path, {'zoom': 3})
+        self.assertEqual(len(cached), 0)
+
+        retail_point = self.data['retail_points'][0]
+        retail_point.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            retail_point.save()
+        response = self.client.get(self.path, {'zoom': 3})
+        self.assertEqual(sum(c['count'] for c in response.data['clusters']), len(self.data['retail_points']) - 1)
+
+    def test_region_is_checked_and_hashed_before_reaching_the_cache_key(self):
+        region = self.data['retail_points'][0].address.region
+        response = self.client.get(self.path, {'zoom': 3, 'region': region})
+        self.assertEqual(sum(c['count'] for c in response.data['clusters']), 1)
+
+        with mock.patch('core.maps.get_or_build', wraps=maps.get_or_build) as get_or_build:
+            for unknown in ('Atlantide', 'x' * 5000, 'a b\r\nc'):
+                response = self.client.get(self.path, {'zoom': 3, 'region': unknown})
+                self.assertEqual(response.data['clusters'], [])
+            self.client.get(self.path, {'zoom': 4, 'region': region})
+        keys = [call.args[0] for call in get_or_build.call_args_list]
+        # Seule la région connue obtient une clé de grappes, sous forme d'empreinte
+        expected = maps.versioned_key(maps.NAMESPACE, 'z4', maps.region_key(region))
+        self.assertEqual([key for key in keys if ':z' in key], [expected])
+        self.assertNotIn(region, ''.join(keys))
+
+    def test_high_zoom_returns_points_inside_bbox(self):
+        response = self.client.get(self.path, {'zoom': 17, 'bbox': '-4.05,5.25,-3.95,5.35'})
+        self.assertEqual(response.data['mode'], 'points')
+        self.assertTrue(all(5.25 <= point['lat'] <= 5.35 for point in response.data['points']))
+        self.assertEqual(self.client.get(self.path, {'zoom': 3, 'bbox': '1,2'}).status_code, 400)
+
+    def test_non_finite_or_inverted_bbox_is_rejected(self):
+        for bbox in ('nan,nan,nan,nan', '-inf,-1,inf,1', '-4,5,nan,6', '1,2,0,3', '-4,6,-3,5', 'a,b,c,d'):
+            for zoom in (3, 17):
+                with self.subTest(bbox=bbox, zoom=zoom):
+                    self.assertEqual(self.client.get(self.path, {'zoom': zoom, 'bbox': bbox}).status_code, 400)
+
+    def test_bbox_is_clamped_to_the_globe(self):
+        response = self.client.get(self.path, {'zoom': 3, 'bbox': '-1000,-1e6,1000,1e6'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(c['count'] for c in response.data['clusters']), len(self.data['retail_points']))
+
+
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.food = Category.objects.create(name='Alimentation')
+        cls.drinks = Category.objects.create(name='Boissons', parent=cls.food)
+        cls.juices = Category.objects.create(name='Jus', parent=cls.drinks)
+        cls.other = Category.objects.create(name='Hygiène')
+        manufacturer = cls.data['users']['MANUFACTURER']
+        for category in (cls.drinks, cls.juices, cls.other):
+            Product.objects.create(name=f'Produit {category.name}', description='', category=category,
+                                   manufacturer=manufacturer)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_moving_a_category_rewrites_its_subtree(self):
+        self.assertEqual(self.juices.path, f'{self.food.pk}/{self.drinks.pk}/{self.juices.pk}/')
+        self.drinks.parent = self.other
+        self.drinks.save()
+        self.juices.refresh_from_db()
+        self.assertEqual(self.juices.path, f'{self.other.pk}/{self.drinks.pk}/{self.juices.pk}/')
+        self.assertEqual(self.juices.depth, 2)
+        self.food.parent = self.juices
+        self.food.save()
+        self.other.parent = self.juices
+        with self.assertRaises(ValidationError):
+            self.other.save()
+
+    def test_stale_instance_is_moved_from_its_stored_path(self):
+        nectars = Category.objects.create(name='Nectars', parent=self.juices)
+        # Chargée avant que son parent ne remonte à la racine : path et depth périmés
+        stale = Category.objects.get(pk=self.juices.pk)
+        self.drinks.parent = None
+        self.drinks.save()
+
+        stale.name = 'Jus frais'
+        stale.save(update_fields=['name'])
+        self.assertEqual(Category.objects.values_list('path', 'depth').get(pk=stale.pk),
+                         (f'{self.drinks.pk}/{stale.pk}/', 1))
+
+        stale = Category.objects.get(pk=self.juices.pk)
+        self.food.parent = self.other
+        self.food.save()
+        self.drinks.parent = self.food
+        self.drinks.save()
+        stale.parent = self.other
+        stale.save()
+        nectars.refresh_from_db()
+        self.assertEqual(nectars.path, f'{self.other.pk}/{stale.pk}/{nectars.pk}/')
+        self.assertEqual(nectars.depth, 2)
+
+    def test_product_list_filters_on_category_subtree(self):
+        response = self.client.get(reverse('product-list'), {'category_subtree': self.food.pk})
+        names = {product['name'] for product in response.data['results']}
+        self.assertEqual(names, {'Produit Boissons', 'Produit Jus'})
+
+    def test_tree_counts_active_products_per_subtree(self):
+        tree = {node['id']: node for node in self.client.get(reverse('category-tree')).data}
+        self.assertEqual(tree[self.food.pk]['product_count'], 2)
+        self.assertEqual(tree[self.food.pk]['children'][0]['children'][0]['product_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(category=self.juices).get().delete()
+        with CaptureQueriesContext(connection) as queries:
+            tree = {node['id']: node for node in self.client.get(reverse('category-tree')).data}
+        self.assertEqual(tree[self.food.pk]['product_count'], 1)
+        self.assertEqual(len(queries), 2)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        manufacturer = cls.data['users']['MANUFACTURER']
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.drinks = Category.objects.create(name='Boissons')
+            cls.juice = Product.objects.create(name='Jus d\'orange Pressé', description='Pur jus sans sucre ajouté',
+                                               category=cls.drinks, manufacturer=manufacturer)
+            cls.soap = Product.objects.create(name='Savon de Marseille', description='Savon à l\'huile d\'olive',
+                                              manufacturer=manufacturer)
+            ProductFormat.objects.create(product=cls.soap, name='Pain 300g', sku='SAV-300', barcode='3760001234567',
+                                         unit_of_measure='unit', quantity_per_unit=1, base_price=500)
+
+    def search(self, query):
+        response = self.client.get(reverse('product-search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_matches_name_description_category_and_codes(self):
+        self.assertEqual(self.search('presse'), [self.juice.pk])
+        self.assertEqual(self.search('boissons'), [self.juice.pk])
+        self.assertEqual(self.search('sav-300'), [self.soap.pk])
+        self.assertEqual(self.search('3760001234567'), [self.soap.pk])
+        self.assertEqual(self.search(''), [])
+
+    def test_name_matches_rank_before_description_matches(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Huile d\'olive', description='Première pression',
+                                   manufacturer=self.data['users']['MANUFACTURER'])
+        results = self.search('huile')
+        self.assertEqual(len(results), 2)
+        self.assertNotEqual(results[0], self.soap.pk)
+
+    def test_document_follows_renames(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drinks.name = 'Rafraîchissements'
+            self.drinks.save()
+        self.assertEqual(self.search('rafraichissements'), [self.juice.pk])
+        self.assertEqual(self.search('boissons'), [])
+
+    def test_refresh_is_batched_and_dropped_with_its_savepoint(self):
+        with mock.patch('core.search.refresh_search_documents') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        self.juice.name = 'Nectar'
+                        self.juice.save()
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                with transaction.atomic():
+                    self.soap.description = 'Savon noir'
+                    self.soap.save()
+                ProductFormat.objects.filter(product=self.soap).delete()
+        # Un seul recalcul, sans le produit du point de sauvegarde annulé
+        refresh.assert_called_once_with({self.soap.pk}, using='default')
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+        cls.user = cls.data['users']['INDIVIDUAL']
+        Notification.objects.filter(user=cls.user).delete()
+        # Horodatages identiques : l'id départage
+        Notification.objects.bulk_create([
+            Notification(user=cls.user, notification_type='ORDER_UPDATE', message=f'Notification {i}')
+            for i in range(7)
+        ])
+        Notification.objects.filter(user=cls.user).update(created_at=Notification.objects.first().created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_walks_forward_and_back_without_gaps(self):
+        expected = list(Notification.objects.filter(user=self.user).order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+        url, seen, pages = reverse('notification-list') + '?page_size=3', [], []
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(pages[-1]['previous']).data
+        self.assertEqual([row['id'] for row in previous['results']], expected[3:6])
+
+    def test_estimated_total_and_invalid_cursor(self):
+        response = self.client.get(reverse('notification-list'), {'total': 'estimate'})
+        self.assertIn('estimated_total', response.data)
+        self.assertEqual(self.client.get(reverse('notification-list'), {'cursor': 'nope'}).status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN analysé uniquement sous PostgreSQL")
+class IndexAdvisorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+
+    def test_views_are_covered_by_indexes(self):
+        for profile in ('ADMIN', 'RETAILER', 'INDIVIDUAL'):
+            output = StringIO()
+            try:
+                call_command('index_advisor', '--fail', user=self.data['users'][profile].username, stdout=output)
+            except CommandError:
+                self.fail(f"{profile}:\n{output.getvalue()}")
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, path):
+        first = self.client.get(path)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(path)
+        # Seul reste l'agrégat des validateurs conditionnels
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(first.json(), second.json())
+        return second.json()
+
+    def test_product_detail_is_invalidated_by_format_changes(self):
+        product = self.data['products'][0]
+        path = reverse('product-detail', kwargs={'pk': product.pk})
+        self.assertCached(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.formats.update(name='Renommé')
+            product.formats.first().save()
+        self.assertIn('Renommé', [f['name'] for f in self.assertCached(path)['formats']])
+
+    def test_retail_point_inventory_follows_stock_movements(self):
+        inventory = self.data['inventories'][0]
+        stock = inventory.current_stock
+        path = reverse('retail-point-inventory', kwargs={'retail_point_id': inventory.retail_point_id})
+        self.assertCached(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement.objects.create(inventory=inventory, movement_type='IN', quantity=5)
+        rows = {row['id']: row for row in self.assertCached(path)['results']}
+        self.assertEqual(Decimal(rows[inventory.pk]['current_stock']), stock + 5)
+
+    def test_warm_up_fills_the_cache(self):
+        call_command('warm_catalog_cache', base_urls=['http://testserver'], stdout=StringIO())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('category-list'))
+        self.assertEqual(len(queries), 1)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, path, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        return response
+
+    def test_product_list_answers_304_until_a_nested_format_changes(self):
+        path = reverse('product-list')
+        extra = ProductFormat.objects.create(
+            product=self.data['products'][0], name='Extra', sku='EXTRA-304',
+            unit_of_measure='unit', quantity_per_unit=1, base_price=100,
+        )
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertNotModified(path, if_none_match=etag)
+        self.assertNotModified(path, if_modified_since=response['Last-Modified'])
+
+        extra.delete()
+        response = self.client.get(path, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_validators_aggregate_each_relation_on_its_own_table(self):
+        path = f"{reverse('product-list')}?near=5.3,-4.0&radius=100"
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(path, headers={'if-none-match': etag}).status_code, 304)
+        # Points de vente proches puis validateurs, sans calcul de distance
+        self.assertEqual(len(queries), 2)
+        sql = queries[1]['sql'].upper()
+        self.assertNotIn('ASIN', sql)
+        # Formats et images agrégés chacun sur leur table, sans jointure produit × format × image
+        self.assertIn('(SELECT MAX(V0."UPDATED_AT") AS "VALUE" FROM "CORE_PRODUCTFORMAT" V0', sql)
+        self.assertIn('(SELECT COUNT(V0."ID") AS "VALUE" FROM "CORE_PRODUCTIMAGE" V0', sql)
+
+        product = Product.objects.get(pk=response.json()['results'][0]['id'])
+        ProductImage.objects.create(product=product, image='products/extra.png')
+        self.assertEqual(self.client.get(path, headers={'if-none-match': etag}).status_code, 200)
+
+    def test_inventory_etag_follows_stock_movements(self):
+        inventory = self.data['inventories'][0]
+        path = reverse('retail-point-inventory', kwargs={'retail_point_id': inventory.retail_point_id})
+        etag = self.client.get(path)['ETag']
+        self.assertNotModified(path, if_none_match=etag)
+        StockMovement.objects.create(inventory=inventory, movement_type='OUT', quantity=1)
+        self.assertEqual(self.client.get(path, headers={'if-none-match': etag}).status_code, 200)
+
+
+class OrderNotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+        cls.user = cls.data['users']['INDIVIDUAL']
+
+    def test_status_transition_queues_one_notification_without_reloading(self):
+        order = Order.objects.filter(user=self.user).first()
+        before = Notification.objects.filter(user=self.user).count()
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                order.status = 'CONFIRMED'
+                order.save(update_fields=['status'])
+                order.save(update_fields=['status'])
+            self.assertTrue(all(query['sql'].startswith('UPDATE') for query in queries))
+        notifications = Notification.objects.filter(user=self.user)
+        self.assertEqual(notifications.count(), before + 1)
+        self.assertEqual(notifications.order_by('-id').first().related_object_id, order.pk)
+
+    def test_rolled_back_transition_is_not_notified(self):
+        order = Order.objects.filter(user=self.user).first()
+        before = Notification.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    order.status = 'SHIPPED'
+                    order.save(update_fields=['status'])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            other = Order.objects.filter(user=self.user).exclude(pk=order.pk).first()
+            other.status = 'CANCELLED'
+            other.save(update_fields=['status'])
+        self.assertEqual(Notification.objects.count(), before + 1)
+        self.assertFalse(Notification.objects.filter(message__contains=order.order_number).exists())
+
+    def test_batch_dropped_with_its_savepoint_is_not_reused(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    notify(self.user.pk, 'ORDER_UPDATE', 'Annulée')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            with transaction.atomic():
+                notify(self.user.pk, 'ORDER_UPDATE', 'Première')
+            notify(self.user.pk, 'ORDER_UPDATE', 'Seconde')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            set(Notification.objects.filter(message__in=['Annulée', 'Première', 'Seconde'])
+                .values_list('message', flat=True)),
+            {'Première', 'Seconde'},
+        )
+
+    def test_mark_all_read_updates_in_bulk(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        first = Notification.objects.filter(user=self.user).first()
+        response = client.post(reverse('mark-all-notifications-read'), {'ids': [first.pk]}, format='json')
+        self.assertEqual(response.json(), {'updated': 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('mark-all-notifications-read'))
+        self.assertEqual(response.json(), {'updated': Notification.objects.filter(user=self.user).count() - 1})
+        # Les notifications et le compteur : un UPDATE chacun, quel que soit leur nombre
+        self.assertEqual([query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']],
+                         ['UPDATE', 'UPDATE'])
+        self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+        self.assertTrue(Notification.objects.filter(user=self.data['users']['RETAILER'], is_read=False).exists())
+
+    def unread_count(self, user):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=user.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('notification-unread-count'))
+        self.assertEqual(len(queries), 0)
+        return response.json()['unread']
+
+    def test_unread_counter_follows_creation_and_reads(self):
+        self.assertEqual(self.unread_count(self.user), 2)
+        order = Order.objects.filter(user=self.user).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'DELIVERED'
+            order.save(update_fields=['status'])
+        self.assertEqual(self.unread_count(self.user), 3)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        notification = Notification.objects.filter(user=self.user).first()
+        path = reverse('mark-notification-read', kwargs={'pk': notification.pk})
+        client.patch(path, {}, format='json')
+        client.patch(path, {}, format='json')
+        self.assertEqual(self.unread_count(self.user), 2)
+        client.post(reverse('mark-all-notifications-read'))
+        self.assertEqual(self.unread_count(self.user), 0)
+
+    def test_reconcile_command_rebuilds_drifted_counters(self):
+        retailer = self.data['users']['RETAILER']
+        User.objects.filter(pk=self.user.pk).update(unread_notifications=40)
+        User.objects.filter(pk=retailer.pk).update(unread_notifications=0)
+        out = StringIO()
+        call_command('reconcile_unread_counts', batch_size=2, stdout=out)
+        self.assertIn('2 compteurs', out.getvalue())
+        self.assertEqual(self.unread_count(self.user), 2)
+        self.assertEqual(self.unread_count(retailer), 2)
+
+
+@override_settings(EVENT_BROKER_URL='memory://')
+class NotificationStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+        cls.user = cls.data['users']['INDIVIDUAL']
+        cls.token = Token.objects.create(user=cls.user)
+
+    async def open_stream(self, **headers):
+        request = AsyncRequestFactory().get(
+            reverse('notification-stream'), {'token': self.token.key}, headers=headers,
+        )
+        response = await notification_stream(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertTrue((await self.next_chunk(stream)).startswith('retry:'))
+        return stream
+
+    async def next_chunk(self, stream):
+        return (await asyncio.wait_for(anext(stream), 1)).decode()
+
+    async def disconnect(self, stream):
+        # Déconnexion du client : le serveur ASGI annule la lecture en cours
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+
+    async def test_published_events_reach_the_open_stream(self):
+        stream = await self.open_stream()
+        publish(self.user.pk, 'order_status', {'order_id': 1, 'status': 'SHIPPED'})
+        publish(self.data['users']['RETAILER'].pk, 'order_status', {'order_id': 2, 'status': 'SHIPPED'})
+        publish(self.user.pk, 'notification', {'id': 10 ** 9, 'message': 'Bonjour'})
+        first = await self.next_chunk(stream)
+        self.assertEqual(first, 'event: order_status\ndata: {"order_id": 1, "status": "SHIPPED"}\n\n')
+        second = await self.next_chunk(stream)
+        self.assertTrue(second.startswith(f'id: {10 ** 9}\nevent: notification\n'))
+        await self.disconnect(stream)
+        self.assertEqual(get_broker()._subscribers, {})
+
+    async def test_reconnect_replays_missed_notifications_once(self):
+        notifications = [n async for n in Notification.objects.filter(user=self.user).order_by('pk')]
+        stream = await self.open_stream(last_event_id=str(notifications[0].pk))
+        replayed = await self.next_chunk(stream)
+        self.assertTrue(replayed.startswith(f'id: {notifications[1].pk}\n'))
+        # Déjà renvoyée par le rattrapage : ignorée si elle arrive aussi par le broker
+        publish(self.user.pk, 'notification', {'id': notifications[1].pk})
+        publish(self.user.pk, 'order_status', {'order_id': 3})
+        self.assertTrue((await self.next_chunk(stream)).startswith('event: order_status'))
+        await self.disconnect(stream)
+
+    async def test_stream_requires_authentication(self):
+        request = AsyncRequestFactory().get(reverse('notification-stream'), {'token': 'invalide'})
+        request.auser = mock.AsyncMock(return_value=mock.Mock(is_authenticated=False))
+        self.assertEqual((await notification_stream(request)).status_code, 401)
+
+    def test_committed_notifications_and_transitions_are_published(self):
+        order = Order.objects.filter(user=self.user).first()
+        with mock.patch('core.notifications.publish') as notification_publish, \
+                mock.patch('core.events.publish') as event_publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                order.status = 'SHIPPED'
+                order.save(update_fields=['status'])
+        self.assertEqual(notification_publish.call_args.args[:2], (self.user.pk, 'notification'))
+        self.assertEqual(event_publish.call_args.args[1:], (
+            'order_status', {'order_id': order.pk, 'order_number': order.order_number, 'status': 'SHIPPED'},
+        ))
+
+
+class NotificationStreamConnectionTests(TransactionTestCase):
+    # Hors transaction de test : la connexion peut réellement être fermée
+    def setUp(self):
+        self.user = make_user('INDIVIDUAL')
+        self.token = Token.objects.create(user=self.user)
+        self.notifications = Notification.objects.bulk_create([
+            Notification(user=self.user, notification_type='ORDER_UPDATE', message=f'Notification {i}')
+            for i in range(2)
+        ])
+
+    async def test_connection_is_closed_once_the_replay_is_sent(self):
+        request = AsyncRequestFactory().get(
+            reverse('notification-stream'), {'token': self.token.key},
+            headers={'last_event_id': str(self.notifications[0].pk)},
+        )
+        # Connexion du thread qui exécute l'ORM pour la requête
+        db = await sync_to_async(lambda: connections['default'])()
+        with mock.patch.object(db, 'close', wraps=db.close) as close, \
+                mock.patch('core.streams.HEARTBEAT_SECONDS', 0.01):
+            stream = (await notification_stream(request)).streaming_content
+            self.assertTrue((await anext(stream)).startswith(b'retry:'))
+            self.assertTrue((await anext(stream)).startswith(f'id: {self.notifications[1].pk}\n'.encode()))
+            close.assert_not_called()
+            # Attente suivante : connexion rendue, battements de cœur sans requête
+            self.assertEqual(await anext(stream), b': keepalive\n\n')
+            self.assertEqual(await anext(stream), b': keepalive\n\n')
+            close.assert_called_once_with()
+            await stream.aclose()
+        if db.vendor == 'postgresql':
+            self.assertIsNone(db.connection)
+
+
+class TokenLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+        cls.user = cls.data['users']['INDIVIDUAL']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, transaction_type, amount, **extra):
+        return self.client.post(reverse('token-transactions'), {
+            'transaction_type': transaction_type, 'amount': amount, **extra,
+        }, format='json')
+
+    def test_conditional_updates_snapshot_the_balance_and_refuse_overdraft(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('DEPOSIT', '150.00')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['balance_after'], '150.00')
+        # Seul le solde est modifié, pas la ligne utilisateur entière
+        self.assertFalse(any('"username"' in query['sql'] for query in queries if query['sql'].startswith('UPDATE')))
+
+        self.assertEqual(self.post('WITHDRAWAL', '40.00').json()['balance_after'], '110.00')
+        self.assertEqual(self.post('WITHDRAWAL', '500.00').status_code, 400)
+        self.assertEqual(self.post('REFUND', '10.00').status_code, 403)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('110.00'))
+
+    def test_order_is_paid_once_and_refunded_on_cancellation(self):
+        order = Order.objects.filter(user=self.user).first()
+        self.post('DEPOSIT', '1500.00')
+        response = self.post('ORDER_PAYMENT', str(order.total_amount), reference=order.order_number)
+        self.assertEqual(response.json()['balance_after'], '500.00')
+        second = self.post('ORDER_PAYMENT', str(order.total_amount), reference=order.order_number)
+        self.assertEqual(second.status_code, 400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'CANCELLED'
+            order.save(update_fields=['status'])
+            order.status = 'PENDING'
+            order.save(update_fields=['status'])
+            order.status = 'CANCELLED'
+            order.save(update_fields=['status'])
+        refunds = TokenTransaction.objects.filter(transaction_type='REFUND', reference=order.order_number)
+        self.assertEqual([refund.balance_after for refund in refunds], [Decimal('1500.00')])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('1500.00'))
+
+    def test_cancelled_order_cannot_be_paid(self):
+        order = Order.objects.filter(user=self.user).first()
+        Order.objects.filter(pk=order.pk).update(status='CANCELLED')
+        self.post('DEPOSIT', '1500.00')
+        response = self.post('ORDER_PAYMENT', str(order.total_amount), reference=order.order_number)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TokenTransaction.objects.filter(reference=order.order_number).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('1500.00'))
+
+    def test_reconcile_rebuilds_balances_from_history(self):
+        # Les dépôts du jeu de données n'ont ni solde ni instantané
+        out = StringIO()
+        call_command('reconcile_token_balances', batch_size=2, chunk_size=3, stdout=out)
+        self.assertIn(f'Utilisateur {self.user.pk}: solde 0.00, attendu 200.00', out.getvalue())
+        self.assertFalse(TokenTransaction.objects.filter(balance_after__isnull=False).exists())
+
+        call_command('reconcile_token_balances', fix=True, stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('200.00'))
+        self.assertEqual(
+            list(self.user.tokentransaction_set.order_by('id').values_list('balance_after', flat=True)),
+            [Decimal('100.00'), Decimal('200.00')],
+        )
+        out = StringIO()
+        call_command('reconcile_token_balances', stdout=out)
+        self.assertIn(': 0 soldes et 0 instantanés à corriger', out.getvalue())
+
+    def test_legacy_order_entries_stay_neutral(self):
+        # Écrites par l'ancienne API : ni solde débité ou crédité, ni instantané
+        order = Order.objects.filter(user=self.user).first()
+        TokenTransaction.objects.bulk_create([
+            TokenTransaction(user=self.user, transaction_type='ORDER_PAYMENT', amount=Decimal('1000'),
+                             reference=order.order_number),
+            TokenTransaction(user=self.user, transaction_type='REFUND', amount=Decimal('30'), reference='ANCIENNE'),
+        ])
+        call_command('reconcile_token_balances', fix=True, stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('200.00'))
+        self.assertEqual(
+            list(self.user.tokentransaction_set.order_by('id').values_list('transaction_type', 'balance_after')),
+            [('DEPOSIT', Decimal('100.00')), ('DEPOSIT', Decimal('200.00')), ('ORDER_PAYMENT', None), ('REFUND', None)],
+        )
+        out = StringIO()
+        call_command('reconcile_token_balances', stdout=out)
+        self.assertIn(': 0 soldes et 0 instantanés à corriger', out.getvalue())
+
+        # Annulée, la commande n'est pas remboursée d'un paiement jamais débité
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'CANCELLED'
+            order.save(update_fields=['status'])
+        self.assertFalse(TokenTransaction.objects.filter(transaction_type='REFUND', reference=order.order_number).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_balance, Decimal('200.00'))
+
+
+class StockReconciliationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=2)
+        cls.inventory = cls.data['inventories'][0]
+
+    def move(self, movement_type, quantity, inventory=None):
+        return StockMovement.objects.create(
+            inventory=inventory or self.inventory, movement_type=movement_type, quantity=quantity,
+        )
+
+    def reconcile(self, **options):
+        out = StringIO()
+        call_command('reconcile_stock', batch_size=3, chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_stock_replays_from_checkpoint_and_adjustments(self):
+        start = self.inventory.current_stock
+        self.move('IN', '5.250')
+        self.move('OUT', '2')
+        self.assertEqual(stock_at(self.inventory.pk), start + Decimal('3.25'))
+        adjustment = self.move('ADJ', '40')
+        self.move('OUT', '0.001')
+        self.assertEqual(stock_at(self.inventory.pk), Decimal('39.999'))
+        self.assertEqual(stock_at(self.inventory.pk, at=adjustment.created_at), Decimal('40'))
+        self.assertIn(': 0 divergents', self.reconcile())
+
+    def test_reconcile_reports_repairs_and_checkpoints_drift(self):
+        other = self.data['inventories'][1]
+        self.move('IN', '10')
+        self.move('ADJ', '7', inventory=other)
+        self.move('TRF', '-2', inventory=other)
+        Inventory.objects.filter(pk=other.pk).update(current_stock=Decimal('99'))
+
+        report = self.reconcile()
+        self.assertIn(f'Inventaire {other.pk}: stock 99.000, attendu 5.000', report)
+        self.assertIn(': 1 divergents, 0 points de contrôle', report)
+
+        self.assertIn(': 1 réparés', self.reconcile(repair=True, checkpoint=True))
+        self.assertEqual(Inventory.objects.get(pk=other.pk).current_stock, Decimal('5'))
+        checkpoint = other.checkpoints.order_by('-movement_id').first()
+        self.assertEqual((checkpoint.stock, checkpoint.movement_id), (Decimal('5'), other.movements.latest('pk').pk))
+        # Après le point de contrôle, plus aucun mouvement n'est relu
+        report = self.reconcile(checkpoint=True)
+        self.assertIn(' 0 mouvements ', report)
+        self.assertIn(': 0 divergents, 0 points de contrôle', report)
+
+    def test_repair_refreshes_validators_caches_and_low_stock_marker(self):
+        cache.clear()
+        self.move('ADJ', '3')
+        Inventory.objects.filter(pk=self.inventory.pk).update(current_stock=Decimal('99'), alert_threshold=5)
+        path = reverse('retail-point-inventory', kwargs={'retail_point_id': self.inventory.retail_point_id})
+        response = self.client.get(path)
+        etag = response['ETag']
+        before = Inventory.objects.get(pk=self.inventory.pk)
+        self.assertIsNone(before.low_stock_since)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIn(': 1 réparés', self.reconcile(repair=True))
+        repaired = Inventory.objects.get(pk=self.inventory.pk)
+        self.assertEqual(repaired.current_stock, Decimal('3'))
+        self.assertGreater(repaired.last_updated, before.last_updated)
+        self.assertIsNotNone(repaired.low_stock_since)
+
+        # Le validateur a changé : la liste en cache n'est pas resservie en 304
+        response = self.client.get(path, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        stocks = {row['id']: row['current_stock'] for row in response.json()['results']}
+        self.assertEqual(Decimal(stocks[self.inventory.pk]), Decimal('3'))
+
+
+class StockMovementBulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.owner = cls.data['users']['RETAILER']
+        cls.inventories = list(Inventory.objects.filter(retail_point__owner=cls.owner).order_by('pk'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def post(self, movements, **params):
+        path = reverse('stock-movement-bulk')
+        if params:
+            path += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(path, movements, format='json')
+
+    def stock(self, inventory):
+        return Inventory.objects.get(pk=inventory.pk).current_stock
+
+    def test_batch_is_applied_with_a_constant_number_of_queries(self):
+        movements = [
+            {'inventory': inventory.pk, 'movement_type': movement_type, 'quantity': '3'}
+            for inventory in self.inventories for movement_type in ('IN', 'OUT', 'OUT')
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(movements)
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(len(queries), 5)
+        body = response.json()
+        self.assertEqual((body['applied'], body['failed']), (len(movements), 0))
+        self.assertEqual(body['results'][2]['stock'], '9997.000')
+        self.assertEqual(self.stock(self.inventories[0]), Decimal('9997'))
+        self.assertEqual(StockMovement.objects.filter(created_by=self.owner).count(), len(movements))
+        self.assertEqual(stock_at(self.inventories[0].pk), Decimal('9997'))
+
+    def test_one_invalid_row_rejects_the_batch_unless_partial(self):
+        other = Inventory.objects.exclude(retail_point__owner=self.owner).first()
+        movements = [
+            {'inventory': self.inventories[0].pk, 'movement_type': 'ADJ', 'quantity': '5'},
+            {'inventory': self.inventories[0].pk, 'movement_type': 'OUT', 'quantity': '6'},
+            {'inventory': other.pk, 'movement_type': 'IN', 'quantity': '1'},
+            {'inventory': self.inventories[1].pk, 'movement_type': 'XX', 'quantity': '1'},
+            {'inventory': self.inventories[1].pk, 'movement_type': 'IN', 'quantity': '2'},
+        ]
+        response = self.post(movements)
+        self.assertEqual(response.status_code, 400)
+        statuses = [row['status'] for row in response.json()['results']]
+        self.assertEqual(statuses, ['not_applied', 'error', 'error', 'error', 'not_applied'])
+        self.assertEqual(self.stock(self.inventories[0]), Decimal('10000'))
+
+        response = self.post({'movements': movements, 'partial': True})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['applied'], 2)
+        self.assertEqual(self.stock(self.inventories[0]), Decimal('5'))
+        self.assertEqual(self.stock(self.inventories[1]), Decimal('10002'))
+        self.assertEqual(self.stock(other), Decimal('10000'))
+
+    def test_csv_batches_are_accepted(self):
+        lines = ['inventory,movement_type,quantity,reference']
+        lines += [f'{inventory.pk},IN,1.5,BL-42' for inventory in self.inventories]
+        response = self.client.post(
+            reverse('stock-movement-bulk') + '?partial=true', '\n'.join(lines), content_type='text/csv',
+        )
+        self.assertEqual(response.json()['applied'], len(self.inventories))
+        self.assertEqual(StockMovement.objects.filter(reference='BL-42').count(), len(self.inventories))
+        self.assertEqual(self.stock(self.inventories[-1]), Decimal('10001.5'))
+
+
+class InventoryBulkUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.owner = cls.data['users']['RETAILER']
+        cls.retail_point = cls.data['retail_points'][0]
+        product = cls.data['products'][0]
+        cls.new_formats = ProductFormat.objects.bulk_create([
+            ProductFormat(product=product, name=f'Nouveau {i}', sku=f'NEW-{i}', unit_of_measure='unit',
+                          quantity_per_unit=1, base_price=Decimal('100'))
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def post(self, rows):
+        return self.client.post(reverse('inventory-bulk-upsert'), rows, format='json')
+
+    def test_rows_are_created_or_updated_in_a_constant_number_of_queries(self):
+        existing = Inventory.objects.filter(retail_point=self.retail_point).order_by('pk')
+        rows = [
+            {'product_format_id': inventory.product_format_id, 'retail_point_id': self.retail_point.pk,
+             'current_stock': '42', 'price_override': '450'}
+            for inventory in existing
+        ] + [
+            {'product_format_id': product_format.pk, 'retail_point_id': self.retail_point.pk,
+             'current_stock': '7', 'price_override': '90'}
+            for product_format in self.new_formats
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(rows)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'created': 3, 'updated': len(existing)})
+        self.assertLessEqual(len([query for query in queries if 'SAVEPOINT' not in query['sql']]), 8)
+
+        inventory = Inventory.objects.get(pk=existing[0].pk)
+        self.assertEqual((inventory.current_stock, inventory.price_override), (Decimal('42'), Decimal('450')))
+        created = Inventory.objects.get(retail_point=self.retail_point, product_format=self.new_formats[0])
+        self.assertEqual(created.current_stock, Decimal('7'))
+        # Les stocks importés restent cohérents avec l'historique des mouvements
+        self.assertEqual(stock_at(inventory.pk), Decimal('42'))
+        self.assertEqual(stock_at(created.pk), Decimal('7'))
+        self.assertEqual(reconcile_stock()['drift'], [])
+
+    def test_omitted_fields_are_left_untouched(self):
+        inventory = Inventory.objects.filter(retail_point=self.retail_point).first()
+        response = self.post({'inventories': [
+            {'product_format_id': inventory.product_format_id, 'retail_point_id': self.retail_point.pk,
+             'is_available': False},
+        ]})
+        self.assertEqual(response.json(), {'created': 0, 'updated': 1})
+        inventory.refresh_from_db()
+        self.assertEqual((inventory.is_available, inventory.current_stock), (False, Decimal('10000')))
+        self.assertFalse(StockMovement.objects.filter(inventory=inventory).exists())
+
+    def test_invalid_rows_reject_the_whole_import(self):
+        other = self.data['retail_points'][1]
+        rows = [
+            {'product_format_id': self.new_formats[0].pk, 'retail_point_id': self.retail_point.pk},
+            {'product_format_id': self.new_formats[1].pk, 'retail_point_id': other.pk},
+            {'product_format_id': 999999, 'retail_point_id': self.retail_point.pk},
+            {'product_format_id': self.new_formats[0].pk, 'retail_point_id': self.retail_point.pk},
+            {'product_format_id': self.new_formats[2].pk, 'retail_point_id': self.retail_point.pk,
+             'current_stock': '-1'},
+        ]
+        response = self.post(rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [5])
+
+        response = self.post(rows[:4])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [2, 3, 4])
+        self.assertFalse(Inventory.objects.filter(product_format__in=self.new_formats).exists())
+
+
+class LowStockAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.owner = cls.data['users']['RETAILER']
+        cls.inventories = list(Inventory.objects.filter(retail_point__owner=cls.owner).order_by('pk'))
+        Inventory.objects.filter(pk__in=[inventory.pk for inventory in cls.inventories]).update(
+            alert_threshold=Decimal('100'),
+        )
+
+    def alerts(self):
+        return list(
+            Notification.objects.filter(user=self.owner, notification_type='STOCK_ALERT')
+            .order_by('pk').values_list('message', 'related_object_id')
+        )
+
+    def move(self, inventory, movement_type, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement.objects.create(inventory=inventory, movement_type=movement_type, quantity=quantity)
+
+    def test_only_threshold_crossings_are_signalled(self):
+        inventory = self.inventories[0]
+        self.move(inventory, 'OUT', '9850')
+        self.assertEqual(self.alerts(), [])
+        self.move(inventory, 'OUT', '60')
+        self.move(inventory, 'OUT', '10')
+        alerts = self.alerts()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0][1], inventory.pk)
+        self.assertIn('90.000 restant(s)', alerts[0][0])
+
+        # Réarmée au-dessus du seuil, l'alerte peut se redéclencher
+        self.move(inventory, 'IN', '500')
+        self.assertIsNone(Inventory.objects.get(pk=inventory.pk).low_stock_since)
+        self.move(inventory, 'ADJ', '5')
+        self.assertEqual(len(self.alerts()), 2)
+        self.assertEqual(User.objects.get(pk=self.owner.pk).unread_notifications, 4 + 2)
+
+    def test_crossings_are_coalesced_per_owner_and_dropped_on_rollback(self):
+        quantities = {inventory.pk: Decimal('9950') for inventory in self.inventories}
+        try:
+            with transaction.atomic():
+                decrement_many(quantities)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.alerts(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                decrement_many(dict(list(quantities.items())[:2]))
+                set_stock_many({self.inventories[2].pk: Decimal('1')})
+        alerts = self.alerts()
+        self.assertEqual(len(alerts), 1)
+        self.assertIsNone(alerts[0][1])
+        self.assertTrue(alerts[0][0].startswith('Stock bas : 3 références'))
+
+    def test_sweep_catches_threshold_changes_in_one_query(self):
+        inventory = self.inventories[0]
+        Inventory.objects.filter(pk=inventory.pk).update(alert_threshold=Decimal('20000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_low_stock(), (1, 0))
+        self.assertEqual(self.alerts()[0][1], inventory.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_low_stock(), (0, 0))
+        self.assertEqual(len(self.alerts()), 1)
+
+        Inventory.objects.filter(pk=inventory.pk).update(alert_threshold=Decimal('0'))
+        out = StringIO()
+        call_command('sweep_low_stock', stdout=out)
+        self.assertIn('0 inventaire(s) signalé(s), 1 alerte(s) réarmée(s)', out.getvalue())
+
+    def test_sweep_refreshes_validators_and_cached_lists(self):
+        cache.clear()
+        inventory = self.inventories[0]
+        path = reverse('retail-point-inventory', kwargs={'retail_point_id': inventory.retail_point_id})
+        before = Inventory.objects.get(pk=inventory.pk).last_updated
+        for threshold in (Decimal('20000'), Decimal('0')):
+            etag = self.client.get(path)['ETag']
+            Inventory.objects.filter(pk=inventory.pk).update(alert_threshold=threshold)
+            with self.captureOnCommitCallbacks(execute=True):
+                sweep_low_stock()
+            # Marqueur posé puis effacé : la liste en cache et son ETag suivent
+            response = self.client.get(path, headers={'if-none-match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            last_updated = Inventory.objects.get(pk=inventory.pk).last_updated
+            self.assertGreater(last_updated, before)
+            before = last_updated
+
+    @skipUnless(connection.vendor == 'postgresql', "Plan d'exécution PostgreSQL")
+    def test_sweep_query_uses_the_partial_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = (
+            Inventory.objects.filter(current_stock__lte=F('alert_threshold'), low_stock_since__isnull=True)
+            .explain()
+        )
+        self.assertIn('inventory_low_stock_idx', plan)
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.buyer = cls.data['users']['INDIVIDUAL']
+        cls.manufacturer = cls.data['users']['MANUFACTURER']
+        cls.retail_point = cls.data['retail_points'][0]
+        cls.inventories = list(Inventory.objects.filter(retail_point=cls.retail_point).order_by('pk')[:2])
+
+    def checkout(self, **order_fields):
+        cart, _ = Cart.objects.get_or_create(user=self.buyer)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, inventory=inventory, quantity=quantity)
+            for inventory, quantity in zip(self.inventories, (2, 3))
+        ])
+        return checkout_cart(cart, self.buyer, **{'retail_point': self.retail_point, **order_fields})
+
+    def snapshot(self):
+        return (
+            sorted(DailySales.objects.values_list(
+                'day', 'retail_point_id', 'region', 'orders', 'revenue', 'cancelled_orders', 'cancelled_revenue',
+            ), key=str),
+            sorted(DailyProductSales.objects.values_list(
+                'day', 'product_format_id', 'retail_point_id', 'manufacturer_id', 'region', 'order_lines', 'units',
+                'revenue', 'cancelled_lines', 'cancelled_units', 'cancelled_revenue',
+            )),
+        )
+
+    def test_checkout_and_cancellation_update_the_day_rollups(self):
+        before = sales_totals(DailySales.objects.filter(retail_point=self.retail_point))
+        order = self.checkout()
+        after = sales_totals(DailySales.objects.filter(retail_point=self.retail_point))
+        self.assertEqual(after['orders'], before['orders'] + 1)
+        self.assertEqual(after['revenue'], before['revenue'] + order.total_amount)
+        line = DailyProductSales.objects.get(
+            day=timezone.localdate(order.created_at), product_format=self.inventories[1].product_format,
+            retail_point=self.retail_point,
+        )
+        self.assertEqual((line.order_lines, line.units, line.manufacturer_id), (2, Decimal('4'), self.manufacturer.pk))
+
+        order.status = 'CANCELLED'
+        order.save(update_fields=['status'])
+        cancelled = sales_totals(DailySales.objects.filter(retail_point=self.retail_point))
+        self.assertEqual(cancelled['cancelled_orders'], 1)
+        self.assertEqual(cancelled['net_revenue'], before['net_revenue'])
+
+        order.status = 'PENDING'
+        order.save(update_fields=['status'])
+        self.assertEqual(sales_totals(DailySales.objects.filter(retail_point=self.retail_point)), after)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.checkout(retail_point=None)
+        self.checkout(retail_point=None)
+        self.assertEqual(DailySales.objects.get(retail_point=None).orders, 2)
+        order = self.checkout()
+        order.status = 'CANCELLED'
+        order.save(update_fields=['status'])
+        incremental = self.snapshot()
+        out = StringIO()
+        call_command('rebuild_sales_rollups', chunk_days=1, stdout=out)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_dashboards_answer_from_rollups_in_constant_queries(self):
+        self.checkout()
+        client = APIClient()
+        client.force_authenticate(self.data['users']['ADMIN'])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('admin-dashboard'), {'days': 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 5)
+        self.assertFalse(any('core_order' in query['sql'] for query in queries))
+        sales = response.json()['sales']
+        self.assertEqual(sales['totals']['orders'], Order.objects.count())
+        self.assertEqual(sum(day['orders'] for day in sales['daily']), Order.objects.count())
+
+        client.force_authenticate(self.manufacturer)
+        response = client.get(reverse('manufacturer-sales'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Decimal(response.json()['totals']['units']),
+            OrderItem.objects.aggregate(total=Sum('quantity'))['total'],
+        )
+        client.force_authenticate(self.buyer)
+        self.assertEqual(client.get(reverse('manufacturer-sales')).status_code, 403)
+
+
+class DashboardWidgetTests(TestCase):
+    WIDGETS = [
+        {'id': 'ca', 'type': 'kpi', 'source': 'sales', 'metrics': ['orders', 'revenue']},
+        {'id': 'net', 'type': 'kpi', 'source': 'sales', 'metric': 'net_revenue', 'ttl': 120},
+        {'id': 'courbe', 'type': 'timeseries', 'source': 'sales', 'metric': 'revenue', 'days': 7},
+        {'id': 'top', 'type': 'top', 'source': 'product_sales', 'metric': 'units', 'by': 'product_format', 'limit': 2},
+        {'id': 'regions', 'type': 'breakdown', 'source': 'product_sales', 'metric': 'revenue', 'by': 'region'},
+        {'id': 'alertes', 'type': 'breakdown', 'source': 'inventory', 'metric': 'low_stock', 'by': 'retail_point'},
+        {'id': 'casse', 'type': 'camembert', 'source': 'sales', 'metric': 'orders'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+        cls.owner = cls.data['users']['RETAILER']
+        cls.dashboard = Dashboard.objects.create(user=cls.owner, name='Boutique', widgets=cls.WIDGETS)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def render(self, dashboard=None):
+        return self.client.get(reverse('dashboard-render', kwargs={'pk': (dashboard or self.dashboard).pk}))
+
+    def test_widgets_sharing_a_query_are_evaluated_together_then_cached(self):
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.render()
+        self.assertEqual(response.status_code, 200)
+        # Tableau de bord + une requête par groupe (KPI, série, top, répartition, inventaire)
+        self.assertEqual(len(queries), 6)
+        self.assertEqual(sorted(call.args[1] for call in set_many.call_args_list), [60, 120, 300])
+
+        widgets = {widget['id']: widget for widget in response.json()['widgets']}
+        own_sales = DailySales.objects.filter(retail_point__owner=self.owner)
+        self.assertEqual(widgets['ca']['data']['orders'], sales_totals(own_sales)['orders'])
+        self.assertEqual(len(widgets['top']['data']), 2)
+        self.assertEqual(set(widgets['top']['data'][0]), {
+            'product_format_id', 'product_format__name', 'product_format__product__name', 'units',
+        })
+        self.assertIn('error', widgets['casse'])
+        self.assertFalse(widgets['ca']['cached'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.render()
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(all(widget.get('cached') for widget in response.json()['widgets'] if 'data' in widget))
+
+    def test_sources_are_scoped_to_the_profile(self):
+        buyer = self.data['users']['INDIVIDUAL']
+        dashboard = Dashboard.objects.create(user=buyer, name='Achats', widgets=[
+            {'type': 'kpi', 'source': 'orders', 'metrics': ['orders', 'spent']},
+            {'type': 'kpi', 'source': 'sales', 'metric': 'revenue'},
+        ])
+        self.client.force_authenticate(buyer)
+        widgets = self.render(dashboard).json()['widgets']
+        self.assertEqual(widgets[0]['data']['orders'], Order.objects.filter(user=buyer).count())
+        self.assertIn('error', widgets[1])
+
+    def test_user_scoped_sources_are_not_shared_between_staff_users(self):
+        widgets = [{'type': 'kpi', 'source': 'orders', 'metrics': ['orders', 'spent']},
+                   {'type': 'kpi', 'source': 'sales', 'metric': 'orders'}]
+        first = self.data['users']['ADMIN']
+        second = make_user('INDIVIDUAL', prefix='admin')
+        second.is_staff = True
+        second.save(update_fields=['is_staff'])
+        Order.objects.create(user=first, order_number='ADMIN-1', total_amount=Decimal('500'))
+        results = []
+        for admin in (first, second):
+            self.client.force_authenticate(admin)
+            dashboard = Dashboard.objects.create(user=admin, name='Plateforme', widgets=widgets)
+            results.append(self.render(dashboard).json()['widgets'])
+        self.assertEqual(results[0][0]['data'], {'orders': 1, 'spent': 500})
+        self.assertEqual(results[1][0]['data'], {'orders': 0, 'spent': 0})
+        self.assertFalse(results[1][0]['cached'])
+        # Les ventes de la plateforme restent partagées entre administrateurs
+        self.assertTrue(results[1][1]['cached'])
+
+    def test_invalid_widget_configuration_is_rejected_on_save(self):
+        response = self.client.post(reverse('dashboard-list'), {'name': 'Test', 'widgets': [
+            {'type': 'top', 'source': 'sales', 'metrics': ['orders', 'revenue'], 'by': 'region'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0', response.json()['widgets'])
+
+
+class BulkProductUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_marketplace(size=4)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.data['users']['ADMIN'])
+
+    def patch(self, payload):
+        return self.client.patch(reverse('bulk-product-update'), payload, format='json')
+
+    def test_set_based_update_of_products_and_formats(self):
+        products = self.data['products']
+        formats = self.data['formats']
+        category = Category.objects.create(name='Promotions')
+        payload = {
+            'products': [
+                {'id': products[0].pk, 'name': 'Renommé', 'category': category.pk},
+                {'id': products[1].pk, 'is_active': False},
+                {'id': products[2].pk, 'name': products[2].name},
+                {'id': 10 ** 9, 'is_active': False},
+            ],
+            'formats': [
+                {'id': product_format.pk, 'base_price': '999.99', 'barcode': f'BC{product_format.pk}'}
+                for product_format in formats
+            ],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.patch(payload)
+        self.assertEqual(response.status_code, 200)
+        # Chargement des catégories, produits et formats, puis un UPDATE par groupe de champs
+        self.assertLessEqual(len(queries), 10)
+        body = response.json()
+        self.assertEqual(
+            [(row['status'], row.get('fields')) for row in body['products']],
+            [('updated', ['name', 'category_id']), ('updated', ['is_active']), ('unchanged', []), ('not_found', None)],
+        )
+        self.assertTrue(all(row['status'] == 'updated' for row in body['formats']))
+
+        self.assertEqual(Product.objects.get(pk=products[0].pk).category, category)
+        self.assertFalse(Product.objects.get(pk=products[1].pk).is_active)
+        self.assertEqual(ProductFormat.objects.filter(base_price='999.99').count(), len(formats))
+        self.assertGreater(Product.objects.get(pk=products[0].pk).updated_at, products[0].updated_at)
+        self.assertEqual(self.client.get(reverse('product-search'), {'q': 'renomme'}).json()['count'], 1)
+        barcode = f'BC{formats[0].pk}'
+        self.assertEqual(self.client.get(reverse('product-search'), {'q': barcode}).json()['count'], 1)
+
+    def test_legacy_list_payload_and_validation(self):
+        product = self.data['products'][0]
+        response = self.patch([{'id': product.pk, 'is_active': False}])
+        self.assertEqual(response.json()['products'][0]['status'], 'updated')
+        self.assertEqual(self.patch([{'id': product.pk}, {'id': product.pk}]).status_code, 400)
+        self.assertEqual(self.patch({'formats': [{'id': 1, 'base_price': '-1'}]}).status_code, 400)
+        self.assertEqual(self.patch([{'id': product.pk, 'category': 10 ** 9}]).status_code, 400)
@@ -1,9 +1,9 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import streams, views
 # OU si vous avez créé auth.py :
 from .auth import AdminLoginView
-from .views import AdminUserListView,OrderExportView, BulkProductUpdateView,RetailPointMapView  # ✅ Import the view
+from .views import AdminDashboardView, AdminUserListView,OrderExportView, BulkProductUpdateView,RetailPointMapView  # ✅ Import the view
 
 router = DefaultRouter()
 router.register(r'reports', views.ReportViewSet, basename='report')
@@ -23,14 +23,17 @@ urlpatterns = [
     # --- Produits ---
     path('products/', views.ProductListView.as_view(), name='product-list'),
     path('products/create/', views.ProductCreateView.as_view(), name='product-create'),
+    path('products/search/', views.ProductSearchView.as_view(), name='product-search'),
     path('products/<int:pk>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('products/<int:product_id>/formats/', views.ProductFormatCreateView.as_view(), name='product-format-create'),
     
     # --- Inventaire ---
     path('inventory/', views.InventoryListView.as_view(), name='inventory-list'),
+    path('inventory/bulk/', views.InventoryBulkUpsertView.as_view(), name='inventory-bulk-upsert'),
     path('inventory/<int:pk>/', views.InventoryDetailView.as_view(), name='inventory-detail'),
     path('retail-points/<int:retail_point_id>/inventory/', views.RetailPointInventoryView.as_view(), name='retail-point-inventory'),
     path('stock-movements/', views.StockMovementCreateView.as_view(), name='stock-movement-create'),
+    path('stock-movements/bulk/', views.StockMovementBulkView.as_view(), name='stock-movement-bulk'),
     
     # --- Panier & Commandes ---
     path('cart/', views.CartView.as_view(), name='cart'),
@@ -41,10 +44,14 @@ urlpatterns = [
     
     # --- Catégories ---
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
+    path('categories/tree/', views.CategoryTreeView.as_view(), name='category-tree'),
      # --- Notice ---
     path('token-transactions/', views.TokenTransactionView.as_view(), name='token-transactions'),
     path('notifications/', views.NotificationListView.as_view(), name='notification-list'),
     path('notifications/<int:pk>/mark-as-read/', views.MarkNotificationAsReadView.as_view(), name='mark-notification-read'),
+    path('notifications/mark-all-read/', views.MarkAllNotificationsAsReadView.as_view(), name='mark-all-notifications-read'),
+    path('notifications/unread-count/', views.UnreadNotificationCountView.as_view(), name='notification-unread-count'),
+    path('notifications/stream/', streams.notification_stream, name='notification-stream'),
 
      # Formats de produits
     path('product-formats/', views.ProductFormatListView.as_view(), name='product-format-list'),
@@ -67,6 +74,8 @@ urlpatterns = [
     # Admin
     path('admin/users/', AdminUserListView.as_view(), name='admin-user-list'),
     path('admin/orders/export/', OrderExportView.as_view(), name='order-export'),
+    path('admin/dashboard/', AdminDashboardView.as_view(), name='admin-dashboard'),
+    path('manufacturer/sales/', views.ManufacturerSalesView.as_view(), name='manufacturer-sales'),
     
     # Products
     path('products/bulk/', BulkProductUpdateView.as_view(), name='bulk-product-update'),
@@ -4,12 +4,38 @@ from .models import *
 from .serializers import *
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
-from django.db import transaction
 from rest_framework import viewsets  # Ajoutez cette ligne
 from rest_framework.decorators import action
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django_filters import FilterSet, DateFromToRangeFilter
 from rest_framework.permissions import IsAdminUser
+from django.db.models import Prefetch
+from .checkout import checkout_cart
+from .exports import CHUNK_SIZE, FileExportResponse, StreamingExportResponse, order_export, stream_csv, write_xlsx
+from .filters import OrderFilter, ProductFilter
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from .reports import ACTIVE_STATUSES, is_stale, parse_filters, request_generation
+from .geo import (
+    DEFAULT_RADIUS_KM, MAX_RADIUS_KM, distance_expression, nearby_retail_points, parse_coordinates, parse_radius,
+)
+from django.db.models import F, Min
+from .categories import category_tree
+from .search import search_products
+from .pagination import KeysetPagination
+from .caching import CATALOG, CachedResponseMixin, inventory_namespace
+from .conditional import ConditionalGetMixin
+from .maps import CLUSTER_MAX_ZOOM, clusters_in_bbox, parse_bbox, points_in_bbox
+from .ledger import pay_order, record
+from .bulk import bulk_update_catalog, upsert_inventories
+from .notifications import mark_read
+from .parsers import CSVParser
+from .stock import ingest_movements
+from .rollups import sales_breakdown, sales_totals
+from .widgets import render_dashboard
+from datetime import timedelta
+from django.utils import timezone
+
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -43,11 +69,17 @@ class RetailPointCreateView(generics.CreateAPIView):
         serializer.save(owner=self.request.user)
 
 
-class CategoryListView(generics.ListAPIView):
-    queryset = Category.objects.all()
+class CategoryListView(ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
+    queryset = Category.objects.order_by('pk')
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+class CategoryTreeView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return Response(category_tree())
+
 class ProductCreateView(generics.CreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
@@ -58,26 +90,78 @@ class ProductCreateView(generics.CreateAPIView):
         context['request'] = self.request
         return context
 
-class ProductListView(generics.ListAPIView):
+class ProductListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
-    filterset_fields = ['category', 'manufacturer']
+    filterset_class = ProductFilter
+    conditional_fields = ('updated_at', 'formats__updated_at', 'images__created_at')
+    conditional_counts = ('formats', 'images')
 
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+        queryset = ProductSerializer.setup_eager_loading(
+            Product.objects.filter(is_active=True).order_by('pk')
+        )
         
-        # Filtrage par géolocalisation (à implémenter plus tard)
+        # Filtrage par géolocalisation : ?near=lat,lng&radius=km
         if 'near' in self.request.query_params:
-            # TODO: Implémenter la logique de filtrage par proximité
-            pass
+            queryset = self.annotate_distance(self.filter_near(queryset))
             
         return queryset
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+    def get_conditional_queryset(self):
+        # Les validateurs ne dépendent que des produits retenus : ni distance ni préchargement
+        queryset = Product.objects.filter(is_active=True)
+        if 'near' in self.request.query_params:
+            queryset = self.filter_near(queryset)
+        return self.filter_queryset(queryset)
+
+    def nearby(self):
+        """(point, {point de vente: distance}) de ?near=, calculés une fois par requête."""
+        if not hasattr(self, '_nearby'):
+            point = parse_coordinates(self.request.query_params['near'])
+            if point is None:
+                raise ValidationError({'near': "Format attendu: lat,lng"})
+            radius = parse_radius(self.request.query_params.get('radius', DEFAULT_RADIUS_KM))
+            if radius is None:
+                raise ValidationError({'radius': f"Rayon invalide : entre 0 et {MAX_RADIUS_KM} km"})
+            # Boîte englobante et geohash en SQL, distance exacte sur les seuls candidats
+            self._nearby = point, nearby_retail_points(*point, radius)
+        return self._nearby
+
+    def filter_near(self, queryset):
+        _, retail_points = self.nearby()
+        return queryset.filter(
+            formats__inventory__retail_point_id__in=list(retail_points),
+            formats__inventory__is_available=True,
+            formats__inventory__current_stock__gt=0,
+        )
+
+    def annotate_distance(self, queryset):
+        point, _ = self.nearby()
+        return queryset.annotate(
+            distance=Min(distance_expression(
+                'formats__inventory__retail_point__address__latitude',
+                'formats__inventory__retail_point__address__longitude',
+                *point,
+            ))
+        ).order_by('distance', 'pk')
+
+class ProductSearchView(generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
 
+    # ?q=... : recherche classée sur nom, description, catégorie, SKU et code-barres
+    def get_queryset(self):
+        queryset = ProductSerializer.setup_eager_loading(Product.objects.filter(is_active=True))
+        return search_products(queryset, self.request.query_params.get('q', ''))
+
+class ProductDetailView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
+    queryset = ProductSerializer.setup_eager_loading(Product.objects.all())
+    serializer_class = ProductSerializer
+    permission_classes = [permissions.AllowAny]
+    conditional_fields = ('updated_at', 'formats__updated_at', 'images__created_at')
+    conditional_counts = ('formats', 'images')
+
 class ProductFormatCreateView(generics.CreateAPIView):
     queryset = ProductFormat.objects.all()
     serializer_class = ProductFormatSerializer
@@ -93,10 +177,11 @@ class ProductFormatCreateView(generics.CreateAPIView):
             
         serializer.save(product=product)
 
-class InventoryListView(generics.ListCreateAPIView):
+class InventoryListView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = InventorySerializer
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['retail_point', 'product_format__product']
+    conditional_fields = ('last_updated', 'product_format__updated_at')
 
     def get_queryset(self):
         user = self.request.user
@@ -120,10 +205,11 @@ class InventoryListView(generics.ListCreateAPIView):
                 current_stock__gt=0
             ).select_related('product_format', 'retail_point')
 
-class InventoryDetailView(generics.RetrieveUpdateAPIView):
+class InventoryDetailView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_fields = ('last_updated', 'product_format__updated_at')
 
     def get_queryset(self):
         user = self.request.user
@@ -146,16 +232,99 @@ class StockMovementCreateView(generics.CreateAPIView):
         context['request'] = self.request
         return context
 
-class RetailPointInventoryView(generics.ListAPIView):
+class StockMovementBulkView(APIView):
+    """Lot de mouvements (JSON ou CSV) appliqué dans une transaction, avec un rapport par ligne.
+
+    JSON : liste de mouvements, ou {"movements": [...], "partial": true}. CSV :
+    corps text/csv ou fichier `file`, colonnes inventory, movement_type, quantity,
+    reference, notes. `?partial=true` applique les lignes valides malgré les erreurs.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+    max_rows = 5000
+
+    def get_rows(self, request):
+        data = request.data
+        if 'file' in request.FILES:
+            return CSVParser().parse(request.FILES['file'])
+        if isinstance(data, dict):
+            return data.get('movements')
+        return data
+
+    def post(self, request):
+        rows = self.get_rows(request)
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({'movements': "Liste de mouvements attendue"})
+        if len(rows) > self.max_rows:
+            raise ValidationError({'movements': f"{self.max_rows} mouvements au plus par lot"})
+        partial = str(request.query_params.get('partial', '')).lower() in ('1', 'true') or (
+            isinstance(request.data, dict) and request.data.get('partial') is True
+        )
+
+        validated = []
+        for row in rows:
+            serializer = StockMovementRowSerializer(data=row if isinstance(row, dict) else {})
+            valid = serializer.is_valid()
+            validated.append((serializer.validated_data if valid else None, None if valid else serializer.errors))
+
+        report, applied = ingest_movements(validated, request.user, partial=partial)
+        return Response(
+            {'applied': applied, 'failed': len(rows) - applied, 'results': report},
+            status=status.HTTP_201_CREATED if applied else status.HTTP_400_BAD_REQUEST,
+        )
+
+class InventoryBulkUpsertView(APIView):
+    """Import d'inventaire (JSON ou CSV) : crée ou met à jour par (product_format_id, retail_point_id).
+
+    JSON : liste de lignes, ou {"inventories": [...]}. CSV : corps text/csv ou
+    fichier `file`. Tout ou rien : la moindre ligne invalide annule l'import.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+    max_rows = 10000
+
+    def get_rows(self, request):
+        data = request.data
+        if 'file' in request.FILES:
+            return CSVParser().parse(request.FILES['file'])
+        if isinstance(data, dict):
+            return data.get('inventories')
+        return data
+
+    def post(self, request):
+        rows = self.get_rows(request)
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({'inventories': "Liste d'inventaires attendue"})
+        if len(rows) > self.max_rows:
+            raise ValidationError({'inventories': f"{self.max_rows} lignes au plus par import"})
+
+        serializer = InventoryUpsertRowSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            errors = [
+                {'row': number, 'errors': row_errors}
+                for number, row_errors in enumerate(serializer.errors, 1) if row_errors
+            ]
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        created, updated, errors = upsert_inventories(serializer.validated_data, request.user)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created, 'updated': updated})
+
+class RetailPointInventoryView(ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     serializer_class = InventorySerializer
     permission_classes = [permissions.AllowAny]
+    conditional_fields = ('last_updated', 'product_format__updated_at')
+
+    def get_cache_namespaces(self):
+        # Les formats sont imbriqués : la réponse dépend aussi du catalogue
+        return [CATALOG, inventory_namespace(self.kwargs['retail_point_id'])]
 
     def get_queryset(self):
         retail_point_id = self.kwargs['retail_point_id']
         return Inventory.objects.filter(
             retail_point_id=retail_point_id,
             is_available=True
-        ).select_related('product_format')
+        ).select_related('product_format', 'retail_point').order_by('pk')
 
 class CartView(generics.RetrieveUpdateAPIView):
     serializer_class = CartSerializer
@@ -176,58 +345,51 @@ class CartItemView(generics.CreateAPIView, generics.DestroyAPIView):
         cart = Cart.objects.get(user=self.request.user)
         serializer.save(cart=cart)
 
+def with_order_items(queryset):
+    # Précharge les lignes et leur inventaire tels que les imbrique OrderSerializer
+    return queryset.prefetch_related(
+        Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related(
+                'inventory__product_format', 'inventory__retail_point'
+            ),
+        )
+    )
+
 class OrderListView(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     filterset_fields = ['status', 'retail_point']
 
     def get_queryset(self):
         user = self.request.user
         if user.user_type in ['RETAILER', 'WHOLESALER', 'SEMI_WHOLESALER']:
             # Pour les vendeurs: voir les commandes passées à eux
-            return Order.objects.filter(
-                items__inventory__retail_point__owner=user
-            ).distinct()
+            # (semi-jointure plutôt que DISTINCT : le tri reste porté par l'index)
+            queryset = Order.objects.filter(
+                pk__in=OrderItem.objects.filter(inventory__retail_point__owner=user).values('order_id')
+            )
         else:
             # Pour les acheteurs: voir leurs propres commandes
-            return Order.objects.filter(user=user)
+            queryset = Order.objects.filter(user=user)
+        return with_order_items(queryset)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # Relecture avec les lignes préchargées : la réponse reste à nombre de requêtes fixe
+        serializer = self.get_serializer(
+            with_order_items(Order.objects.all()).get(pk=serializer.instance.pk)
+        )
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_create(self, serializer):
         # Logique de création de commande depuis le panier
         cart = Cart.objects.get(user=self.request.user)
-        if not cart.items.exists():
-            raise ValidationError("Le panier est vide")
-
-        with transaction.atomic():
-            order = serializer.save(
-                user=self.request.user,
-                status='PENDING',
-                total_amount=0
-            )
-            
-            total_amount = 0
-            for item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    inventory=item.inventory,
-                    quantity=item.quantity,
-                    unit_price=item.inventory.price_override or item.inventory.product_format.base_price,
-                    total_price=item.quantity * (item.inventory.price_override or item.inventory.product_format.base_price)
-                )
-                total_amount += item.quantity * (item.inventory.price_override or item.inventory.product_format.base_price)
-                
-                # Mise à jour du stock
-                StockMovement.objects.create(
-                    inventory=item.inventory,
-                    movement_type='OUT',
-                    quantity=item.quantity,
-                    reference=f"Commande #{order.order_number}",
-                    created_by=self.request.user
-                )
-            
-            order.total_amount = total_amount
-            order.save()
-            cart.items.all().delete()
+        serializer.instance = checkout_cart(cart, self.request.user, **serializer.validated_data)
 
 class OrderDetailView(generics.RetrieveUpdateAPIView):
     serializer_class = OrderSerializer
@@ -236,59 +398,85 @@ class OrderDetailView(generics.RetrieveUpdateAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.user_type in ['RETAILER', 'WHOLESALER', 'SEMI_WHOLESALER']:
-            return Order.objects.filter(
+            queryset = Order.objects.filter(
                 items__inventory__retail_point__owner=user
             ).distinct()
         else:
-            return Order.objects.filter(user=user)
+            queryset = Order.objects.filter(user=user)
+        return with_order_items(queryset)
 
 
 class TokenTransactionView(generics.ListCreateAPIView):
     serializer_class = TokenTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return TokenTransaction.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
         user = self.request.user
-        amount = serializer.validated_data['amount']
-        
-        with transaction.atomic():
-            if serializer.validated_data['transaction_type'] == 'DEPOSIT':
-                user.token_balance += amount
-            elif serializer.validated_data['transaction_type'] == 'WITHDRAWAL':
-                if user.token_balance < amount:
-                    raise serializers.ValidationError("Solde insuffisant")
-                user.token_balance -= amount
-            
-            user.save()
-            serializer.save(user=user)
+        data = serializer.validated_data
+        transaction_type = data['transaction_type']
+
+        if transaction_type == 'REFUND':
+            raise PermissionDenied("Les remboursements sont émis à l'annulation de la commande")
+        if transaction_type == 'ORDER_PAYMENT':
+            order = Order.objects.filter(user=user, order_number=data.get('reference')).first()
+            if order is None:
+                raise ValidationError({'reference': "Commande introuvable"})
+            if data['amount'] != order.total_amount:
+                raise ValidationError({'amount': f"Le montant de la commande est {order.total_amount}"})
+            serializer.instance = pay_order(order)
+        else:
+            serializer.instance = record(user.pk, transaction_type, data['amount'], data.get('reference'))
+        user.token_balance = serializer.instance.balance_after
 
 class NotificationListView(generics.ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user).order_by('-created_at')
 
 class MarkNotificationAsReadView(generics.UpdateAPIView):
-    queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ['patch']
 
+    def get_queryset(self):
+        return Notification.objects.filter(user=self.request.user)
+
     def perform_update(self, serializer):
+        mark_read(self.request.user.pk, [serializer.instance.pk])
         serializer.save(is_read=True)
 
+class MarkAllNotificationsAsReadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Un seul UPDATE ; {"ids": [...]} restreint aux notifications indiquées
+    def post(self, request):
+        ids = request.data.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids)):
+            raise ValidationError({'ids': "Liste d'identifiants attendue"})
+        return Response({'updated': mark_read(request.user.pk, ids)})
 
-class ProductFormatListView(generics.ListAPIView):
-    queryset = ProductFormat.objects.all()
+class UnreadNotificationCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Le compteur est sur la ligne utilisateur déjà chargée par l'authentification
+    def get(self, request):
+        return Response({'unread': request.user.unread_notifications})
+
+
+class ProductFormatListView(ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
+    queryset = ProductFormat.objects.order_by('pk')
     serializer_class = ProductFormatSerializer
     permission_classes = [permissions.AllowAny]
     filterset_fields = ['product', 'is_active']
 
-class ProductFormatDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ProductFormatDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = ProductFormat.objects.all()
     serializer_class = ProductFormatSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -383,6 +571,11 @@ class ProductFormatImageListCreateView(generics.ListCreateAPIView):
         serializer.save(format=product_format)
 
 
+def with_dispute_relations(queryset):
+    return queryset.select_related('created_by', 'assigned_to').prefetch_related(
+        Prefetch('messages', queryset=DisputeMessage.objects.select_related('sender'))
+    )
+
 class DisputeListView(generics.ListCreateAPIView):
     serializer_class = DisputeSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -391,8 +584,10 @@ class DisputeListView(generics.ListCreateAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.user_type in ['ADMIN', 'STAFF']:
-            return Dispute.objects.all()
-        return Dispute.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+            queryset = Dispute.objects.all()
+        else:
+            queryset = Dispute.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+        return with_dispute_relations(queryset)
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -405,8 +600,10 @@ class DisputeDetailView(generics.RetrieveUpdateAPIView):
     def get_queryset(self):
         user = self.request.user
         if user.user_type in ['ADMIN', 'STAFF']:
-            return Dispute.objects.all()
-        return Dispute.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+            queryset = Dispute.objects.all()
+        else:
+            queryset = Dispute.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+        return with_dispute_relations(queryset)
 
 class DisputeMessageCreateView(generics.CreateAPIView):
     queryset = DisputeMessage.objects.all()
@@ -438,9 +635,19 @@ class ReportViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def generate(self, request, pk=None):
         report = self.get_object()
-        # Ici vous intégrerez la logique de génération du rapport
-        # avec les librairies comme ReportLab (PDF) ou pandas (Excel)
-        return Response({"status": "Report generation started"}, status=202)
+        if report.report_type == 'USER' and not request.user.is_staff:
+            raise PermissionDenied("Rapport réservé aux administrateurs")
+        # Rapports antérieurs à la validation des filtres : refusés ici plutôt qu'en échec dans le worker
+        try:
+            parse_filters(report.filters)
+        except ValidationError as exc:
+            raise ValidationError({'filters': exc.detail})
+        # Le calcul s'exécute dans le pool de workers ; le client suit status/progress
+        reused = False
+        # Un rapport en file ou en cours n'est relancé que si son worker l'a abandonné
+        if report.status not in ACTIVE_STATUSES or is_stale(report):
+            reused = request_generation(report)
+        return Response(self.get_serializer(report).data, status=200 if reused else 202)
 
 class DashboardViewSet(viewsets.ModelViewSet):
     serializer_class = DashboardSerializer
@@ -452,14 +659,24 @@ class DashboardViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=True, methods=['get'], url_path='render', url_name='render')
+    def render_widgets(self, request, pk=None):
+        """Données de tous les widgets en un aller-retour (voir core/widgets.py)."""
+        return Response(render_dashboard(self.get_object(), request.user))
+
 
 # views.py
 class AdminStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
     def get(self, request):
         data = {
             "total_users": User.objects.count(),
             "active_orders": Order.objects.filter(status="PROCESSING").count(),
-            "monthly_sales": Order.objects.aggregate(total=Sum('total_amount'))
+            # Chiffre d'affaires net du mois, lu dans les agrégats quotidiens
+            "monthly_sales": DailySales.objects.filter(day__gte=timezone.localdate().replace(day=1)).aggregate(
+                total=Sum(F('revenue') - F('cancelled_revenue'), default=0)
+            )
         }
         return Response(data)
 
@@ -486,6 +703,8 @@ class AdminUserListView(generics.ListAPIView):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['user_type', 'is_active', 'date_joined']
     renderer_classes = [JSONRenderer]  # Force le rendu JSON
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-date_joined', '-id')
     
     def get_queryset(self):
         return User.objects.all().order_by('-date_joined')
@@ -493,52 +712,54 @@ class AdminUserListView(generics.ListAPIView):
 
 # core/views.py
 class BulkProductUpdateView(APIView):
+    """Mise à jour en masse : liste de produits, ou {"products": [...], "formats": [...]}."""
     permission_classes = [IsAdminUser]
-    
+    max_rows = 10000
+
     def patch(self, request):
-        serializer = BulkProductUpdateSerializer(data=request.data, many=True)
-        if serializer.is_valid():
-            updates = []
-            for item in serializer.validated_data:
-                product = Product.objects.get(id=item['id'])
-                for attr, value in item.items():
-                    if attr != 'id':
-                        setattr(product, attr, value)
-                product.save()
-                updates.append(product)
-            return Response(ProductSerializer(updates, many=True).data)
-        return Response(serializer.errors, status=400)
+        data = request.data
+        products, formats = (data.get('products', []), data.get('formats', [])) if isinstance(data, dict) else (data, [])
+        if not isinstance(products, list) or not isinstance(formats, list):
+            raise ValidationError("Listes de produits et de formats attendues")
+        if len(products) + len(formats) > self.max_rows:
+            raise ValidationError(f"{self.max_rows} lignes au plus par requête")
+
+        product_serializer = BulkProductUpdateSerializer(data=products, many=True)
+        format_serializer = BulkProductFormatUpdateSerializer(data=formats, many=True)
+        errors = {}
+        if not product_serializer.is_valid():
+            errors['products'] = product_serializer.errors
+        if not format_serializer.is_valid():
+            errors['formats'] = format_serializer.errors
+        if errors:
+            return Response(errors, status=400)
+        return Response(bulk_update_catalog(product_serializer.validated_data, format_serializer.validated_data))
 
 # core/views.py
-import pandas as pd
-
 class OrderExportView(APIView):
     permission_classes = [IsAdminUser]
-    
+
+    def perform_content_negotiation(self, request, force=False):
+        # `format` désigne ici le format d'export (csv/excel), pas un rendu DRF
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request):
-        queryset = Order.objects.all().select_related('user')
-        data = [{
-            'ID': order.id,
-            'Client': order.user.email,
-            'Montant': order.total_amount,
-            'Statut': order.get_status_display(),
-            'Date': order.created_at
-        } for order in queryset]
-        
-        format = request.query_params.get('format', 'csv')
-        
-        if format == 'excel':
-            df = pd.DataFrame(data)
-            response = HttpResponse(content_type='application/vnd.ms-excel')
-            response['Content-Disposition'] = 'attachment; filename="commandes.xlsx"'
-            df.to_excel(response, index=False)
-        else:
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="commandes.csv"'
-            writer = csv.DictWriter(response, fieldnames=data[0].keys())
-            writer.writeheader()
-            writer.writerows(data)
-            
+        filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        with_items = request.query_params.get('items') in ('1', 'true', 'True')
+        header, rows = order_export(filterset.qs, with_items=with_items)
+
+        if request.query_params.get('format', 'csv') == 'excel':
+            return FileExportResponse(
+                write_xlsx(header, rows),
+                as_attachment=True,
+                filename='commandes.xlsx',
+                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            )
+
+        response = StreamingExportResponse(stream_csv(header, rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="commandes.csv"'
         return response
 
 # core/views.py
@@ -550,43 +771,110 @@ class RetailPointMapView(generics.ListAPIView):
         qs = super().get_queryset()
         if 'region' in self.request.query_params:
             qs = qs.filter(address__region=self.request.query_params['region'])
-        return qs.select_related('address')
+        return qs.select_related('address').order_by('pk')
+
+    def list(self, request, *args, **kwargs):
+        # ?zoom=&bbox=ouest,sud,est,nord : grappes agrégées (ou points au zoom fort)
+        if 'zoom' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            zoom = int(request.query_params['zoom'])
+        except ValueError:
+            raise ValidationError({'zoom': "Zoom invalide"})
+        if not 0 <= zoom <= 22:
+            raise ValidationError({'zoom': "Zoom invalide"})
+        bbox = (-180.0, -90.0, 180.0, 90.0)
+        if 'bbox' in request.query_params:
+            bbox = parse_bbox(request.query_params['bbox'])
+            if bbox is None:
+                raise ValidationError({'bbox': "Format attendu: ouest,sud,est,nord"})
+        region = request.query_params.get('region')
+
+        if zoom > CLUSTER_MAX_ZOOM:
+            points = self.get_serializer(points_in_bbox(bbox, region), many=True).data
+            return Response({'zoom': zoom, 'mode': 'points', 'points': points})
+        return Response({'zoom': zoom, 'mode': 'clusters', 'clusters': clusters_in_bbox(zoom, bbox, region)})
 
 
 from django.db.models import Count, Sum
 from rest_framework.decorators import permission_classes
 from rest_framework.permissions import IsAdminUser
 
+def sales_period(request, default_days):
+    """Premier jour de la période demandée par ?days= (jour courant inclus)."""
+    try:
+        days = int(request.query_params.get('days', default_days))
+    except ValueError:
+        raise ValidationError({'days': "Nombre de jours attendu"})
+    if not 1 <= days <= 366:
+        raise ValidationError({'days': "Entre 1 et 366 jours"})
+    return timezone.localdate() - timedelta(days=days - 1)
+
+
 class AdminDashboardView(APIView):
+    """Indicateurs de la plateforme ; les ventes sont lues dans les agrégats quotidiens (core/rollups.py)."""
     permission_classes = [IsAdminUser]
 
     def get(self, request):
+        since = sales_period(request, 7)
+        by_type = dict(User.objects.order_by().values_list('user_type').annotate(count=Count('id')))
+        orders = DailySales.objects.filter(day__gte=since)
+        products = DailyProductSales.objects.filter(day__gte=since)
         data = {
             "users": {
-                "total": User.objects.count(),
-                "by_type": dict(User.objects.values_list('user_type').annotate(count=Count('id')))
+                "total": sum(by_type.values()),
+                "by_type": by_type,
+            },
+            "sales": {
+                "since": since,
+                "totals": sales_totals(orders),
+                "daily": sales_breakdown(orders, 'day'),
+                "by_region": sales_breakdown(orders, 'region'),
+                "top_formats": sales_breakdown(
+                    products, 'product_format_id', 'product_format__name', 'product_format__product__name', limit=10,
+                ),
             },
-            "orders": {
-                "last_7_days": Order.objects.filter(
-                    created_at__gte=timezone.now()-timedelta(days=7)
-                    .aggregate(total=Sum('total_amount')))
-            }
         }
         return Response(data)
 
 
-import csv
-from django.http import HttpResponse
+class ManufacturerSalesView(APIView):
+    """Ventes des produits du fabricant connecté (ou de ?manufacturer= pour l'équipe), par jour, région et format."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        if user.is_staff and 'manufacturer' in request.query_params:
+            manufacturer_id = request.query_params['manufacturer']
+            if not manufacturer_id.isdigit():
+                raise ValidationError({'manufacturer': "Identifiant attendu"})
+        elif user.user_type == 'MANUFACTURER':
+            manufacturer_id = user.pk
+        else:
+            raise PermissionDenied("Réservé aux fabricants")
+        since = sales_period(request, 30)
+        rollups = DailyProductSales.objects.filter(manufacturer_id=manufacturer_id, day__gte=since)
+        return Response({
+            "since": since,
+            "totals": sales_totals(rollups),
+            "daily": sales_breakdown(rollups, 'day'),
+            "by_region": sales_breakdown(rollups, 'region'),
+            "by_format": sales_breakdown(
+                rollups, 'product_format_id', 'product_format__name', 'product_format__product__name', limit=50,
+            ),
+        })
+
 
 class ExportOrdersView(APIView):
     def get(self, request):
-        response = HttpResponse(content_type='text/csv')
+        rows = (
+            Order.objects.order_by('pk')
+            .values_list('id', 'user__email', 'total_amount', 'status')
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        response = StreamingExportResponse(
+            stream_csv(['ID', 'User', 'Amount', 'Status'], rows), content_type='text/csv'
+        )
         response['Content-Disposition'] = 'attachment; filename="orders.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'User', 'Amount', 'Status'])
-        
-        for order in Order.objects.all().select_related('user'):
-            writer.writerow([order.id, order.user.email, order.total_amount, order.status])
-        
-        return response
\ No newline at end of file
+        return response
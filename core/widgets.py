@@ -0,0 +1,293 @@
+import hashlib
+import json
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import DailyProductSales, DailySales, Inventory, Order
+from .reports import SELLER_TYPES, report_scope
+
+WIDGET_TYPES = ('kpi', 'timeseries', 'top', 'breakdown')
+MAX_WIDGETS = 24
+DEFAULT_DAYS, MAX_DAYS = 30, 366
+DEFAULT_LIMIT, MAX_LIMIT = 5, 50
+# Durée de cache par type de widget (secondes), surchargeable par widget avec "ttl"
+DEFAULT_TTL = {'kpi': 60, 'timeseries': 300, 'top': 300, 'breakdown': 300}
+MIN_TTL, MAX_TTL = 10, 3600
+
+
+# --- Sources : périmètre selon le profil, mesures et axes de regroupement ---
+
+def _sales(user):
+    rows = DailySales.objects.all()
+    if user.is_staff:
+        return rows
+    if user.user_type in SELLER_TYPES:
+        return rows.filter(retail_point__owner=user)
+    return None
+
+
+def _product_sales(user):
+    rows = DailyProductSales.objects.all()
+    if user.is_staff:
+        return rows
+    if user.user_type in SELLER_TYPES:
+        return rows.filter(retail_point__owner=user)
+    if user.user_type == 'MANUFACTURER':
+        return rows.filter(manufacturer=user)
+    return None
+
+
+def _inventory(user):
+    inventories = Inventory.objects.all()
+    if user.is_staff:
+        return inventories
+    if user.user_type in SELLER_TYPES:
+        return inventories.filter(retail_point__owner=user)
+    if user.user_type == 'MANUFACTURER':
+        return inventories.filter(product_format__product__manufacturer=user)
+    return None
+
+
+def _orders(user):
+    # Commandes passées par l'utilisateur lui-même, quel que soit son profil
+    return Order.objects.filter(user=user)
+
+
+RETAIL_POINT = ('retail_point_id', 'retail_point__name')
+PRODUCT_FORMAT = ('product_format_id', 'product_format__name', 'product_format__product__name')
+
+SOURCES = {
+    'sales': {
+        'rows': _sales,
+        'day': 'day',
+        'metrics': {
+            'orders': Sum('orders', default=0),
+            'revenue': Sum('revenue', default=0),
+            'cancelled_orders': Sum('cancelled_orders', default=0),
+            'cancelled_revenue': Sum('cancelled_revenue', default=0),
+            'net_revenue': Sum(F('revenue') - F('cancelled_revenue'), default=0),
+        },
+        'dimensions': {'region': ('region',), 'retail_point': RETAIL_POINT},
+    },
+    'product_sales': {
+        'rows': _product_sales,
+        'day': 'day',
+        'metrics': {
+            'order_lines': Sum('order_lines', default=0),
+            'units': Sum('units', default=0),
+            'revenue': Sum('revenue', default=0),
+            'cancelled_units': Sum('cancelled_units', default=0),
+            'net_revenue': Sum(F('revenue') - F('cancelled_revenue'), default=0),
+        },
+        'dimensions': {
+            'region': ('region',), 'retail_point': RETAIL_POINT, 'product_format': PRODUCT_FORMAT,
+            'manufacturer': ('manufacturer_id', 'manufacturer__username'),
+        },
+    },
+    'inventory': {
+        'rows': _inventory,
+        'day': None,
+        'metrics': {
+            'references': Count('id'),
+            'stock': Sum('current_stock', default=0),
+            'low_stock': Count('id', filter=Q(low_stock_since__isnull=False)),
+            'unavailable': Count('id', filter=Q(is_available=False)),
+        },
+        'dimensions': {
+            'region': ('retail_point__address__region',), 'retail_point': RETAIL_POINT,
+            'product_format': PRODUCT_FORMAT,
+        },
+    },
+    'orders': {
+        'rows': _orders,
+        # Périmètre propre à chaque utilisateur, administrateurs compris
+        'per_user': True,
+        'day': 'created_at',
+        'metrics': {
+            'orders': Count('id'),
+            'spent': Sum('total_amount', default=0),
+            'cancelled': Count('id', filter=Q(status='CANCELLED')),
+        },
+        'dimensions': {'status': ('status',), 'retail_point': RETAIL_POINT},
+    },
+}
+
+
+# --- Lecture de la configuration ---
+
+def _int_option(config, name, default, low, high):
+    value = config.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise serializers.ValidationError(f"{name} : entier entre {low} et {high} attendu")
+    return value
+
+
+def parse_widget(config, index):
+    """Normalise la configuration d'un widget ; lève ValidationError si elle est inexploitable."""
+    if not isinstance(config, dict):
+        raise serializers.ValidationError("Objet attendu")
+    kind, name = config.get('type'), config.get('source')
+    if kind not in WIDGET_TYPES:
+        raise serializers.ValidationError(f"type : {', '.join(WIDGET_TYPES)}")
+    if name not in SOURCES:
+        raise serializers.ValidationError(f"source : {', '.join(SOURCES)}")
+    source = SOURCES[name]
+
+    metrics = config.get('metrics', [config['metric']] if 'metric' in config else None)
+    if not metrics or not isinstance(metrics, list) or any(metric not in source['metrics'] for metric in metrics):
+        raise serializers.ValidationError(f"metric : {', '.join(source['metrics'])}")
+    if kind == 'top' and len(metrics) != 1:
+        raise serializers.ValidationError("Un widget top est classé sur une seule mesure")
+
+    widget = {
+        'id': str(config.get('id', index)),
+        'type': kind,
+        'source': name,
+        'metrics': sorted(set(metrics)),
+        'days': _int_option(config, 'days', DEFAULT_DAYS, 1, MAX_DAYS) if source['day'] else None,
+        'ttl': _int_option(config, 'ttl', DEFAULT_TTL[kind], MIN_TTL, MAX_TTL),
+        'by': None,
+        'limit': None,
+    }
+    if kind == 'timeseries' and not source['day']:
+        raise serializers.ValidationError(f"La source {name} n'a pas de dimension temporelle")
+    if kind in ('top', 'breakdown'):
+        widget['by'] = config.get('by')
+        if widget['by'] not in source['dimensions']:
+            raise serializers.ValidationError(f"by : {', '.join(source['dimensions'])}")
+    if kind == 'top':
+        widget['limit'] = _int_option(config, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    return widget
+
+
+def parse_widgets(widgets):
+    if not isinstance(widgets, list):
+        raise serializers.ValidationError("Liste de widgets attendue")
+    if len(widgets) > MAX_WIDGETS:
+        raise serializers.ValidationError(f"{MAX_WIDGETS} widgets au plus")
+    errors = {}
+    for index, config in enumerate(widgets):
+        try:
+            parse_widget(config, index)
+        except serializers.ValidationError as exc:
+            errors[index] = exc.detail
+    if errors:
+        raise serializers.ValidationError(errors)
+    return widgets
+
+
+# --- Évaluation groupée ---
+
+def _group_key(widget):
+    # Widgets d'une même source, période et forme : une seule requête d'agrégat
+    shape = 'kpi' if widget['type'] == 'kpi' else 'day' if widget['type'] == 'timeseries' else widget['by']
+    return widget['source'], widget['days'], shape
+
+
+def _base_rows(source, user, days):
+    rows = source['rows'](user)
+    if rows is None or days is None:
+        return rows
+    since = timezone.localdate() - timedelta(days=days - 1)
+    if source['day'] == 'day':
+        return rows.filter(day__gte=since)
+    return rows.filter(**{f"{source['day']}__gte": timezone.make_aware(datetime.combine(since, time.min))})
+
+
+def _evaluate(group, widgets, user):
+    name, days, shape = group
+    source = SOURCES[name]
+    rows = _base_rows(source, user, days)
+    if rows is None:
+        raise PermissionError("Source non disponible pour ce profil")
+    metrics = sorted({metric for widget in widgets for metric in widget['metrics']})
+    # Les alias préfixés évitent les collisions avec les champs du même nom (orders, revenue…)
+    aggregates = {f'm_{metric}': source['metrics'][metric] for metric in metrics}
+
+    if shape == 'kpi':
+        values = rows.aggregate(**aggregates)
+        return [{metric: values[f'm_{metric}'] for metric in widget['metrics']} for widget in widgets]
+
+    if shape == 'day':
+        fields = ('day',)
+        if source['day'] != 'day':
+            rows = rows.annotate(day=TruncDate(source['day']))
+        grouped = rows.values('day').annotate(**aggregates).order_by('day')
+    else:
+        fields = source['dimensions'][shape]
+        grouped = rows.values(*fields).annotate(**aggregates).order_by(*fields)
+        # Un seul classement demandé : tri et limite poussés dans la requête
+        if len(widgets) == 1 and widgets[0]['type'] == 'top':
+            grouped = grouped.order_by(f"-m_{widgets[0]['metrics'][0]}", *fields)[:widgets[0]['limit']]
+    grouped = list(grouped)
+
+    results = []
+    for widget in widgets:
+        data = [
+            {**{field: row[field] for field in fields}, **{metric: row[f'm_{metric}'] for metric in widget['metrics']}}
+            for row in grouped
+        ]
+        if widget['type'] in ('top', 'breakdown'):
+            data.sort(key=lambda row: row[widget['metrics'][0]], reverse=True)
+        if widget['type'] == 'top':
+            data = data[:widget['limit']]
+        results.append(data)
+    return results
+
+
+def cache_key(widget, user):
+    payload = {key: value for key, value in widget.items() if key not in ('id', 'ttl')}
+    scope = f'user:{user.pk}' if SOURCES[widget['source']].get('per_user') else report_scope(user)
+    payload.update(scope=scope, day=str(timezone.localdate()))
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f'widget:{digest}'
+
+
+def render_dashboard(dashboard, user):
+    """Résultats de tous les widgets du tableau de bord, en un appel.
+
+    Les résultats en cache sont lus en un aller-retour ; les widgets manquants
+    partageant source, période et forme sont calculés par une même requête,
+    puis mis en cache chacun avec sa propre durée. Un widget invalide ou hors
+    périmètre renvoie une erreur sans empêcher les autres.
+    """
+    widgets = dashboard.widgets if isinstance(dashboard.widgets, list) else []
+    results, parsed = [], []
+    for index, config in enumerate(widgets[:MAX_WIDGETS]):
+        try:
+            widget = parse_widget(config, index)
+        except serializers.ValidationError as exc:
+            results.append({'id': str(config.get('id', index)) if isinstance(config, dict) else str(index),
+                            'error': exc.detail})
+            continue
+        results.append({'id': widget['id'], 'type': widget['type'], 'source': widget['source']})
+        parsed.append((results[-1], widget, cache_key(widget, user)))
+
+    cached = cache.get_many([key for _, _, key in parsed])
+    groups = defaultdict(list)
+    for result, widget, key in parsed:
+        if key in cached:
+            result.update(data=cached[key], cached=True)
+        else:
+            groups[_group_key(widget)].append((result, widget, key))
+
+    fresh = defaultdict(dict)
+    for group, members in groups.items():
+        try:
+            values = _evaluate(group, [widget for _, widget, _ in members], user)
+        except PermissionError as exc:
+            for result, _, _ in members:
+                result['error'] = str(exc)
+            continue
+        for (result, widget, key), data in zip(members, values):
+            result.update(data=data, cached=False)
+            fresh[widget['ttl']][key] = data
+    for ttl, entries in fresh.items():
+        cache.set_many(entries, ttl)
+    return {'id': dashboard.pk, 'name': dashboard.name, 'widgets': results}
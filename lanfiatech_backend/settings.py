@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Third-party apps
     'rest_framework',
     'rest_framework.authtoken',
@@ -232,4 +233,11 @@ CACHES = {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://127.0.0.1:6379/1",
     }
-}
\ No newline at end of file
+}
+
+# Génération des rapports en arrière-plan
+REPORT_WORKERS = config('REPORT_WORKERS', default=2, cast=int)
+# Un rapport identique terminé depuis moins longtemps est réutilisé
+REPORT_REUSE_SECONDS = config('REPORT_REUSE_SECONDS', default=3600, cast=int)
+# Diffusion des événements temps réel entre processus ; memory:// pour un processus unique
+EVENT_BROKER_URL = config('EVENT_BROKER_URL', default='redis://127.0.0.1:6379/2')